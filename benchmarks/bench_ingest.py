@@ -0,0 +1,80 @@
+"""
+Ingest throughput comparison between the native and pyshark engines.
+
+Each engine ingests the same capture into its own temporary database; the
+resulting BLEPacket / BLEPacketUUID rows are then compared row by row.
+
+    python benchmarks/bench_ingest.py wireLogs/watch_capture.pcapng
+    python benchmarks/bench_ingest.py --synthetic 1000000 --engines native
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+from config import PCAP_FILE
+from utils.db_utils import init_db
+from logs_to_db import process_ble_packets_optimized, INGEST_ENGINES
+from synthetic import write_synthetic_capture
+
+
+def run_engine(engine, pcap_file, db_path, workers=1):
+    conn, cursor = init_db(db_path)
+    start = time.perf_counter()
+    packet_count = process_ble_packets_optimized(pcap_file, conn, cursor, engine=engine, workers=workers)
+    elapsed = time.perf_counter() - start
+    packets = conn.execute("""
+        SELECT timestamp, dmac, smac, rssi, distance, company_id, manufacturer_data, packet_hash
+        FROM BLEPacket ORDER BY id
+    """).fetchall()
+    uuids = conn.execute("""
+        SELECT ble_packet_id, uuid_type, uuid FROM BLEPacketUUID ORDER BY id
+    """).fetchall()
+    conn.close()
+    return packet_count, elapsed, packets, uuids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pcap_file', nargs='?', default=PCAP_FILE)
+    parser.add_argument('--synthetic', type=int, metavar='N', help="Generate a synthetic Nordic capture with N packets")
+    parser.add_argument('--engines', nargs='+', choices=INGEST_ENGINES, default=list(INGEST_ENGINES))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help="Native engine worker counts to time, e.g. --workers 1 4 16")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pcap_file = args.pcap_file
+        if args.synthetic:
+            pcap_file = write_synthetic_capture(os.path.join(tmp, 'synthetic.pcapng'), args.synthetic)
+        size_mb = os.path.getsize(pcap_file) / 1e6
+        print(f"📦 {pcap_file} ({size_mb:.1f} MB)")
+
+        results = {}
+        for engine in args.engines:
+            for workers in (args.workers if engine == 'native' else [1]):
+                label = f'{engine}/{workers}'
+                try:
+                    result = run_engine(engine, pcap_file, os.path.join(tmp, f'{engine}_{workers}.db'), workers)
+                except Exception as e:
+                    print(f"⚠️ {label}: {e}")
+                    continue
+                results.setdefault(engine, result)
+                packet_count, elapsed, _, _ = result
+                print(f"⏱️ {label:12s} {packet_count:>10d} packets  {elapsed:8.2f}s  "
+                      f"{packet_count / elapsed:>10.0f} pkt/s  {size_mb / elapsed:6.1f} MB/s")
+
+        if len(results) == 2:
+            native, reference = results['native'], results['pyshark']
+            same_packets = native[2] == reference[2]
+            same_uuids = native[3] == reference[3]
+            print(f"{'✅' if same_packets else '❌'} BLEPacket rows identical: {same_packets}")
+            print(f"{'✅' if same_uuids else '❌'} BLEPacketUUID rows identical: {same_uuids}")
+            print(f"🚀 Speedup: {reference[1] / native[1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
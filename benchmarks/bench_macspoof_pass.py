@@ -0,0 +1,73 @@
+"""
+macSpoof analysis: the separate sort/groupby steps vs. analyze_packets' single-sort pass.
+
+Loads the packets once, then runs both variants on the same frame and reports
+time, peak Python memory (excluding the frame itself) and whether every
+result table is identical.
+
+    python benchmarks/bench_macspoof_pass.py --db outputs/DB/Bledb.db
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+from config import DB_PATH
+import macSpoof
+
+
+def separate_steps(df):
+    fingerprint_counts, heuristic_stats = macSpoof.generate_statistics(df)
+    top_manufacturers = df['manufacturer_data'].value_counts().head(10).reset_index()
+    top_manufacturers.columns = ['manufacturer_data', 'count']
+    return {
+        'fingerprint_change_events': macSpoof.detect_fingerprint_changes(df),
+        'rssi_distance_anomalies': macSpoof.detect_rssi_distance_anomalies(df),
+        'fingerprint_counts': fingerprint_counts,
+        'heuristic_stats': heuristic_stats,
+        'hash_anomalies': macSpoof.detect_packet_hash_anomalies(df),
+        'top_manufacturers': top_manufacturers,
+    }
+
+
+def measured(fn, df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(df)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def identical(expected, actual):
+    try:
+        for name, frame in expected.items():
+            pd.testing.assert_frame_equal(frame.reset_index(drop=True), actual[name].reset_index(drop=True),
+                                          check_dtype=False, check_categorical=False)
+        return True
+    except AssertionError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    macSpoof.DB_PATH = args.db
+    df = macSpoof.generate_fingerprints(macSpoof.normalize_data(macSpoof.load_data()))
+    print(f"{len(df):,} packets, frame {df.memory_usage(deep=True).sum() / 2**20:.1f} MB")
+    expected, separate_time, separate_peak = measured(separate_steps, df)
+    actual, fused_time, fused_peak = measured(macSpoof.analyze_packets, df)
+    verdict = '✅ identical' if identical(expected, actual) else '❌ differs'
+    print(f"{'separate steps':16s} {separate_time:7.2f}s {separate_peak / 2**20:8.1f} MB")
+    print(f"{'analyze_packets':16s} {fused_time:7.2f}s {fused_peak / 2**20:8.1f} MB  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
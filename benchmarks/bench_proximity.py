@@ -0,0 +1,97 @@
+"""
+Proximity detection: n x n matrix reference vs. the sliding-window detector, on skewed devices.
+
+Packet counts per device follow a Zipf law (--skew), so one chatty device holds
+a large share of the rows; each device moves in bursts that cross the distance
+threshold. The matrix reference is skipped when its largest device exceeds
+--matrix-max-group packets (it needs ~17 bytes per pair of packets).
+
+    python benchmarks/bench_proximity.py --rows 100000 1000000 --skew 1.2
+    python benchmarks/bench_proximity.py --db outputs/DB/Bledb.db
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+from proximityAlert import (DISTANCE_THRESHOLD_M, load_distance_data, detect_proximity_anomalies_ultra_fast,
+                            detect_proximity_anomalies_matrix)
+from synthetic import START_TS_US
+
+
+def skewed_distance_frame(n_rows, n_devices=1000, skew=1.2, seed=42):
+    """n_rows packets over n_devices whose packet counts follow rank ** -skew."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, n_devices + 1) ** skew
+    counts = np.maximum(1, np.round(weights / weights.sum() * n_rows)).astype(int)
+    frames = []
+    for device, count in enumerate(counts):
+        # Gaps of ~10 ms to a few seconds; distance follows a random walk with occasional jumps
+        gaps = rng.exponential(rng.uniform(0.01, 2.0), count)
+        jumps = np.where(rng.random(count) < 0.002, rng.normal(0, 60, count), 0.0)
+        distance = np.abs(rng.uniform(1, 30) + np.cumsum(rng.normal(0, 0.3, count) + jumps))
+        frames.append(pd.DataFrame({
+            'timestamp': (START_TS_US + np.cumsum(gaps * 1e6).astype('int64')).astype('datetime64[us]'),
+            'smac': f'02:00:00:00:{device >> 8:02x}:{device & 0xFF:02x}',
+            'distance': np.round(distance, 2),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def measured(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run(label, df, threshold, matrix_max_group):
+    largest = int(df['smac'].value_counts().iloc[0])
+    pairs, window_time, window_peak = measured(lambda: detect_proximity_anomalies_ultra_fast(df, threshold))
+    line = (f"{label:>12s} {largest:>10,d} {len(pairs):>10,d} {window_time:9.2f} {window_peak / 2**20:9.1f}")
+    if largest <= matrix_max_group:
+        reference, matrix_time, matrix_peak = measured(lambda: detect_proximity_anomalies_matrix(df, threshold))
+        try:
+            pd.testing.assert_frame_equal(pd.DataFrame(reference), pd.DataFrame(pairs))
+            verdict = '✅ identical'
+        except AssertionError:
+            verdict = '❌ differs'
+        line += f" {matrix_time:9.2f} {matrix_peak / 2**20:10.1f}  {verdict}"
+    else:
+        line += f" {'skipped':>9s} {'':>10s}"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--skew', type=float, default=1.2, help="Zipf exponent of the packets per device")
+    parser.add_argument('--threshold', type=float, default=DISTANCE_THRESHOLD_M)
+    parser.add_argument('--db', help="Benchmark on a real database instead of synthetic frames")
+    parser.add_argument('--matrix-max-group', type=int, default=5000,
+                        help="Skip the matrix reference when a device has more packets than this")
+    args = parser.parse_args()
+
+    print(f"{'rows':>12s} {'largest':>10s} {'pairs':>10s} {'window s':>9s} {'window MB':>9s} "
+          f"{'matrix s':>9s} {'matrix MB':>10s}")
+    if args.db:
+        df = load_distance_data(args.db)
+        run(f'{len(df):,}', df, args.threshold, args.matrix_max_group)
+        return
+    for n_rows in args.rows:
+        df = skewed_distance_frame(n_rows, args.devices, args.skew)
+        run(f'{len(df):,}', df, args.threshold, args.matrix_max_group)
+        del df
+
+
+if __name__ == "__main__":
+    main()
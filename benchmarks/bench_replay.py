@@ -0,0 +1,86 @@
+"""
+Replay detection: per-hash groupby loop (reference) vs. the vectorized engine.
+
+Builds a synthetic packet frame shaped like load_packet_hash_data's output,
+times both implementations and checks that their alerts are identical.
+
+    python benchmarks/bench_replay.py --rows 1000000 10000000
+    python benchmarks/bench_replay.py --db outputs/DB/Bledb.db
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+from config import REPLAY_TIME_WINDOW_SEC
+from replayAttack import ALERT_COLUMNS, load_packet_hash_data, detect_replay_attacks, detect_replay_attacks_vectorized
+from synthetic import START_TS_US
+
+
+def synthetic_packet_frame(n_rows, rows_per_hash=2.0, n_devices=2000, seed=42):
+    """n_rows packets over n_rows / rows_per_hash distinct hashes, ~5 ms apart on average."""
+    rng = np.random.default_rng(seed)
+    n_hashes = max(1, int(n_rows / rows_per_hash))
+    hash_ids = rng.integers(0, n_hashes, n_rows)
+    macs = np.array([':'.join(f'{b:02x}' for b in rng.integers(0, 256, 6)) for _ in range(n_devices)], dtype=object)
+    rssi = rng.integers(-95, -35, n_rows)
+    return pd.DataFrame({
+        'timestamp': (START_TS_US + np.cumsum(rng.integers(200, 10000, n_rows))).astype('datetime64[us]'),
+        'dmac': 'ff:ff:ff:ff:ff:ff',
+        'smac': macs[rng.integers(0, n_devices, n_rows)],
+        'rssi': rssi,
+        'distance': np.round(10 ** ((-59 - rssi) / 20), 2),
+        'packet_hash': pd.Series(hash_ids).map('{:064x}'.format),
+    })
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def run(label, df, window, reference):
+    vectorized, vectorized_time = timed(lambda: detect_replay_attacks_vectorized(df, window))
+    line = f"{label:>14s} {df['packet_hash'].nunique():>12,d} {len(vectorized):>10,d} {vectorized_time:10.2f}"
+    if reference:
+        alerts, reference_time = timed(lambda: detect_replay_attacks(df, window))
+        try:
+            # An empty alert list carries no dtypes to compare
+            pd.testing.assert_frame_equal(pd.DataFrame(alerts, columns=ALERT_COLUMNS), vectorized,
+                                          check_dtype=bool(alerts), check_index_type=bool(alerts))
+            verdict = '✅ identical'
+        except AssertionError:
+            verdict = '❌ differs'
+        line += f" {reference_time:10.2f} {reference_time / vectorized_time:8.1f}x  {verdict}"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--rows-per-hash', type=float, default=2.0, help="Average packets per packet_hash")
+    parser.add_argument('--db', help="Benchmark on a real database instead of synthetic frames")
+    parser.add_argument('--window', type=float, default=REPLAY_TIME_WINDOW_SEC)
+    parser.add_argument('--reference-max-rows', type=int, default=None,
+                        help="Skip the (slow) reference implementation above this many rows")
+    args = parser.parse_args()
+
+    print(f"{'rows':>14s} {'hashes':>12s} {'alerts':>10s} {'vector s':>10s} {'loop s':>10s} {'speedup':>9s}")
+    if args.db:
+        df = load_packet_hash_data(args.db)
+        run(f'{len(df):,}', df, args.window, True)
+        return
+    for n_rows in args.rows:
+        df = synthetic_packet_frame(n_rows, args.rows_per_hash)
+        reference = args.reference_max_rows is None or n_rows <= args.reference_max_rows
+        run(f'{n_rows:,}', df, args.window, reference)
+        del df
+
+
+if __name__ == "__main__":
+    main()
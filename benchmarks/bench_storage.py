@@ -0,0 +1,140 @@
+"""
+Flat vs. normalized packet storage: file size, conversion time, load memory and a view scan.
+
+Builds a synthetic flat database (rows are generated directly, no capture decoding),
+copies it, converts the copy with normalize_packet_storage and compares the two.
+
+    python benchmarks/bench_storage.py --packets 10000000
+    python benchmarks/bench_storage.py --db outputs/DB/Bledb.db --memory-rows 1000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from config import DB_PATH
+from utils.db_utils import init_db, connect, normalize_packet_storage, PACKET_COLUMNS
+from utils.ble_utils import (BROADCAST_MAC, format_timestamp, rssi_to_distance, generate_packet_hash,
+                             generate_content_fingerprint, generate_payload_fingerprint)
+from synthetic import START_TS_US, generate_devices
+
+N_SENSORS = 4
+
+
+def device_fields(device):
+    mfr = device['manufacturer_data']
+    return {
+        'dmac': BROADCAST_MAC,
+        'uuids_16': ','.join(sorted(f'0x{u:04x}' for u in device['uuids_16'])),
+        'uuids_32': '',
+        'uuids_128': '',
+        'company_id': f"0x{device['company_id']:04x}",
+        'manufacturer_data': mfr.hex(':') if mfr else '',
+    }
+
+
+def iter_flat_rows(n_packets, n_devices, seed=42):
+    """Yield rows in PACKET_COLUMNS order, formatted as the ingester stores them."""
+    rng = random.Random(seed)
+    devices = []
+    for device in generate_devices(rng, n_devices):
+        fields = device_fields(device)
+        devices.append((device['mac'][::-1].hex(':'), device['rssi'], fields, generate_content_fingerprint(fields),
+                        generate_payload_fingerprint(fields)))
+    ts_us = START_TS_US
+    for i in range(n_packets):
+        ts_us += rng.randint(200, 5000)
+        smac, base_rssi, fields, fingerprint, payload_fingerprint = rng.choice(devices)
+        rssi = max(-127, min(-20, base_rssi + rng.randint(-8, 8)))
+        timestamp = format_timestamp(ts_us)
+        packet_hash = generate_packet_hash({**fields, 'timestamp': timestamp, 'rssi': rssi})
+        sensor = f'snif{i % N_SENSORS}'
+        yield (timestamp, BROADCAST_MAC, smac, rssi, rssi_to_distance(rssi), fields['company_id'],
+               fields['manufacturer_data'], packet_hash, fingerprint, payload_fingerprint, ts_us,
+               f'{sensor}_synthetic.pcapng', sensor)
+
+
+def build_flat_db(db_path, n_packets, n_devices, batch_size=100000):
+    conn, cursor = init_db(db_path, storage='flat')
+    sql = f"INSERT INTO BLEPacket ({', '.join(PACKET_COLUMNS)}) VALUES ({', '.join('?' * len(PACKET_COLUMNS))})"
+    rows = iter_flat_rows(n_packets, n_devices)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        cursor.executemany(sql, batch)
+        conn.commit()
+    conn.close()
+
+
+def frame_memory(conn, query):
+    df = pd.read_sql_query(query, conn)
+    return df.memory_usage(deep=True).sum()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def run(flat_db, normalized_db, memory_rows):
+    shutil.copyfile(flat_db, normalized_db)
+    conn = connect(normalized_db, 'bulk')
+    packets, convert_time = timed(lambda: normalize_packet_storage(conn))
+    conn.close()
+    print(f"📦 {packets:,} packets, normalized in {convert_time:.1f}s")
+
+    flat = connect(flat_db)
+    normalized = connect(normalized_db)
+    counts = {table: normalized.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('Device', 'Payload', 'CaptureSource')}
+    print("🔑 " + ", ".join(f"{table}: {count:,}" for table, count in counts.items()))
+
+    flat_size, normalized_size = os.path.getsize(flat_db), os.path.getsize(normalized_db)
+    print(f"{'':40s} {'flat':>12s} {'normalized':>12s}")
+    print(f"{'file size (MB)':40s} {flat_size / 2**20:12.1f} {normalized_size / 2**20:12.1f}"
+          f"  ({normalized_size / flat_size:.0%})")
+
+    limit = f"LIMIT {memory_rows}"
+    flat_mem = frame_memory(flat, f"SELECT * FROM BLEPacket ORDER BY id {limit}")
+    compact_mem = frame_memory(normalized, f"SELECT * FROM BLEPacketCompact ORDER BY id {limit}") + sum(
+        frame_memory(normalized, f"SELECT * FROM {table}") for table in counts)
+    print(f"{f'DataFrame memory, {memory_rows:,} rows (MB)':40s} {flat_mem / 2**20:12.1f} {compact_mem / 2**20:12.1f}"
+          f"  ({compact_mem / flat_mem:.0%}, ids + lookup tables)")
+
+    scan = "SELECT smac, COUNT(*), AVG(rssi) FROM BLEPacket GROUP BY smac"
+    flat_scan, flat_time = timed(lambda: flat.execute(scan).fetchall())
+    view_scan, view_time = timed(lambda: normalized.execute(scan).fetchall())
+    print(f"{'GROUP BY smac scan (s)':40s} {flat_time:12.2f} {view_time:12.2f}"
+          f"  {'✅ identical' if sorted(flat_scan) == sorted(view_scan) else '❌ differs'}")
+    flat.close()
+    normalized.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help=f"Existing flat database to compare (e.g. {DB_PATH}); it is copied, not modified")
+    parser.add_argument('--packets', type=int, default=10_000_000, help="Synthetic packets when --db is not given")
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--memory-rows', type=int, default=1_000_000,
+                        help="Rows loaded into pandas for the memory comparison")
+    parser.add_argument('--tmp', help="Directory for the working copies (default: system temp)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmp) as tmp:
+        flat_db = args.db
+        if not flat_db:
+            flat_db = os.path.join(tmp, 'flat.db')
+            _, build_time = timed(lambda: build_flat_db(flat_db, args.packets, args.devices))
+            print(f"🛠️ Synthetic flat database built in {build_time:.1f}s")
+        run(flat_db, os.path.join(tmp, 'normalized.db'), args.memory_rows)
+
+
+if __name__ == "__main__":
+    main()
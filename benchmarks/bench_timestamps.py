@@ -0,0 +1,76 @@
+"""
+Packet load time with text timestamps (pd.to_datetime) vs. integer timestamp_us.
+
+Builds a synthetic database (or uses an existing one), then times the SQL read
+and the datetime conversion separately for each variant the analyzers used.
+
+    python benchmarks/bench_timestamps.py --synthetic 1000000
+    python benchmarks/bench_timestamps.py --db outputs/DB/Bledb.db
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+from config import DB_PATH
+from utils.db_utils import init_db, connect
+from utils.time_utils import timestamp_us_to_datetime
+from logs_to_db import ingest_captures
+from synthetic import write_synthetic_capture
+
+TEXT_PARSERS = {
+    "to_datetime(errors='coerce')": lambda s: pd.to_datetime(s, errors='coerce'),
+    "to_datetime(format='mixed')": lambda s: pd.to_datetime(s, format='mixed', errors='coerce'),
+    "to_datetime(format='ISO8601')": lambda s: pd.to_datetime(s, format='ISO8601', errors='coerce'),
+}
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def build_synthetic_db(tmp, n_packets):
+    pcap_file = write_synthetic_capture(os.path.join(tmp, 'synthetic.pcapng'), n_packets)
+    db_path = os.path.join(tmp, 'synthetic.db')
+    conn, cursor = init_db(db_path)
+    ingest_captures([pcap_file], conn, cursor, workers=os.cpu_count() or 1)
+    conn.close()
+    return db_path
+
+
+def run(db_path):
+    conn = connect(db_path)
+    text, read_text = timed(lambda: pd.read_sql_query("SELECT timestamp FROM BLEPacket ORDER BY id", conn)['timestamp'])
+    ints, read_int = timed(lambda: pd.read_sql_query("SELECT timestamp_us FROM BLEPacket ORDER BY id", conn)['timestamp_us'])
+    conn.close()
+    print(f"📦 {len(text):,} packets")
+
+    converted, convert_int = timed(lambda: timestamp_us_to_datetime(ints))
+    print(f"{'variant':34s} {'read':>8s} {'convert':>8s} {'total':>8s}")
+    for name, parser in TEXT_PARSERS.items():
+        parsed, convert_text = timed(lambda: parser(text))
+        same = parsed.astype('datetime64[us]').equals(converted)
+        print(f"{name:34s} {read_text:8.2f} {convert_text:8.2f} {read_text + convert_text:8.2f}"
+              f"  {'✅ identical' if same else '❌ differs'}")
+    print(f"{'timestamp_us astype(datetime64[us])':34s} {read_int:8.2f} {convert_int:8.2f} {read_int + convert_int:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--synthetic', type=int, metavar='N', help="Ingest a synthetic capture with N packets")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = build_synthetic_db(tmp, args.synthetic) if args.synthetic else args.db
+        run(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Analysis frames as plain read_sql_query strings vs. read_packet_frame's categorical / string[pyarrow] columns.
+
+For every packet loader, reads the same query both ways and reports bytes per
+row of the resulting frame (deep), peak Python memory while loading, and time.
+The plain variant includes the .str.lower() the loaders used to run. The
+'object' rows force object strings (the pandas < 3 default).
+
+    python benchmarks/bench_typed_frames.py --db outputs/DB/Bledb.db
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from config import DB_PATH
+from utils.db_utils import connect
+from utils.frame_utils import read_packet_frame
+from utils.time_utils import timestamp_us_to_datetime
+
+LOADERS = {
+    'macSpoof': """
+        SELECT id, timestamp_us AS timestamp, dmac, smac, rssi, distance, company_id, manufacturer_data,
+               packet_hash, payload_fingerprint AS fingerprint
+        FROM BLEPacket""",
+    'proximityAlert': """
+        SELECT timestamp_us AS timestamp, smac, distance FROM BLEPacket
+        WHERE distance IS NOT NULL ORDER BY smac, timestamp_us""",
+    'replayAttack / dashboard': """
+        SELECT timestamp_us AS timestamp, dmac, smac, rssi, distance, packet_hash
+        FROM BLEPacket ORDER BY timestamp_us""",
+    'visualize_mac_spoofing': """
+        SELECT BLEPacket.id, BLEPacket.timestamp_us AS timestamp, BLEPacket.dmac, BLEPacket.smac,
+               BLEPacket.company_id, BLEPacket.manufacturer_data, BLEPacketUUID.uuid_type, BLEPacketUUID.uuid
+        FROM BLEPacket LEFT JOIN BLEPacketUUID ON BLEPacket.id = BLEPacketUUID.ble_packet_id""",
+}
+
+
+def plain_frame(conn, sql):
+    df = pd.read_sql_query(sql, conn)
+    df['timestamp'] = timestamp_us_to_datetime(df['timestamp'])
+    for column in ('smac', 'dmac'):
+        if column in df.columns:
+            df[column] = df[column].str.lower()
+    return df
+
+
+def object_frame(conn, sql):
+    with pd.option_context('future.infer_string', False):
+        return plain_frame(conn, sql)
+
+
+def measured(fn, conn, sql):
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = fn(conn, sql)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--loaders', nargs='+', choices=LOADERS, default=list(LOADERS))
+    args = parser.parse_args()
+
+    variants = {'plain': plain_frame, 'typed': read_packet_frame}
+    try:
+        if pd.get_option('future.infer_string'):
+            variants = {'object': object_frame, **variants}
+    except KeyError:
+        pass
+
+    conn = connect(args.db)
+    print(f"{'loader':26s} {'variant':8s} {'rows':>10s} {'B/row':>7s} {'frame MB':>9s} {'peak MB':>8s} {'s':>6s}")
+    for name in args.loaders:
+        for variant, fn in variants.items():
+            df, elapsed, peak = measured(fn, conn, LOADERS[name])
+            size = df.memory_usage(deep=True).sum()
+            print(f"{name:26s} {variant:8s} {len(df):>10,d} {size / max(len(df), 1):7.1f} {size / 2**20:9.1f} "
+                  f"{peak / 2**20:8.1f} {elapsed:6.2f}", flush=True)
+            del df
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
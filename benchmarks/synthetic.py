@@ -0,0 +1,84 @@
+"""
+Synthetic BLE data generators shared by the benchmark scripts.
+"""
+
+import random
+import struct
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.ble_utils import LINKTYPE_NORDIC_BLE, ADVERTISING_ACCESS_ADDRESS, ADV_IND, ADV_NONCONN_IND, SCAN_REQ
+from utils.pcapng_utils import write_pcapng
+
+START_TS_US = 1_748_260_800_000_000  # 2025-05-26 12:00:00 UTC
+
+
+def random_mac(rng):
+    return bytes(rng.getrandbits(8) for _ in range(6))
+
+
+def build_ad_data(rng, uuids_16=(), uuids_128=(), company_id=None, manufacturer_data=b''):
+    ad = b'\x02\x01\x06'
+    if uuids_16:
+        body = b''.join(struct.pack('<H', u) for u in uuids_16)
+        ad += bytes([1 + len(body), 0x03]) + body
+    for u in uuids_128:
+        ad += bytes([17, 0x07]) + u
+    if company_id is not None:
+        body = struct.pack('<H', company_id) + manufacturer_data
+        ad += bytes([1 + len(body), 0xFF]) + body
+    return ad
+
+
+def build_nordic_frame(pdu_type, payload, rssi, channel=37, protover=3):
+    """Wrap a link-layer advertising PDU in an nRF Sniffer (LINKTYPE_NORDIC_BLE) header."""
+    ll = struct.pack('<IBB', ADVERTISING_ACCESS_ADDRESS, pdu_type, len(payload)) + payload + b'\x00\x00\x00'
+    event = bytes([0x01, channel, -rssi & 0xFF]) + struct.pack('<HI', 0, 0)
+    if protover < 3:
+        event = bytes([10]) + event
+    body = event + ll
+    header = struct.pack('<HBHB', len(body), protover, 0, 0x02)
+    return bytes([0]) + header + body
+
+
+def generate_devices(rng, n_devices):
+    devices = []
+    for _ in range(n_devices):
+        devices.append({
+            'mac': random_mac(rng),
+            'uuids_16': tuple(rng.sample(range(0xFD00, 0xFEFF), rng.randint(1, 3))),
+            'uuids_128': (rng.randbytes(16),) if rng.random() < 0.2 else (),
+            'company_id': rng.choice((0x0006, 0x004C, 0x0075, 0x00E0)),
+            'manufacturer_data': rng.randbytes(rng.randint(4, 24)),
+            'rssi': rng.randint(-95, -35),
+        })
+    return devices
+
+
+def iter_synthetic_frames(n_packets, n_devices=500, seed=42, replay_fraction=0.01):
+    """Yield (ts_us, frame) tuples; a small fraction are scan requests or replays."""
+    rng = random.Random(seed)
+    devices = generate_devices(rng, n_devices)
+    ts_us = START_TS_US
+    last_frame = None
+    for _ in range(n_packets):
+        ts_us += rng.randint(200, 5000)
+        if last_frame is not None and rng.random() < replay_fraction:
+            yield ts_us, last_frame
+            continue
+        device = rng.choice(devices)
+        rssi = max(-127, min(-20, device['rssi'] + rng.randint(-8, 8)))
+        if rng.random() < 0.02:
+            payload = random_mac(rng) + device['mac']
+            frame = build_nordic_frame(SCAN_REQ, payload, rssi)
+        else:
+            ad = build_ad_data(rng, device['uuids_16'], device['uuids_128'],
+                               device['company_id'], device['manufacturer_data'])
+            frame = build_nordic_frame(rng.choice((ADV_IND, ADV_NONCONN_IND)), device['mac'] + ad, rssi)
+        last_frame = frame
+        yield ts_us, frame
+
+
+def write_synthetic_capture(path, n_packets, n_devices=500, seed=42):
+    write_pcapng(path, iter_synthetic_frames(n_packets, n_devices, seed), LINKTYPE_NORDIC_BLE)
+    return path
@@ -11,6 +11,65 @@ DOCS_DIR = os.path.join(OUTPUT_DIR, 'Docs')
 FOTOS_DIR = os.path.join(OUTPUT_DIR, 'images')
 PCAP_FILE = os.path.join('wireLogs', 'watch_capture.pcapng')
 
+# === Database ===
+# Packet layout for new databases: 'flat' = one BLEPacket table with every text column,
+# 'normalized' = BLEPacketCompact + Device/Payload/CaptureSource lookups behind a BLEPacket view
+PACKET_STORAGE = 'flat'
+# Connection tuning applied by utils.db_utils.connect()
+SQLITE_CACHE_MB = 256
+SQLITE_MMAP_MB = 1024
+SQLITE_BUSY_TIMEOUT_SEC = 30
+# Bulk-load profile: 'NORMAL' (WAL) only risks the last commits on power loss, 'OFF' skips fsync entirely
+SQLITE_BULK_SYNCHRONOUS = 'NORMAL'
+# True keeps the database locked for the whole load (no readers until the writer closes)
+SQLITE_BULK_EXCLUSIVE = False
+
+# === Ingest ===
+# 'native' = built-in pcapng reader + Nordic BLE decoder, 'pyshark' = tshark via pyshark
+INGEST_ENGINE = 'native'
+# Decoder processes for the native engine and the size of the block-aligned chunk each one handles
+INGEST_WORKERS = os.cpu_count() or 1
+INGEST_CHUNK_BYTES = 32 * 1024 * 1024
+# Leading bytes hashed to recognise a capture file across re-runs and appends
+INGEST_IDENTITY_BYTES = 1024 * 1024
+# Files picked up when a directory is given to the ingester
+INGEST_FILE_PATTERNS = ('*.pcapng', '*.pcap')
+# Sensor id taken from the capture file name (the 'sensor' group); falls back to the file stem
+SENSOR_ID_PATTERN = r'^(?P<sensor>[^_.]+)_'
+# Drop the secondary packet indexes during a load and rebuild them in one pass afterwards:
+# True, False or 'auto' (defer when the bytes to read reach INGEST_DEFER_INDEX_RATIO x the database size)
+INGEST_DEFER_INDEXES = 'auto'
+INGEST_DEFER_INDEX_RATIO = 0.1
+# Flag replays while ingesting (ReplayAlerts), with state for REPLAY_TIME_WINDOW_SEC + REPLAY_REORDER_SEC only
+INGEST_REPLAY_DETECTION = True
+# How far a packet may arrive behind the newest one and still be checked in memory; fingerprints
+# of later packets (e.g. an older capture ingested after a newer one) are recomputed from the database
+REPLAY_REORDER_SEC = 10
+# Keep the MAC identity clusters (IdentityCluster) up to date with every ingest commit
+INGEST_IDENTITY_CLUSTERS = True
+# Keep the per-device aggregates (DeviceStats) up to date with every ingest commit
+INGEST_DEVICE_STATS = True
+
+# === Detectors ===
+# Where each detector runs: 'pandas' loads the packets into a DataFrame, 'sql' computes the
+# per-group LAG()/diff inside SQLite with window functions and fetches only the alert rows
+DETECTOR_BACKENDS = {
+    'replay': 'pandas',
+    'proximity': 'pandas',
+    'fingerprint_changes': 'pandas',
+    'rssi_distance': 'pandas',
+}
+
+# === Pipeline (run_all_with_viz.py) ===
+# Threads for the stages whose dependencies are done (the three detectors run side by side)
+PIPELINE_WORKERS = 3
+# Inputs / output hashes of each stage's last run; a stage whose inputs are unchanged is skipped
+PIPELINE_MANIFEST = os.path.join(OUTPUT_DIR, 'pipeline_manifest.json')
+# Per-stage wall / CPU time, peak RSS, rows and I/O of the last run (JSON)
+PIPELINE_REPORT = os.path.join(OUTPUT_DIR, 'pipeline_report.json')
+# Where --profile writes one cProfile stats file per stage (<stage>.prof)
+PIPELINE_PROFILE_DIR = os.path.join(OUTPUT_DIR, 'profiles')
+
 # Ensure output directories exist (optional helper)
 def ensure_output_dirs():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
@@ -18,9 +77,20 @@ def ensure_output_dirs():
     os.makedirs(FOTOS_DIR, exist_ok=True)
     
 REPLAY_TIME_WINDOW_SEC = 5
+# Bounded-memory replay scan (replayAttack.py --source bloom): distinct fingerprints expected per
+# window and the Bloom filters' false-positive rate; candidates are confirmed against the database
+REPLAY_BLOOM_CAPACITY = 1_000_000
+REPLAY_BLOOM_FP_RATE = 0.01
 # === BLE Distance Estimation Parameters ===
 RSSI_REFERENCE = -59  # Measured RSSI at 1 meter
 ENVIRONMENTAL_FACTOR = 2  # Path-loss exponent (1.6–3.3 typical)
+# Per-company (company_id as stored, e.g. '0x004c') and per-device (smac) overrides of
+# (RSSI_REFERENCE, ENVIRONMENTAL_FACTOR); keys are lower-case and a device entry wins over its company's.
+# Apply to an existing database with: python scripts/dbMaintenance.py recompute-distance
+DISTANCE_CALIBRATION = {
+    'company': {},
+    'device': {},
+}
 
 # === Hashing Fields (for traceability if needed later) ===
 USE_HASH_FIELDS = [
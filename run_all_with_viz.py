@@ -1,56 +1,262 @@
-import subprocess
+import argparse
+import hashlib
+import importlib
+import os
 import sys
-from config import OUTPUT_DIR, ensure_output_dirs
-
-# Ensure necessary directories exist
-ensure_output_dirs()
-
-# List of scripts to run in order
-analysis_scripts = [
-    "scripts/logs_to_db.py",
-    "scripts/insertMockedData.py",
-    "scripts/dbExport.py", 
-    "scripts/macSpoof.py",
-    "scripts/proximityAlert.py",
-    "scripts/replayAttack.py",
-    "scripts/create_interactive_dashboard.py",
-    "visualizations/visualize_mac_spoofing.py",
-    "visualizations/visualize_proximity_alert.py",
-    "visualizations/visualize_replay_attack.py",
-]
+import threading
+import time
+import config
+from config import (DB_PATH, DOCS_DIR, FOTOS_DIR, PCAP_FILE, PIPELINE_WORKERS, PIPELINE_MANIFEST, PIPELINE_REPORT,
+                    PIPELINE_PROFILE_DIR, ensure_output_dirs)
+from utils.db_utils import database_state
+from utils.pipeline_utils import Stage, StageCache, select_stages, run_pipeline
+from utils.profile_utils import PipelineProfiler, write_report, count_rows_read
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+_db_states = {}
+# Parallel stages read the cache from several threads
+_db_states_lock = threading.Lock()
+
+
+def db_state():
+    """database_state(DB_PATH), recomputed only when the database or its WAL file changed on disk."""
+    stamp = tuple((os.stat(path).st_size, os.stat(path).st_mtime_ns) if os.path.exists(path) else None
+                  for path in (DB_PATH, DB_PATH + '-wal'))
+    with _db_states_lock:
+        if stamp in _db_states:
+            return _db_states[stamp]
+        state = database_state(DB_PATH)
+        _db_states.clear()
+        _db_states[stamp] = state
+        return state
+
+
+def source(*paths):
+    """SHA-256 of the given repository files, so editing a script's thresholds re-runs its stage."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(os.path.join(ROOT, path), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def inputs(*paths, settings=(), db=True, extra=None):
+    """A Stage.inputs callable: the database state, the named config values and the sources of ``paths``."""
+    def collect():
+        collected = {'code': source(*paths), 'config': {name: getattr(config, name) for name in settings}}
+        if db:
+            collected['db'] = db_state()
+        if extra is not None:
+            collected.update(extra())
+        return collected
+    return collect
+
+
+def capture_files():
+    """Size and mtime of the default capture, which the ingest stage reads."""
+    if not os.path.exists(PCAP_FILE):
+        return {'captures': None}
+    stat = os.stat(PCAP_FILE)
+    return {'captures': [PCAP_FILE, stat.st_size, stat.st_mtime_ns]}
+
+
+def docs(*names):
+    return [os.path.join(DOCS_DIR, name) for name in names]
+
+
+def images(*names):
+    return [os.path.join(FOTOS_DIR, name) for name in names]
+
+
+def script(module, *argv):
+    """Stage body calling a script's main(argv) in this process (modules are imported once, on first use)."""
+    def run(values):
+        return importlib.import_module(module).main(list(argv))
+    return run
+
+
+def insert_mocked_data(values):
+    importlib.import_module('scripts.insertMockedData').main()
+
+
+def load_plot_packets(values):
+    """The packet frame and DeviceStats every plotting stage reads, loaded once."""
+    from utils.db_utils import connect
+    from utils.frame_utils import read_plot_packets, read_device_stats
+    conn = connect(DB_PATH)
+    try:
+        return {'packets': read_plot_packets(conn), 'device_stats': read_device_stats(conn)}
+    finally:
+        conn.close()
+
+
+def plot_frames(values, *names):
+    """The shared plot frames; the rows of those in ``names`` count toward the receiving stage's rows_in."""
+    shared = values['plot_packets']
+    count_rows_read(sum(len(shared[name]) for name in names))
+    return shared
 
-visualization_scripts = [
-    "visualize_complete.py"
+
+def export_csvs(values):
+    importlib.import_module('scripts.dbExport').export_all()
+
+
+def dashboard(values):
+    shared = plot_frames(values, 'packets', 'device_stats')
+    module = importlib.import_module('scripts.create_interactive_dashboard')
+    module.ComprehensiveSecurityDashboard(packets=shared['packets'], device_stats=shared['device_stats']).generate_dashboard()
+
+
+def visualize_mac_spoofing(values):
+    module = importlib.import_module('visualizations.visualize_mac_spoofing')
+    module.MacSpoofingVisualizer().generate_all_visualizations()
+
+
+def visualize_proximity(values):
+    module = importlib.import_module('visualizations.visualize_proximity_alert')
+    module.ProximityAlertVisualizer(packets=plot_frames(values, 'packets')['packets']).generate_all_visualizations()
+
+
+def visualize_replay(values):
+    shared = plot_frames(values, 'packets', 'device_stats')
+    module = importlib.import_module('visualizations.visualize_replay_attack')
+    module.ReplayAttackVisualizer(packets=shared['packets'],
+                                  device_stats=shared['device_stats']).generate_all_visualizations()
+
+
+# ingest -> mocked attacks -> export / three detectors -> visualizers / dashboard.
+# The matplotlib visualizers share pyplot's global figure state, so they hold the 'pyplot' lock.
+# inputs / outputs make a stage skippable while nothing it reads has changed (see StageCache).
+DETECTOR_SETTINGS = ('DETECTOR_BACKENDS',)
+STAGES = [
+    Stage('ingest', script('scripts.logs_to_db'), writes_db=True, description="scripts/logs_to_db.py",
+          inputs=inputs('scripts/logs_to_db.py', settings=(
+              'PACKET_STORAGE', 'INGEST_ENGINE', 'INGEST_REPLAY_DETECTION', 'REPLAY_TIME_WINDOW_SEC', 'RSSI_REFERENCE',
+              'ENVIRONMENTAL_FACTOR', 'DISTANCE_CALIBRATION', 'INGEST_IDENTITY_CLUSTERS', 'INGEST_DEVICE_STATS'),
+              extra=capture_files)),
+    Stage('mock', insert_mocked_data, deps=['ingest'], writes_db=True, description="scripts/insertMockedData.py",
+          inputs=inputs('scripts/insertMockedData.py')),
+    Stage('export', export_csvs, deps=['mock'], description="scripts/dbExport.py",
+          inputs=inputs('scripts/dbExport.py'),
+          outputs=docs("BLEPacket.csv", "BLEPacketUUID.csv", "BLEPacket_Joined.csv")),
+    Stage('macspoof', script('scripts.macSpoof'), deps=['mock'], description="scripts/macSpoof.py",
+          inputs=inputs('scripts/macSpoof.py', settings=DETECTOR_SETTINGS),
+          outputs=docs("Fingerprint_Change_Events.csv", "MACSpoofing_CombinedAlerts.csv", "RSSI_Distance_Anomalies.csv",
+                       "Top_UUIDs.csv", "Top_ManufacturerData.csv", "MAC_Identity_Clusters.csv")),
+    Stage('proximity', script('scripts.proximityAlert'), deps=['mock'], description="scripts/proximityAlert.py",
+          inputs=inputs('scripts/proximityAlert.py', settings=DETECTOR_SETTINGS),
+          outputs=docs("ProximityAnomalyAlerts.csv")),
+    Stage('replay', script('scripts.replayAttack'), deps=['mock'], description="scripts/replayAttack.py",
+          inputs=inputs('scripts/replayAttack.py', settings=DETECTOR_SETTINGS + (
+              'REPLAY_TIME_WINDOW_SEC', 'REPLAY_BLOOM_CAPACITY', 'REPLAY_BLOOM_FP_RATE')),
+          outputs=docs("ReplayAttackAlerts.csv")),
+    Stage('plot_packets', load_plot_packets, deps=['mock'], shared=True, description="Paket verisi (paylaşılan)"),
+    Stage('dashboard', dashboard, deps=['macspoof', 'proximity', 'replay', 'plot_packets'],
+          description="scripts/create_interactive_dashboard.py",
+          inputs=inputs('scripts/create_interactive_dashboard.py', settings=('REPLAY_TIME_WINDOW_SEC',)),
+          outputs=docs("ble_security_dashboard.html")),
+    Stage('viz_macspoof', visualize_mac_spoofing, deps=['macspoof'], locks=['pyplot'],
+          description="visualizations/visualize_mac_spoofing.py",
+          inputs=inputs('visualizations/visualize_mac_spoofing.py'),
+          outputs=images("mac_spoofing_fingerprint_analysis.png", "mac_spoofing_anomaly_dashboard.png",
+                         "mac_spoofing_pattern_analysis.png") + docs("mac_spoofing_summary.txt")),
+    Stage('viz_proximity', visualize_proximity, deps=['proximity', 'plot_packets'], locks=['pyplot'],
+          description="visualizations/visualize_proximity_alert.py",
+          inputs=inputs('visualizations/visualize_proximity_alert.py'),
+          outputs=images("proximity_distance_analysis.png", "proximity_anomaly_dashboard.png",
+                         "proximity_temporal_analysis.png") + docs("proximity_alert_summary.txt")),
+    Stage('viz_replay', visualize_replay, deps=['replay', 'plot_packets'], locks=['pyplot'],
+          description="visualizations/visualize_replay_attack.py",
+          inputs=inputs('visualizations/visualize_replay_attack.py', settings=('REPLAY_TIME_WINDOW_SEC',)),
+          outputs=images("replay_packet_analysis.png", "replay_attack_dashboard.png",
+                         "replay_security_timeline.png") + docs("replay_attack_summary.txt")),
 ]
 
-print("🚀 BLE Güvenlik Analizi ve Görselleştirme Pipeline'ı Başlatılıyor...\n")
-
-# First, run the analysis scripts
-print("📊 ADIM 1: BLE Güvenlik Analizi")
-print("=" * 50)
-for script in analysis_scripts:
-    print(f"▶️ {script} çalıştırılıyor...")
-    result = subprocess.run(["python", script])
-    if result.returncode != 0:
-        print(f"❌ {script} başarısız oldu (hata kodu: {result.returncode}). Pipeline durduruluyor.")
-        sys.exit(1)
-    print(f"✅ {script} başarıyla tamamlandı.\n")
-
-print("🎨 ADIM 2: Görselleştirme ve Dashboard Oluşturma")
-print("=" * 50)
-
-# Then run the visualization scripts
-for script in visualization_scripts:
-    print(f"▶️ {script} çalıştırılıyor...")
-    result = subprocess.run(["python", script])
-    if result.returncode != 0:
-        print(f"⚠️ {script} başarısız oldu (hata kodu: {result.returncode}). Analiz tamamlandı ancak görselleştirme oluşturulamadı.")
-    else:
-        print(f"✅ {script} başarıyla tamamlandı.\n")
-
-print("🎉 Pipeline tamamlandı!")
-print("\n📋 Oluşturulan Çıktılar:")
-print("   📁 ./outputs/ klasöründe:")
-print("      • Docs/CSV analiz dosyaları")
-print("      • images/PNG grafik dosyaları")
-print("      • Docs/TXT özet istatistik raporu")
+
+def megabytes(value):
+    return f"{value / 2**20:.1f}" if value is not None else "-"
+
+
+def print_stage_table(results):
+    """Status, time, memory, rows and I/O of every stage (the JSON report has the full metrics)."""
+    print(f"   {'aşama':<14} {'durum':<8} {'süre s':>7} {'CPU s':>7} {'RSS MB':>7} {'satır in':>9} {'satır out':>9} "
+          f"{'okunan MB':>9} {'yazılan MB':>10} {'DB +MB':>7}")
+    for name, result in results.items():
+        seconds = f"{result['seconds']:.1f}" if result['seconds'] is not None else "-"
+        metrics = result['metrics']
+        if metrics is None:
+            print(f"   {name:<14} {result['status']:<8} {seconds:>7}")
+            continue
+        io = metrics['io'] or {}
+        db = metrics['db'] or {}
+        print(f"   {name:<14} {result['status']:<8} {seconds:>7} {metrics['cpu_sec']:>7.1f} {metrics['peak_rss_mb']:>7.0f} "
+              f"{metrics['rows_in']:>9} {metrics['rows_out']:>9} {megabytes(io.get('rchar')):>9} "
+              f"{megabytes(io.get('wchar')):>10} {megabytes(db.get('file_growth_bytes')):>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the BLE analysis and visualization pipeline in one process")
+    parser.add_argument('stages', nargs='*',
+                        help="Run only these stages and the ones downstream of them (default: every stage)")
+    parser.add_argument('--workers', type=int, default=PIPELINE_WORKERS,
+                        help="Stages run side by side once their dependencies are done")
+    parser.add_argument('--force', action='store_true',
+                        help="Run every selected stage even if its inputs are unchanged (the manifest is still updated)")
+    parser.add_argument('--no-cache', action='store_true', help="Neither read nor write the stage manifest")
+    parser.add_argument('--list', action='store_true', help="List the stages and their dependencies")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"Run every stage under cProfile and write its stats to {PIPELINE_PROFILE_DIR}/<stage>.prof; "
+                             "stages then run one at a time (--workers 1), as only one cProfile can be active")
+    parser.add_argument('--report', default=PIPELINE_REPORT,
+                        help="JSON report of the run: status, time, CPU, peak RSS, rows and I/O per stage")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for stage in STAGES:
+            print(f"{stage.name:<14} <- {', '.join(stage.deps) or '-':<42} {stage.description}")
+        return 0
+    try:
+        stages = select_stages(STAGES, args.stages)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.profile and args.workers > 1:
+        # Python 3.12+ refuses a second active cProfile (ValueError); earlier versions mix the stages' stats
+        print(f"ℹ️ --profile: aşamalar tek tek çalıştırılıyor (--workers {args.workers} yerine 1).")
+        args.workers = 1
+
+    # The figures are only saved, and a GUI backend cannot be driven from the worker threads
+    os.environ['MPLBACKEND'] = 'Agg'
+    # Ensure necessary directories exist
+    ensure_output_dirs()
+    print("🚀 BLE Güvenlik Analizi ve Görselleştirme Pipeline'ı Başlatılıyor...\n")
+    cache = None if args.no_cache else StageCache(PIPELINE_MANIFEST, force=args.force)
+    started = time.perf_counter()
+    with PipelineProfiler(DB_PATH, PIPELINE_PROFILE_DIR if args.profile else None) as profiler:
+        results = run_pipeline(stages, workers=args.workers, cache=cache, profiler=profiler)
+    write_report(args.report, results, started_at=profiler.started_at,
+                 wall_sec=round(time.perf_counter() - started, 3), workers=args.workers,
+                 stages_selected=args.stages or None, cache=cache is not None, db_path=DB_PATH)
+
+    incomplete = [name for name, result in results.items() if result['status'] in ('failed', 'skipped')]
+    print("\n📋 Aşamalar:")
+    print_stage_table(results)
+    print(f"\n📊 Ayrıntılı rapor: {args.report}")
+    if args.profile:
+        print(f"🔬 cProfile çıktıları: {PIPELINE_PROFILE_DIR}/<aşama>.prof (python -m pstats ile incelenebilir)")
+    if incomplete:
+        failed = [name for name in incomplete if results[name]['status'] == 'failed']
+        print(f"\n❌ Başarısız: {', '.join(failed)}. Yalnızca bunları ve bağlı aşamaları yeniden çalıştırmak için:")
+        print(f"   python run_all_with_viz.py {' '.join(failed)}")
+        return 1
+
+    print("\n🎉 Pipeline tamamlandı!")
+    print("\n📋 Oluşturulan Çıktılar:")
+    print("   📁 ./outputs/ klasöründe:")
+    print("      • Docs/CSV analiz dosyaları")
+    print("      • images/PNG grafik dosyaları")
+    print("      • Docs/TXT özet istatistik raporu")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,6 @@ Tüm saldırı türleri için kapsamlı interaktif dashboard oluşturur
 """
 
 import pandas as pd
-import sqlite3
 import json
 import os
 from datetime import datetime
@@ -17,12 +16,17 @@ import plotly.offline as pyo
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from config import DB_PATH, DOCS_DIR, REPLAY_TIME_WINDOW_SEC
+from utils.db_utils import connect
+from utils.frame_utils import read_device_stats, read_plot_packets
 
 class ComprehensiveSecurityDashboard:
-    def __init__(self, db_path=DB_PATH, docs_path=DOCS_DIR):
+    def __init__(self, db_path=DB_PATH, docs_path=DOCS_DIR, packets=None, device_stats=None):
         self.db_path = db_path
         self.docs_path = docs_path
+        # Pipeline'da paylaşılan read_plot_packets çerçevesi verilirse veritabanı tekrar okunmaz
+        self.shared_packets = packets
         self.raw_packet_data = None
+        self.device_stats = device_stats
         self.mac_spoofing_attacks = None
         self.proximity_attacks = None
         self.replay_attacks = None
@@ -32,14 +36,16 @@ class ComprehensiveSecurityDashboard:
         """Tüm veri türlerini yükle"""
         print("📊 Kapsamlı güvenlik dashboard verileri yükleniyor...")
         
-        conn = sqlite3.connect(self.db_path)
+        conn = connect(self.db_path)
         
         # Ana paket verilerini yükle
-        self.raw_packet_data = pd.read_sql_query("""
-            SELECT timestamp, dmac, smac, rssi, distance, packet_hash
-            FROM BLEPacket
-            ORDER BY timestamp
-        """, conn)
+        # Kategorik MAC / string[pyarrow] hash kolonları, timestamp datetime64[us] olarak gelir
+        if self.shared_packets is not None:
+            self.raw_packet_data = self.shared_packets.copy(deep=False)
+        else:
+            self.raw_packet_data = read_plot_packets(conn)
+            # Cihaz başına sayımlar DeviceStats tablosundan (güncel değilse None)
+            self.device_stats = read_device_stats(conn)
         
         # MAC Spoofing saldırılarını CSV'den yükle (veritabanı yerine)
         try:
@@ -109,15 +115,6 @@ class ComprehensiveSecurityDashboard:
             print(f"⚠️ Proximity Attack verileri yüklenirken hata: {e}")
             self.proximity_attacks = None
         
-        # Timestamp dönüşümü
-        if self.raw_packet_data is not None:
-            # Timestamp'i daha esnek şekilde parse et (microsaniye desteği için)
-            try:
-                self.raw_packet_data['timestamp'] = pd.to_datetime(self.raw_packet_data['timestamp'], format='mixed')
-            except ValueError:
-                # Eğer mixed format çalışmazsa, errors='coerce' kullan
-                self.raw_packet_data['timestamp'] = pd.to_datetime(self.raw_packet_data['timestamp'], errors='coerce')
-        
         print("✅ Tüm veriler başarıyla yüklendi!")
         
     def create_comprehensive_security_status(self):
@@ -158,7 +155,10 @@ class ComprehensiveSecurityDashboard:
         """Kapsamlı istatistik özeti"""
         total_packets = len(self.raw_packet_data) if self.raw_packet_data is not None else 0
         unique_hashes = self.raw_packet_data['packet_hash'].nunique() if self.raw_packet_data is not None else 0
-        unique_macs = self.raw_packet_data['smac'].nunique() if self.raw_packet_data is not None else 0
+        if self.device_stats is not None:
+            unique_macs = len(self.device_stats)
+        else:
+            unique_macs = self.raw_packet_data['smac'].nunique() if self.raw_packet_data is not None else 0
         
         # Saldırı sayıları
         mac_count = len(self.mac_spoofing_attacks) if self.mac_spoofing_attacks is not None else 0
@@ -1,9 +1,10 @@
-import sqlite3
 import pandas as pd
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from config import DB_PATH, DOCS_DIR
+from utils.db_utils import connect, read_snapshot
+from utils.profile_utils import count_rows_read
 
 def ensure_export_dir(path):
     os.makedirs(path, exist_ok=True)
@@ -11,6 +12,7 @@ def ensure_export_dir(path):
 def export_ble_packet(conn, export_path):
     try:
         df = pd.read_sql_query("SELECT * FROM BLEPacket", conn)
+        count_rows_read(len(df))
         df.to_csv(os.path.join(export_path, "BLEPacket.csv"), index=False)
         print("✔️ BLEPacket.csv created.")
     except Exception as e:
@@ -29,6 +31,7 @@ def export_ble_packet_uuid(conn, export_path):
             FROM BLEPacketUUID
             JOIN BLEPacket ON BLEPacket.id = BLEPacketUUID.ble_packet_id
         """, conn)
+        count_rows_read(len(df))
         df.to_csv(os.path.join(export_path, "BLEPacketUUID.csv"), index=False)
         print("✔️ BLEPacketUUID.csv created.")
     except Exception as e:
@@ -50,8 +53,9 @@ def export_joined_data(conn, export_path):
             FROM BLEPacket
             LEFT JOIN BLEPacketUUID ON BLEPacket.id = BLEPacketUUID.ble_packet_id
             GROUP BY BLEPacket.id
-            ORDER BY BLEPacket.timestamp
+            ORDER BY BLEPacket.timestamp_us
         """, conn)
+        count_rows_read(len(df))
         df.to_csv(os.path.join(export_path, "BLEPacket_Joined.csv"), index=False)
         print("✔️ BLEPacket_Joined.csv created.")
     except Exception as e:
@@ -59,13 +63,16 @@ def export_joined_data(conn, export_path):
 
 def export_all():
     ensure_export_dir(DOCS_DIR)
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
 
-    export_ble_packet(conn, DOCS_DIR)
-    export_ble_packet_uuid(conn, DOCS_DIR)
-    export_joined_data(conn, DOCS_DIR)
+    # All three files come from the same snapshot, even while an ingest is running
+    with read_snapshot(conn):
+        export_ble_packet(conn, DOCS_DIR)
+        export_ble_packet_uuid(conn, DOCS_DIR)
+        export_joined_data(conn, DOCS_DIR)
 
     conn.close()
     print("✅ All exports completed successfully.")
 
-export_all()
\ No newline at end of file
+if __name__ == "__main__":
+    export_all()
@@ -0,0 +1,239 @@
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from config import DB_PATH, DISTANCE_CALIBRATION
+from utils.db_utils import (init_db, backfill_content_fingerprints, backfill_timestamp_us, get_storage_mode,
+                            normalize_packet_storage, index_status, rebuild_indexes, recompute_distances,
+                            update_identity_clusters, reset_identity_clusters, identity_cluster_summary,
+                            update_device_stats, reset_device_stats, lowercase_macs)
+
+# The packet reads of the analyzers, visualizers, dashboard and export (keep in step with those scripts)
+ANALYZER_QUERIES = (
+    ('macSpoof: one row per packet', """
+        SELECT id, timestamp_us, dmac, smac, rssi, distance, company_id, manufacturer_data, packet_hash,
+               payload_fingerprint FROM BLEPacket"""),
+    ('macSpoof: top UUIDs', """
+        SELECT uuid, COUNT(*) FROM BLEPacketUUID GROUP BY uuid"""),
+    ('visualize_mac_spoofing: packets + UUIDs', """
+        SELECT BLEPacket.id, BLEPacket.timestamp_us, BLEPacket.dmac, BLEPacket.smac, BLEPacket.company_id,
+               BLEPacket.manufacturer_data, BLEPacketUUID.uuid_type, BLEPacketUUID.uuid
+        FROM BLEPacket LEFT JOIN BLEPacketUUID ON BLEPacket.id = BLEPacketUUID.ble_packet_id"""),
+    ('identity graph: packets after the watermark', """
+        SELECT id, lower(smac), payload_fingerprint FROM BLEPacket WHERE id > 0 ORDER BY id LIMIT 100000"""),
+    ('proximityAlert: distances by smac, time', """
+        SELECT timestamp_us, smac, distance FROM BLEPacket
+        WHERE distance IS NOT NULL ORDER BY smac, timestamp_us"""),
+    ('visualize_proximity_alert: distances by smac, time', """
+        SELECT timestamp_us, smac, dmac, distance, rssi FROM BLEPacket
+        WHERE distance IS NOT NULL ORDER BY smac, timestamp_us"""),
+    ('replayAttack / visualize_replay_attack / dashboard: packets by time', """
+        SELECT timestamp_us, dmac, smac, rssi, distance, packet_hash FROM BLEPacket ORDER BY timestamp_us"""),
+    ('replayAttack: fingerprint walk', """
+        SELECT content_fingerprint, timestamp_us, dmac, smac, rssi, distance, packet_hash FROM BLEPacket
+        WHERE content_fingerprint IS NOT NULL AND timestamp_us IS NOT NULL
+        ORDER BY content_fingerprint, timestamp_us"""),
+    ('packet_hash repeats', """
+        SELECT packet_hash, COUNT(*), MIN(timestamp_us) FROM BLEPacket GROUP BY packet_hash"""),
+    ('dbExport: BLEPacketUUID.csv', """
+        SELECT BLEPacketUUID.id, BLEPacketUUID.ble_packet_id, BLEPacket.timestamp, BLEPacket.smac,
+               BLEPacketUUID.uuid_type, BLEPacketUUID.uuid
+        FROM BLEPacketUUID JOIN BLEPacket ON BLEPacket.id = BLEPacketUUID.ble_packet_id"""),
+    ('dbExport: BLEPacket_Joined.csv', """
+        SELECT BLEPacket.timestamp, BLEPacket.smac,
+               GROUP_CONCAT(BLEPacketUUID.uuid || ' (' || BLEPacketUUID.uuid_type || ')', '; ') AS uuids
+        FROM BLEPacket LEFT JOIN BLEPacketUUID ON BLEPacket.id = BLEPacketUUID.ble_packet_id
+        GROUP BY BLEPacket.id ORDER BY BLEPacket.timestamp_us"""),
+)
+INDEX_STATE_ICONS = {'ok': '✅', 'missing': '❌', 'stale': '⚠️', 'extra': 'ℹ️'}
+
+
+def cmd_backfill_fingerprints(conn, args):
+    start = time.perf_counter()
+    updated = backfill_content_fingerprints(conn, batch_size=args.batch_size)
+    print(f"✔️ content/payload fingerprints filled for {updated} packet(s) in {time.perf_counter() - start:.1f}s.")
+
+
+def cmd_migrate_timestamps(conn, args):
+    start = time.perf_counter()
+    updated = backfill_timestamp_us(conn, batch_size=args.batch_size)
+    print(f"✔️ timestamp_us filled for {updated} packet(s) in {time.perf_counter() - start:.1f}s.")
+
+
+def cmd_lowercase_macs(conn, args):
+    start = time.perf_counter()
+    updated = lowercase_macs(conn, batch_size=args.batch_size)
+    print(f"✔️ smac/dmac lower-cased for {updated} packet(s) in {time.perf_counter() - start:.1f}s.")
+
+
+def cmd_migrate(conn, args):
+    cmd_lowercase_macs(conn, args)
+    cmd_migrate_timestamps(conn, args)
+    cmd_backfill_fingerprints(conn, args)
+
+
+def cmd_normalize(conn, args):
+    if get_storage_mode(conn.cursor()) == 'normalized':
+        print("ℹ️ Packets are already stored in the normalized layout.")
+        return
+    size_before = os.path.getsize(args.db)
+    start = time.perf_counter()
+    packets = normalize_packet_storage(conn)
+    print(f"✔️ {packets} packet(s) moved to BLEPacketCompact + Device/Payload/CaptureSource "
+          f"in {time.perf_counter() - start:.1f}s ({size_before / 2**20:.1f} MB -> {os.path.getsize(args.db) / 2**20:.1f} MB).")
+
+
+def load_calibration(path):
+    """DISTANCE_CALIBRATION plus the rows of a scope,key,rssi_reference,environmental_factor CSV."""
+    calibration = {scope: dict(DISTANCE_CALIBRATION.get(scope, {})) for scope in ('company', 'device')}
+    if path:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                calibration[row['scope']][row['key'].strip().lower()] = (
+                    float(row['rssi_reference']), float(row['environmental_factor']))
+    return calibration
+
+
+def cmd_recompute_distance(conn, args):
+    calibration = load_calibration(args.calibration)
+    start = time.perf_counter()
+    scanned, updated = recompute_distances(conn, calibration, batch_size=args.batch_size)
+    print(f"✔️ distance recomputed for {scanned:,} packet(s), {updated:,} changed, "
+          f"in {time.perf_counter() - start:.1f}s ({len(calibration['company'])} company / "
+          f"{len(calibration['device'])} device calibration(s)).")
+
+
+def cmd_identity_clusters(conn, args):
+    cursor = conn.cursor()
+    if args.rebuild:
+        reset_identity_clusters(cursor)
+    start = time.perf_counter()
+    _graph, consumed = update_identity_clusters(cursor, batch_size=args.batch_size)
+    conn.commit()
+    summary = identity_cluster_summary(cursor)
+    print(f"✔️ {consumed:,} packet(s) folded into the identity graph in {time.perf_counter() - start:.1f}s: "
+          f"{summary['macs']:,} MAC(s) in {summary['clusters']:,} cluster(s).")
+    for size, count in summary['cluster_sizes'].items():
+        print(f"   {size:>5d} MAC(s) per cluster: {count:,}")
+
+
+def cmd_device_stats(conn, args):
+    cursor = conn.cursor()
+    if args.rebuild:
+        reset_device_stats(cursor)
+    start = time.perf_counter()
+    consumed = update_device_stats(cursor, batch_size=args.batch_size)
+    conn.commit()
+    devices = cursor.execute("SELECT COUNT(*) FROM DeviceStats").fetchone()[0]
+    print(f"✔️ {consumed:,} packet(s) folded into DeviceStats in {time.perf_counter() - start:.1f}s: {devices:,} device(s).")
+
+
+def cmd_indexes(conn, args):
+    cursor = conn.cursor()
+    packets = cursor.execute("SELECT COUNT(*) FROM BLEPacket").fetchone()[0]
+    print(f"📇 {get_storage_mode(cursor)} packet layout, {packets:,} packets")
+    print(f"{'index':34s} {'table':16s} {'columns':46s} state")
+    for index in index_status(cursor):
+        print(f"{index['name']:34s} {index['table']:16s} {', '.join(index['columns']):46s} "
+              f"{INDEX_STATE_ICONS[index['state']]} {index['state']}")
+    analyzed = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    print(f"📊 Planner statistics: {'present' if analyzed else 'missing (run build-indexes)'}")
+    if args.integrity:
+        problems = [row[0] for row in cursor.execute('PRAGMA integrity_check')]
+        print("✔️ integrity_check: ok" if problems == ['ok'] else "❌ integrity_check:\n  " + "\n  ".join(problems))
+
+
+def cmd_build_indexes(conn, args):
+    built, seconds = rebuild_indexes(conn, rebuild=args.rebuild)
+    if built:
+        print(f"🔧 Built {len(built)} index(es) in {seconds:.1f}s: {', '.join(built)}")
+    else:
+        print("✔️ All indexes are present.")
+
+
+def describe_plan(plan):
+    """Indexes used, fully scanned tables and whether a temp B-tree sort is needed."""
+    indexes, scans, sort = [], [], False
+    for detail in plan:
+        indexes += re.findall(r'USING (?:COVERING )?INDEX (\w+)', detail)
+        scan = re.match(r'SCAN (\w+)', detail)
+        if scan and 'INDEX' not in detail:
+            scans.append(scan.group(1))
+        sort = sort or 'USE TEMP B-TREE' in detail
+    return indexes, scans, sort
+
+
+def cmd_index_report(conn, args):
+    queries = [(f'--sql #{i}', sql) for i, sql in enumerate(args.sql, 1)] if args.sql else ANALYZER_QUERIES
+    for label, sql in queries:
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        indexes, scans, sort = describe_plan(plan)
+        print(f"🔎 {label}")
+        print(f"   index: {', '.join(dict.fromkeys(indexes)) or '—'}"
+              f" | full scan: {', '.join(scans) or '—'} | temp sort: {'yes' if sort else 'no'}")
+        if args.plan:
+            for detail in plan:
+                print(f"      {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the BLE SQLite database")
+    parser.add_argument('--db', default=DB_PATH, help="Database path (default: config.DB_PATH)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, func, help_text in (
+            ('migrate', cmd_migrate, "Run every backfill below"),
+            ('lowercase-macs', cmd_lowercase_macs,
+             "Lower-case the smac/dmac values stored by earlier versions (recomputes the affected fingerprints)"),
+            ('migrate-timestamps', cmd_migrate_timestamps,
+             "Fill the integer timestamp_us column from the timestamp text"),
+            ('backfill-fingerprints', cmd_backfill_fingerprints,
+             "Compute content_fingerprint and payload_fingerprint for packets ingested before they existed"),
+            ('normalize', cmd_normalize,
+             "Move a flat BLEPacket table to dictionary-encoded tables behind a BLEPacket view")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--batch-size', type=int, default=50000)
+        command.set_defaults(func=func, build_indexes=True)
+
+    command = commands.add_parser('recompute-distance',
+                                  help="Rewrite distance from rssi with the current path-loss calibration")
+    command.add_argument('--batch-size', type=int, default=500000)
+    command.add_argument('--calibration', help="CSV of scope (company|device), key, rssi_reference, "
+                                               "environmental_factor, applied over DISTANCE_CALIBRATION")
+    command.set_defaults(func=cmd_recompute_distance)
+    command = commands.add_parser('identity-clusters',
+                                  help="Fold the packets since the last run into IdentityCluster and show cluster sizes")
+    command.add_argument('--batch-size', type=int, default=100000)
+    command.add_argument('--rebuild', action='store_true', help="Discard the clusters and rebuild from every packet")
+    command.set_defaults(func=cmd_identity_clusters)
+    command = commands.add_parser('device-stats', help="Fold the packets since the last update into DeviceStats")
+    command.add_argument('--batch-size', type=int, default=200000)
+    command.add_argument('--rebuild', action='store_true', help="Discard DeviceStats and recompute it from every packet")
+    command.set_defaults(func=cmd_device_stats)
+    command = commands.add_parser('indexes', help="Show the state of every secondary index")
+    command.add_argument('--integrity', action='store_true', help="Also run PRAGMA integrity_check (full read)")
+    command.set_defaults(func=cmd_indexes)
+    command = commands.add_parser('build-indexes', help="Build missing/stale indexes and refresh planner statistics")
+    command.add_argument('--rebuild', action='store_true', help="Drop and rebuild every index")
+    command.set_defaults(func=cmd_build_indexes)
+    command = commands.add_parser('index-report', help="Show which index each analyzer query uses")
+    command.add_argument('--sql', action='append', default=[], help="Explain this query instead (repeatable)")
+    command.add_argument('--plan', action='store_true', help="Print the full EXPLAIN QUERY PLAN output")
+    command.set_defaults(func=cmd_index_report)
+
+    args = parser.parse_args()
+    # init_db adds any missing columns before a command touches them; indexes are built after the backfills
+    conn, _cursor = init_db(args.db, indexes=False)
+    try:
+        args.func(conn, args)
+        if getattr(args, 'build_indexes', False):
+            cmd_build_indexes(conn, argparse.Namespace(rebuild=False))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,48 @@
-import pyshark
 import sqlite3
 import sys
 import os
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import re
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from collections import defaultdict
-from config import DB_PATH, PCAP_FILE
-from utils.db_utils import init_db, insert_packet, insert_uuids, insert_spoof_alert
-from utils.ble_utils import rssi_to_distance, generate_packet_hash
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from config import (DB_PATH, PCAP_FILE, INGEST_ENGINE, INGEST_WORKERS, INGEST_CHUNK_BYTES, INGEST_IDENTITY_BYTES,
+                    INGEST_FILE_PATTERNS, SENSOR_ID_PATTERN, PACKET_STORAGE, INGEST_DEFER_INDEXES,
+                    INGEST_DEFER_INDEX_RATIO, INGEST_REPLAY_DETECTION, REPLAY_TIME_WINDOW_SEC,
+                    INGEST_IDENTITY_CLUSTERS, INGEST_DEVICE_STATS)
+from utils.db_utils import (init_db, insert_packet, insert_uuids, insert_spoof_alert, get_ingest_state,
+                            save_ingest_state, insert_replay_alerts, queue_replay_recheck, recheck_replay_alerts,
+                            delete_capture_packets, PacketStore,
+                            PACKET_STORAGE_MODES,
+                            drop_indexes, rebuild_indexes, update_identity_clusters,
+                            update_device_stats)
+from utils.ble_utils import (rssi_to_distance, calibration_for, generate_packet_hash, generate_content_fingerprint,
+                             generate_payload_fingerprint, decode_ble_frame, format_timestamp, BROADCAST_MAC)
+from utils.pcapng_utils import PcapngReader, split_chunks
+from utils.replay_utils import StreamingReplayDetector
 
+INGEST_ENGINES = ('native', 'pyshark')
 
 
-def process_ble_packets_optimized(pcap_file, conn, cursor):
-    """Optimized BLE packet processing with batch operations and reduced DB calls"""
-    
+def iter_pyshark_packets(pcap_file):
+    """Decode packets through tshark/pyshark (reference engine).
+
+    get_field_value returns only the first value of a repeated field, so a
+    packet listing several UUIDs of one size yields just the first of them.
+    """
+    import pyshark
+
     capture = pyshark.FileCapture(
         pcap_file,
         display_filter='btle'
     )
-    identity_map = defaultdict(set)
-    
-    # Batch containers
-    packet_batch = []
-    uuid_batch = []
-    spoof_alerts = []
-    
-    batch_size = 1000  # Process in batches
-    packet_count = 0
-    
-    # Pre-compile SQL statements for better performance
-    insert_packet_sql = """
-        INSERT INTO BLEPacket (timestamp, dmac, smac, rssi, distance, company_id, 
-                              manufacturer_data, packet_hash) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """
-    
-    insert_uuid_sql = """
-    INSERT INTO BLEPacketUUID (ble_packet_id, uuid_type, uuid) VALUES (?, ?, ?)
-    """
-    
     try:
         for pkt in capture:
             try:
@@ -50,14 +55,6 @@ def process_ble_packets_optimized(pcap_file, conn, cursor):
                 
                 timestamp = pkt.sniff_time.strftime('%Y-%m-%d %H:%M:%S.%f')
                 
-                # Optimized MAC address extraction
-                if scanning_address:
-                    smac = scanning_address.lower()
-                    dmac = advertising_address.lower() if advertising_address else 'ff:ff:ff:ff:ff:ff'
-                else:
-                    smac = advertising_address.lower()
-                    dmac = 'ff:ff:ff:ff:ff:ff'
-                
                 # Optimized RSSI extraction
                 rssi = None
                 if hasattr(pkt, 'nordic_ble') and hasattr(pkt.nordic_ble, 'rssi'):
@@ -66,10 +63,8 @@ def process_ble_packets_optimized(pcap_file, conn, cursor):
                     except (ValueError, TypeError):
                         rssi = None
                 
-                distance = rssi_to_distance(rssi) if rssi is not None else None
-                
                 # Optimized UUID extraction with early capture
-                uuid_data = {'16': set(), '32': set(), '128': set()}
+                uuids = []
                 company_id = None
                 manufacturer_data = None
                 
@@ -82,17 +77,11 @@ def process_ble_packets_optimized(pcap_file, conn, cursor):
 
                             field_name_lower = field_name.lower()
                             if 'uuid_16' in field_name_lower:
-                                uuid_str = str(field_value)
-                                uuid_data['16'].add(uuid_str)
-                                uuid_batch.append((len(packet_batch), '16', uuid_str))  # Capture UUID immediately
+                                uuids.append(('16', str(field_value)))
                             elif 'uuid_32' in field_name_lower:
-                                uuid_str = str(field_value)
-                                uuid_data['32'].add(uuid_str)
-                                uuid_batch.append((len(packet_batch), '32', uuid_str))
+                                uuids.append(('32', str(field_value)))
                             elif 'uuid_128' in field_name_lower:
-                                uuid_str = str(field_value)
-                                uuid_data['128'].add(uuid_str)
-                                uuid_batch.append((len(packet_batch), '128', uuid_str))
+                                uuids.append(('128', str(field_value)))
                             elif 'company_id' in field_name_lower:
                                 company_id = str(field_value)
                             elif 'manufacturer_data' in field_name_lower or 'entry_data' in field_name_lower:
@@ -101,84 +90,368 @@ def process_ble_packets_optimized(pcap_file, conn, cursor):
                             print(f"Error processing field {field_name}: {e}")
                             continue
 
-                if not any(uuid_data.values()):
-                    # print(f"⚠️ Packet at {timestamp} has no UUIDs. Skipping.")
-                    continue  # Skip packet if no UUIDs found
-
-                # Generate hash efficiently
-                hash_input = {
+                yield {
+                    'ts_us': int(round(float(pkt.sniff_timestamp) * 1_000_000)),
                     'timestamp': timestamp,
-                    'dmac': dmac,
-                    'uuids_16': ','.join(sorted(uuid_data['16'])),
-                    'uuids_32': ','.join(sorted(uuid_data['32'])),
-                    'uuids_128': ','.join(sorted(uuid_data['128'])),
-                    'company_id': company_id or '',
-                    'manufacturer_data': manufacturer_data or '',
-                    'rssi': rssi or ''
+                    'advertising_address': advertising_address,
+                    'scanning_address': scanning_address,
+                    'rssi': rssi,
+                    'uuids': uuids,
+                    'company_id': company_id,
+                    'manufacturer_data': manufacturer_data,
                 }
-                print(f"Packet hash input: {hash_input}")
-                packet_hash = generate_packet_hash(hash_input)
-                
-                # Add to batch
-                packet_data = (
-                    timestamp, dmac, smac, rssi, distance, 
-                    company_id, manufacturer_data, packet_hash
-                )
-                packet_batch.append(packet_data)
-                
-                # Check for spoofing (optimized)
-                all_uuids = []
-                for uuid_type, uuid_set in uuid_data.items():
-                    for uuid_val in uuid_set:
-                        all_uuids.append((uuid_type, uuid_val, company_id, manufacturer_data))
-                
-                for uuid_key in all_uuids:
-                    identity_map[uuid_key].add(dmac)
-                    if len(identity_map[uuid_key]) > 1:
-                        spoof_alerts.append({
-                            'timestamp': timestamp,
-                            'uuid_type': uuid_key[0],
-                            'uuid': uuid_key[1],
-                            'company_id': uuid_key[2],
-                            'manufacturer_data': uuid_key[3],
-                            'conflicting_macs': list(identity_map[uuid_key])
-                        })
-                
-                packet_count += 1
-                
-                # Process batch when it reaches the limit
-                if len(packet_batch) >= batch_size:
-                    process_batch(cursor, conn, packet_batch, uuid_batch, spoof_alerts,
-                                  insert_packet_sql, insert_uuid_sql)
-                    packet_batch.clear()
-                    uuid_batch.clear()
-                    spoof_alerts.clear()
-                    
-                    if packet_count % 10000 == 0:
-                        print(f"Processed {packet_count} packets...")
 
             except Exception as e:
                 print(f"Error processing packet: {e}")
                 continue
-        
     finally:
-        # Process remaining batch
-        if packet_batch:
-            process_batch(cursor, conn, packet_batch, uuid_batch, spoof_alerts,
-                          insert_packet_sql, insert_uuid_sql)
-        
         capture.close()
-    
+
+
+def decode_native_records(reader):
+    """Decode the packets of an open PcapngReader with the Nordic/BTLE decoder."""
+    for record in reader:
+        decoded = decode_ble_frame(record.linktype, record.data)
+        if decoded is None:
+            continue
+        rssi, fields = decoded
+        if not (fields['advertising_address'] or fields['scanning_address']):
+            continue
+        fields['ts_us'] = record.ts_us
+        fields['timestamp'] = format_timestamp(record.ts_us)
+        fields['rssi'] = rssi
+        yield fields
+
+
+def iter_native_packets(pcap_file, start=0, end=None, state=None):
+    """Decode packets with the built-in pcapng reader and Nordic/BTLE decoder."""
+    with PcapngReader(pcap_file, start, end, state) as reader:
+        yield from decode_native_records(reader)
+
+
+def iter_packets(pcap_file, engine=INGEST_ENGINE):
+    if engine == 'native':
+        return iter_native_packets(pcap_file)
+    if engine == 'pyshark':
+        return iter_pyshark_packets(pcap_file)
+    raise ValueError(f"Unknown ingest engine: {engine} (expected one of {', '.join(INGEST_ENGINES)})")
+
+
+def prepare_packet(pkt):
+    """Resolve MACs, distance, packet hash and content/payload fingerprints for one decoded packet.
+
+    Returns (ts_us, packet_row, uuids) or None when the packet carries no UUIDs.
+    """
+    timestamp = pkt['timestamp']
+    advertising_address = pkt['advertising_address']
+    scanning_address = pkt['scanning_address']
+
+    # Optimized MAC address extraction
+    if scanning_address:
+        smac = scanning_address.lower()
+        dmac = advertising_address.lower() if advertising_address else BROADCAST_MAC
+    else:
+        smac = advertising_address.lower()
+        dmac = BROADCAST_MAC
+
+    rssi = pkt['rssi']
+    company_id = pkt['company_id']
+    manufacturer_data = pkt['manufacturer_data']
+    distance = rssi_to_distance(rssi, *calibration_for(company_id, smac)) if rssi is not None else None
+
+    uuid_data = {'16': set(), '32': set(), '128': set()}
+    for uuid_type, uuid_str in pkt['uuids']:
+        uuid_data[uuid_type].add(uuid_str)
+
+    if not any(uuid_data.values()):
+        # print(f"⚠️ Packet at {timestamp} has no UUIDs. Skipping.")
+        return None  # Skip packet if no UUIDs found
+
+    # Generate hash efficiently
+    hash_input = {
+        'timestamp': timestamp,
+        'dmac': dmac,
+        'uuids_16': ','.join(sorted(uuid_data['16'])),
+        'uuids_32': ','.join(sorted(uuid_data['32'])),
+        'uuids_128': ','.join(sorted(uuid_data['128'])),
+        'company_id': company_id or '',
+        'manufacturer_data': manufacturer_data or '',
+        'rssi': rssi or ''
+    }
+    packet_hash = generate_packet_hash(hash_input)
+    content_fingerprint = generate_content_fingerprint(hash_input)
+    payload_fingerprint = generate_payload_fingerprint(hash_input)
+
+    packet_data = (
+        timestamp, dmac, smac, rssi, distance,
+        company_id, manufacturer_data, packet_hash, content_fingerprint, payload_fingerprint,
+        pkt['ts_us']
+    )
+    return pkt['ts_us'], packet_data, pkt['uuids']
+
+
+def _prepare_all(packets):
+    for pkt in packets:
+        try:
+            prepared = prepare_packet(pkt)
+        except Exception as e:
+            print(f"Error processing packet: {e}")
+            continue
+        if prepared is not None:
+            yield prepared
+
+
+def iter_prepared_packets(pcap_file, engine=INGEST_ENGINE, start=0, state=None):
+    """Yield (ts_us, packet_row, uuids, resume) in capture order.
+
+    resume is the (offset, section_state) a later run can continue from once
+    this row is committed, or None when the engine cannot seek (pyshark).
+    A final (None, None, None, resume) marker covers trailing blocks.
+    """
+    if engine == 'pyshark':
+        if start:
+            raise ValueError("The pyshark engine cannot resume mid-file; use the native engine")
+        for prepared in _prepare_all(iter_pyshark_packets(pcap_file)):
+            yield (*prepared, None)
+        return
+    if engine != 'native':
+        iter_packets(pcap_file, engine)  # raises for unknown engines
+    with PcapngReader(pcap_file, start, state=state) as reader:
+        for prepared in _prepare_all(decode_native_records(reader)):
+            yield (*prepared, (reader.offset, reader.state))
+        yield None, None, None, (reader.offset, reader.state)
+
+
+def decode_chunk(task):
+    """Process-pool worker: decode and prepare one block-aligned chunk, sorted by time."""
+    pcap_file, start, end, state = task
+    rows = list(_prepare_all(iter_native_packets(pcap_file, start, end, state)))
+    rows.sort(key=itemgetter(0))
+    return rows
+
+
+def _bounded_submit(pool, fn, tasks, max_pending):
+    """Submit tasks lazily, yielding their futures in order with at most max_pending in flight."""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, task))
+        if len(pending) >= max_pending:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def _bounded_map(pool, fn, tasks, max_pending):
+    """Like pool.map, but keeps at most max_pending results in flight."""
+    for future in _bounded_submit(pool, fn, tasks, max_pending):
+        yield future.result()
+
+
+def merge_chunk_rows(chunk_results):
+    """Merge per-chunk sorted rows into one timestamp-ordered stream.
+
+    Rows later than the first packet of the next chunk are held back and merged
+    with it, so ordering is global as long as capture disorder spans less than
+    a chunk. Rows carry no resume point of their own; a (None, None, None,
+    resume) marker is yielded whenever every chunk up to ``resume`` has been
+    fully emitted and nothing after it has.
+    """
+    pending = []
+    pending_end = None
+    for (_start, end, _state, end_state), rows in chunk_results:
+        if rows:
+            next_start = rows[0][0]
+            cut = len(pending)
+            while cut and pending[cut - 1][0] > next_start:
+                cut -= 1
+            for row in pending[:cut]:
+                yield (*row, None)
+            if cut == len(pending) and pending_end is not None:
+                yield None, None, None, pending_end
+            pending = list(heapq.merge(pending[cut:], rows, key=itemgetter(0)))
+        elif not pending:
+            yield None, None, None, (end, end_state)
+        pending_end = (end, end_state)
+    # An empty last chunk was already marked inside the loop
+    if pending:
+        for row in pending:
+            yield (*row, None)
+        yield None, None, None, pending_end
+
+
+def iter_prepared_packets_parallel(pcap_file, workers=INGEST_WORKERS, chunk_bytes=INGEST_CHUNK_BYTES,
+                                   start=0, state=None):
+    """Decode a capture across a process pool, yielding rows in timestamp order."""
+    chunks = split_chunks(pcap_file, chunk_bytes, start, state)
+    tasks = [(pcap_file, chunk_start, end, chunk_state) for chunk_start, end, chunk_state, _ in chunks]
+    print(f"Decoding {len(tasks)} chunk(s) on {workers} worker(s)...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from merge_chunk_rows(zip(chunks, _bounded_map(pool, decode_chunk, tasks, workers * 2)))
+
+
+def process_ble_packets_optimized(pcap_file, conn, cursor, engine=INGEST_ENGINE,
+                                  workers=1, chunk_bytes=INGEST_CHUNK_BYTES,
+                                  start=0, state=None, checkpoint=None, provenance=None):
+    """Optimized BLE packet processing with batch operations and reduced DB calls
+
+    With ``checkpoint`` set, commits only happen at clean resume points and
+    ``checkpoint(offset, state, packet_count)`` is called inside each of those
+    transactions, so the recorded offset always matches the committed rows.
+    """
+    if workers > 1 and engine == 'native':
+        packets = iter_prepared_packets_parallel(pcap_file, workers, chunk_bytes, start, state)
+    else:
+        packets = iter_prepared_packets(pcap_file, engine, start, state)
+    return write_packets(packets, conn, cursor, checkpoint=checkpoint, provenance=provenance)
+
+
+def write_packets(packets, conn, cursor, checkpoint=None, provenance=None, identity_map=None, progress=None,
+                  replay_detector=None, identity_graph=None, device_stats=False):
+    """Single writer for a stream of (ts_us, packet_row, uuids, resume) tuples.
+
+    ``provenance`` is the (source_file, sensor_id) stored on every row. Pass a
+    shared ``identity_map`` to detect spoofing across several captures, and a
+    ``progress(packet_count)`` callable to replace the per-capture progress print.
+    With a ``replay_detector`` (StreamingReplayDetector), replays are flagged as
+    packets arrive and written to ReplayAlerts with each batch; fingerprints
+    it could not check in memory are queued in ReplayRecheck. With an
+    ``identity_graph`` (IdentityGraph), each commit also folds the rows it
+    writes into IdentityCluster, in the same transaction; ``device_stats``
+    does the same for DeviceStats.
+    """
+
+    if identity_map is None:
+        identity_map = defaultdict(set)
+    if provenance is None:
+        provenance = (None, None)
+
+    # Batch containers
+    packet_batch = []
+    uuid_batch = []
+    spoof_alerts = []
+    replay_alerts = []
+
+    batch_size = 1000  # Process in batches
+    packet_count = 0
+    uncommitted = 0
+    position = None
+
+    # Packet rows go through the store so both flat and normalized databases work
+    packet_store = PacketStore(cursor)
+
+    insert_uuid_sql = """
+    INSERT INTO BLEPacketUUID (ble_packet_id, uuid_type, uuid) VALUES (?, ?, ?)
+    """
+
+    def flush_batch():
+        nonlocal uncommitted, failed
+        if packet_batch:
+            if not process_batch(cursor, conn, packet_batch, uuid_batch, spoof_alerts,
+                                 packet_store, insert_uuid_sql, commit=False, replay_alerts=replay_alerts):
+                # The rollback also dropped every batch since the last commit; the checkpoint must stay there
+                packet_store.reset()
+                failed = True
+                raise RuntimeError(f"A batch of {len(packet_batch)} packet(s) could not be written; "
+                                   f"{uncommitted} earlier uncommitted packet(s) were rolled back with it")
+            uncommitted += len(packet_batch)
+            packet_batch.clear()
+            uuid_batch.clear()
+            spoof_alerts.clear()
+            replay_alerts.clear()
+
+    def commit():
+        nonlocal uncommitted
+        flush_batch()
+        if identity_graph is not None:
+            update_identity_clusters(cursor, identity_graph)
+        if device_stats:
+            update_device_stats(cursor)
+        if replay_detector is not None and replay_detector.recheck:
+            queue_replay_recheck(cursor, replay_detector.recheck)
+            replay_detector.recheck.clear()
+        if checkpoint is not None and position is not None:
+            checkpoint(position[0], position[1], packet_count)
+        conn.commit()
+        uncommitted = 0
+
+    completed = failed = False
+    try:
+        for _ts_us, packet_data, uuids, position in packets:
+            if packet_data is not None:
+                try:
+                    timestamp, dmac = packet_data[0], packet_data[1]
+                    company_id, manufacturer_data = packet_data[5], packet_data[6]
+
+                    # UUID rows reference the packet by its position in the batch
+                    packet_index = len(packet_batch)
+                    for uuid_type, uuid_str in uuids:
+                        uuid_batch.append((packet_index, uuid_type, uuid_str))
+                    packet_batch.append(packet_data + provenance)
+
+                    # Check for spoofing (optimized)
+                    for uuid_type, uuid_val in set(uuids):
+                        uuid_key = (uuid_type, uuid_val, company_id, manufacturer_data)
+                        identity_map[uuid_key].add(dmac)
+                        if len(identity_map[uuid_key]) > 1:
+                            spoof_alerts.append({
+                                'timestamp': timestamp,
+                                'uuid_type': uuid_key[0],
+                                'uuid': uuid_key[1],
+                                'company_id': uuid_key[2],
+                                'manufacturer_data': uuid_key[3],
+                                'conflicting_macs': list(identity_map[uuid_key])
+                            })
+
+                    if replay_detector is not None:
+                        fingerprint, ts_us = packet_data[8], packet_data[10]
+                        smac, rssi, distance = packet_data[2:5]
+                        alert = replay_detector.observe(fingerprint, ts_us,
+                                                        (packet_data[7], dmac, smac, rssi, distance))
+                        if alert is not None:
+                            first_seen_us, repeated_at_us, details = alert
+                            replay_alerts.append((fingerprint, details[0], first_seen_us, repeated_at_us,
+                                                  *details[1:]))
+
+                    packet_count += 1
+
+                    if packet_count % 10000 == 0:
+                        if progress is not None:
+                            progress(packet_count)
+                        else:
+                            print(f"Processed {packet_count} packets...")
+
+                except Exception as e:
+                    print(f"Error processing packet: {e}")
+                    continue
+
+            # Process batch when it reaches the limit
+            if len(packet_batch) >= batch_size:
+                flush_batch()
+            # Commit only where the capture offset matches the rows written so far
+            if uncommitted and (checkpoint is None or position is not None):
+                commit()
+        completed = True
+
+    finally:
+        # Process remaining batch (nothing is left to commit after a failed one)
+        if failed:
+            pass
+        elif completed or checkpoint is None or position is not None:
+            commit()
+        else:
+            # Interrupted between resume points: drop rows a re-run will decode again
+            conn.rollback()
+
     return packet_count
 
 
 def process_batch(cursor, conn, packet_batch, uuid_batch, spoof_alerts, 
-                 insert_packet_sql, insert_uuid_sql):
-    """Process a batch of packets efficiently"""
+                 packet_store, insert_uuid_sql, commit=True, replay_alerts=None):
+    """Process a batch of packets efficiently; returns False if it was rolled back"""
     
     try:
         # Batch insert packets
-        cursor.executemany(insert_packet_sql, packet_batch)
+        packet_store.insert_many(packet_batch)
         
         # Fetch last inserted row ID
         cursor.execute("SELECT last_insert_rowid()")
@@ -191,7 +464,6 @@ def process_batch(cursor, conn, packet_batch, uuid_batch, spoof_alerts,
         for packet_index, uuid_type, uuid_val in uuid_batch:
             actual_packet_id = start_packet_id + packet_index
             uuid_batch_with_ids.append((actual_packet_id, uuid_type, uuid_val))
-            print(f"🗃️ Inserting UUID into BLEPacketUUID: packet_id={actual_packet_id}, type={uuid_type}, uuid={uuid_val}")
         
         # Batch insert UUIDs
         if uuid_batch_with_ids:
@@ -199,22 +471,334 @@ def process_batch(cursor, conn, packet_batch, uuid_batch, spoof_alerts,
         
         # Insert spoof alerts
         for alert in spoof_alerts:
-            insert_spoof_alert(cursor, conn, alert)
+            insert_spoof_alert(cursor, conn, alert, commit=False)
+
+        if replay_alerts:
+            insert_replay_alerts(cursor, replay_alerts)
         
         # Commit the batch
-        conn.commit()
+        if commit:
+            conn.commit()
+        return True
         
     except Exception as e:
         print(f"Error processing batch: {e}")
         conn.rollback()
+        return False
+
+
+def capture_digest(path, length):
+    """SHA-256 of the first ``length`` bytes: identifies a capture across appends."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def resolve_capture_files(inputs):
+    """Expand capture files, directories and glob patterns into a sorted list of paths."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in INGEST_FILE_PATTERNS:
+                files.extend(glob.glob(os.path.join(item, pattern)))
+        elif any(ch in item for ch in '*?['):
+            files.extend(glob.glob(item, recursive=True))
+        else:
+            files.append(item)
+    return sorted(dict.fromkeys(os.path.abspath(f) for f in files))
+
+
+def sensor_id_for(path):
+    """Sensor that recorded a capture, taken from its file name (SENSOR_ID_PATTERN)."""
+    name = os.path.basename(path)
+    match = re.match(SENSOR_ID_PATTERN, name)
+    return match.group('sensor') if match else os.path.splitext(name)[0]
+
+
+def plan_capture(pcap_file, cursor, engine=INGEST_ENGINE, restart=False):
+    """Decide from the IngestState row whether to skip, resume or (re)ingest a capture.
+
+    A capture is identified by its path plus a hash of its leading bytes. An
+    unchanged, completed file is skipped; a partial or grown one continues
+    from the last committed block offset; a replaced one starts over, as does
+    every capture with ``restart`` or an engine that cannot resume. Starting
+    over sets plan['replace']: the rows of the earlier ingest are deleted
+    first (see start_capture).
+    """
+    path = os.path.abspath(pcap_file)
+    size = os.path.getsize(path)
+    plan = {'path': path, 'size': size, 'sensor_id': sensor_id_for(path), 'status': 'ingested',
+            'start': 0, 'state': None, 'packet_total': 0, 'replace': False}
+    previous = get_ingest_state(cursor, path)
+
+    if previous is not None and restart:
+        print(f"🔁 {pcap_file}: --restart, re-ingesting from the start.")
+    elif previous is not None:
+        hashed_bytes = previous['hashed_bytes'] or 0
+        same_file = hashed_bytes <= size and capture_digest(path, hashed_bytes) == previous['content_hash']
+        if previous['content_hash'] is None:
+            print(f"⚠️ {pcap_file} was interrupted before its first checkpoint; re-ingesting from the start.")
+        elif not same_file:
+            print(f"⚠️ {pcap_file} changed since its last ingest; re-ingesting from the start.")
+        elif previous['completed'] and size == previous['size']:
+            print(f"⏭️ {pcap_file} already ingested ({previous['packet_count']} packets), skipping.")
+            plan['status'] = 'skipped'
+        elif engine != 'native':
+            print(f"⚠️ The {engine} engine cannot resume; re-ingesting {pcap_file} from the start.")
+        else:
+            plan['start'] = previous['last_offset'] or 0
+            plan['state'] = json.loads(previous['section_state']) if previous['section_state'] else None
+            plan['packet_total'] = previous['packet_count'] or 0
+            plan['status'] = 'resumed'
+            print(f"↪️ Resuming {pcap_file} at byte {plan['start']:,} of {size:,}.")
+    plan['replace'] = previous is not None and plan['status'] == 'ingested'
+    return plan
+
+
+def start_capture(plan, conn, cursor, provenance):
+    """Before a capture is ingested from its first byte: delete the rows an earlier ingest of it left and record
+    it as started, so an interrupted run is replaced rather than duplicated by the next one.
+
+    Rows only carry the file name, so a capture whose name another ingested
+    path shares cannot be replaced (ValueError).
+    """
+    if plan['start']:
+        return
+    if plan['replace']:
+        name = os.path.basename(plan['path'])
+        others = [path for (path,) in cursor.execute('SELECT path FROM IngestState WHERE path != ?', (plan['path'],))
+                  if os.path.basename(path) == name]
+        if others:
+            raise ValueError(f"its packets cannot be told apart from those of {others[0]} (same file name); "
+                             f"rename the capture or ingest into a fresh database")
+        removed = delete_capture_packets(cursor, *provenance)
+        if removed:
+            print(f"🧹 {removed:,} packet(s) from the earlier ingest of {name} deleted.")
+    # No content hash yet: until the first checkpoint, a later run treats the capture as changed and replaces it
+    save_ingest_state(cursor, plan['path'], size=plan['size'], content_hash=None, hashed_bytes=0, last_offset=0,
+                      section_state=None, packet_count=0, completed=0)
+    conn.commit()
+
+
+def capture_checkpoint(plan, cursor):
+    """Checkpoint callback for write_packets that records a capture's progress in IngestState."""
+    path = plan['path']
+    identity = {'bytes': None, 'hash': None}
+
+    def checkpoint(offset, section_state, packet_count):
+        hashed_bytes = min(offset, INGEST_IDENTITY_BYTES)
+        if identity['bytes'] != hashed_bytes:
+            identity['bytes'], identity['hash'] = hashed_bytes, capture_digest(path, hashed_bytes)
+        save_ingest_state(cursor, path, size=plan['size'], content_hash=identity['hash'],
+                          hashed_bytes=hashed_bytes, last_offset=offset,
+                          section_state=json.dumps(section_state),
+                          packet_count=plan['packet_total'] + packet_count, completed=0)
+    return checkpoint
+
+
+def finish_capture(plan, conn, cursor, engine, packet_count):
+    """Mark a capture as fully ingested."""
+    path, size = plan['path'], plan['size']
+    if engine != 'native':
+        hashed_bytes = min(size, INGEST_IDENTITY_BYTES)
+        save_ingest_state(cursor, path, size=size, content_hash=capture_digest(path, hashed_bytes),
+                          hashed_bytes=hashed_bytes, last_offset=size, section_state=None,
+                          packet_count=packet_count)
+    save_ingest_state(cursor, path, size=size, completed=1)
+    conn.commit()
+
+
+class IngestProgress:
+    """One consolidated progress line for a multi-capture ingest."""
+
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.bytes_done = 0
+        self.packets_done = 0
+        self.started = time.perf_counter()
+
+    def __call__(self, file_packets=0):
+        packets = self.packets_done + file_packets
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(f"[{self.files_done}/{self.total_files} files] {packets:,} packets, "
+              f"{self.bytes_done / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB, {packets / elapsed:,.0f} pkt/s")
+
+    def file_done(self, packets, size):
+        self.files_done += 1
+        self.bytes_done += size
+        self.packets_done += packets
+        self()
+
+
+def should_defer_indexes(conn, pending_bytes, defer=INGEST_DEFER_INDEXES):
+    """Whether a load is large enough to drop the packet indexes and rebuild them afterwards."""
+    if defer != 'auto':
+        return bool(defer)
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return pending_bytes >= INGEST_DEFER_INDEX_RATIO * page_count * page_size
+
+
+def seed_replay_detector(cursor, detector):
+    """Prime the detector with the stored packets it would still hold, so an appended capture continues the stream."""
+    cursor.execute("SELECT MAX(timestamp_us) FROM BLEPacket")
+    newest = cursor.fetchone()[0]
+    if newest is None:
+        return
+    cursor.execute("""
+        SELECT content_fingerprint, timestamp_us, packet_hash, dmac, smac, rssi, distance FROM BLEPacket
+        WHERE timestamp_us > ? ORDER BY timestamp_us, id
+    """, (newest - detector.window_us - detector.reorder_us,))
+    detector.seed((row[0], row[1], row[2:]) for row in cursor.fetchall())
+
+
+def ingest_captures(inputs, conn, cursor, engine=INGEST_ENGINE, workers=1,
+                    chunk_bytes=INGEST_CHUNK_BYTES, restart=False, defer_indexes=INGEST_DEFER_INDEXES,
+                    replay_detection=INGEST_REPLAY_DETECTION, identity_clusters=INGEST_IDENTITY_CLUSTERS,
+                    device_stats=INGEST_DEVICE_STATS):
+    """Ingest every capture named by ``inputs`` (files, directories or globs).
+
+    With the native engine and workers > 1, the chunks of all captures share
+    one bounded process pool, so decoding runs ahead into the next files while
+    the single writer commits the current one. Every row records its source
+    file and sensor id. Large loads drop the secondary indexes first and
+    rebuild them once at the end (``defer_indexes``, see should_defer_indexes);
+    missing indexes are built at the end either way. With ``replay_detection``
+    one StreamingReplayDetector follows all captures in ingest order (the
+    fingerprints it queued for a recheck are recomputed at the end), and with
+    ``identity_clusters`` one IdentityGraph absorbs every commit (DeviceStats
+    likewise with ``device_stats``). Returns one summary dict per capture.
+    """
+    files = resolve_capture_files(inputs)
+    parallel = workers > 1 and engine == 'native'
+    results = []
+    plans = []
+    for pcap_file in files:
+        result = {'file': os.path.basename(pcap_file), 'sensor_id': sensor_id_for(pcap_file),
+                  'status': 'failed', 'packets': 0, 'seconds': 0.0}
+        results.append(result)
+        try:
+            plan = plan_capture(pcap_file, cursor, engine, restart)
+            if plan['status'] != 'skipped':
+                # Before the aggregates below are caught up, so they see the deletions
+                start_capture(plan, conn, cursor, (result['file'], result['sensor_id']))
+            if plan['status'] != 'skipped' and parallel:
+                plan['chunks'] = split_chunks(plan['path'], chunk_bytes, plan['start'], plan['state'])
+        except (OSError, ValueError) as e:
+            print(f"❌ {pcap_file}: {e}")
+            continue
+        result['status'] = plan['status']
+        if plan['status'] != 'skipped':
+            plan['result'] = result
+            plans.append(plan)
+
+    pending_bytes = sum(plan['size'] - plan['start'] for plan in plans)
+    replay_detector = None
+    if plans and replay_detection:
+        replay_detector = StreamingReplayDetector(REPLAY_TIME_WINDOW_SEC)
+        seed_replay_detector(cursor, replay_detector)
+    identity_graph = None
+    if plans and identity_clusters:
+        # Also catches up on packets written while the clusters were switched off
+        identity_graph, _ = update_identity_clusters(cursor)
+        conn.commit()
+    if plans and device_stats:
+        update_device_stats(cursor)
+        conn.commit()
+    if plans and should_defer_indexes(conn, pending_bytes, defer_indexes):
+        dropped = drop_indexes(cursor)
+        conn.commit()
+        if dropped:
+            print(f"⏸️ {len(dropped)} index(es) dropped for the bulk load; rebuilt when it finishes.")
+
+    progress = IngestProgress(len(plans), pending_bytes)
+    identity_map = defaultdict(set)
+    pool = ProcessPoolExecutor(max_workers=workers) if parallel and plans else None
+    try:
+        if pool is not None:
+            tasks = [(plan['path'], start, end, state)
+                     for plan in plans for start, end, state, _ in plan['chunks']]
+            print(f"Decoding {len(tasks)} chunk(s) from {len(plans)} capture(s) on {workers} worker(s)...")
+            futures = _bounded_submit(pool, decode_chunk, tasks, workers * 2)
+
+        for plan in plans:
+            result = plan['result']
+            started = time.perf_counter()
+            if pool is not None:
+                file_futures = islice(futures, len(plan['chunks']))
+                packets = merge_chunk_rows(zip(plan['chunks'], (f.result() for f in file_futures)))
+            else:
+                packets = iter_prepared_packets(plan['path'], engine, plan['start'], plan['state'])
+            try:
+                packet_count = write_packets(
+                    packets, conn, cursor,
+                    checkpoint=capture_checkpoint(plan, cursor) if engine == 'native' else None,
+                    provenance=(result['file'], result['sensor_id']),
+                    identity_map=identity_map, progress=progress, replay_detector=replay_detector,
+                    identity_graph=identity_graph, device_stats=device_stats)
+                finish_capture(plan, conn, cursor, engine, packet_count)
+            except Exception as e:
+                print(f"❌ {plan['path']}: {e}")
+                result['status'] = 'failed'
+                if pool is not None:
+                    deque(file_futures, maxlen=0)  # skip this capture's remaining chunks
+                packet_count = 0
+            result['packets'] = packet_count
+            result['seconds'] = time.perf_counter() - started
+            progress.file_done(packet_count, plan['size'] - plan['start'])
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        built, seconds = rebuild_indexes(conn)
+        if built:
+            print(f"🔧 Built {len(built)} index(es) in {seconds:.1f}s: {', '.join(built)}")
+        if replay_detector is not None:
+            rechecked = recheck_replay_alerts(cursor, replay_detector.window_us)
+            conn.commit()
+            if rechecked:
+                print(f"🔁 Replay alerts recomputed for {rechecked} fingerprint(s) that arrived out of order.")
+    return results
+
+
+def ingest_capture(pcap_file, conn, cursor, engine=INGEST_ENGINE, workers=1,
+                   chunk_bytes=INGEST_CHUNK_BYTES, restart=False):
+    """Ingest one capture, skipping or resuming it based on its IngestState row."""
+    results = ingest_captures([pcap_file], conn, cursor, engine, workers, chunk_bytes, restart)
+    return sum(result['packets'] for result in results)
+
+
+def print_ingest_summary(results, elapsed):
+    """Per-capture table plus totals for a multi-file ingest."""
+    print("\n📊 Ingest summary")
+    print(f"{'file':40s} {'sensor':12s} {'status':9s} {'packets':>10s} {'seconds':>8s}")
+    for result in results:
+        print(f"{result['file'][:40]:40s} {result['sensor_id'][:12]:12s} {result['status']:9s} "
+              f"{result['packets']:>10,d} {result['seconds']:>8.1f}")
+    total = sum(result['packets'] for result in results)
+    counts = defaultdict(int)
+    for result in results:
+        counts[result['status']] += 1
+    print(f"Files: {len(results)} ({', '.join(f'{n} {status}' for status, n in sorted(counts.items()))})")
+    print(f"Packets: {total:,} in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} pkt/s)")
 
 
 def process_ble_packets_ultra_fast(pcap_file, conn, cursor):
     """Ultra-fast version with minimal processing"""
-    
+    import pyshark
+
     capture = pyshark.FileCapture(pcap_file)
     
     # Prepare bulk insert
+    packet_store = PacketStore(cursor)
     packets = []
     packet_count = 0
     
@@ -244,21 +828,17 @@ def process_ble_packets_ultra_fast(pcap_file, conn, cursor):
                 if hasattr(pkt, 'nordic_ble') and hasattr(pkt.nordic_ble, 'rssi'):
                     try:
                         rssi = int(pkt.nordic_ble.rssi)
-                    except:
+                    except (ValueError, TypeError):
                         pass
                 
-                distance = rssi_to_distance(rssi) if rssi else None
+                distance = rssi_to_distance(rssi, *calibration_for(None, smac)) if rssi else None
                 
-                packets.append((timestamp, dmac, smac, rssi, distance, None, None, ''))
+                packets.append((timestamp, dmac, smac, rssi, distance, None, None, '', None, None, None, None, None))
                 packet_count += 1
                 
                 # Bulk insert every 5000 packets
                 if len(packets) >= 5000:
-                    cursor.executemany("""
-                        INSERT INTO BLEPacket (timestamp, dmac, smac, rssi, distance, 
-                                             company_id, manufacturer_data, packet_hash) 
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, packets)
+                    packet_store.insert_many(packets)
                     packets.clear()
                     
                     if packet_count % 50000 == 0:
@@ -266,17 +846,14 @@ def process_ble_packets_ultra_fast(pcap_file, conn, cursor):
                         conn.commit()
                         conn.execute("BEGIN TRANSACTION")
             
-            except:
+            except Exception as e:
+                print(f"Error processing packet: {e}")
                 continue
     
     finally:
         # Insert remaining packets
         if packets:
-            cursor.executemany("""
-                INSERT INTO BLEPacket (timestamp, dmac, smac, rssi, distance, 
-                                     company_id, manufacturer_data, packet_hash) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, packets)
+            packet_store.insert_many(packets)
         
         conn.commit()
         capture.close()
@@ -284,17 +861,47 @@ def process_ble_packets_ultra_fast(pcap_file, conn, cursor):
     return packet_count
 
 
-if __name__ == "__main__":
-    conn, cursor = init_db(DB_PATH)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest BLE sniffer captures into the SQLite database")
+    parser.add_argument('inputs', nargs='*', default=[PCAP_FILE],
+                        help="Capture files, directories or glob patterns (default: config.PCAP_FILE)")
+    parser.add_argument('--engine', choices=INGEST_ENGINES, default=INGEST_ENGINE,
+                        help="Packet decoder: built-in pcapng reader or pyshark/tshark")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                        help="Decoder processes for the native engine (1 = single process)")
+    parser.add_argument('--chunk-mb', type=float, default=INGEST_CHUNK_BYTES / 2**20,
+                        help="Approximate chunk size handed to each worker")
+    parser.add_argument('--restart', action='store_true',
+                        help="Ignore the stored checkpoints and ingest the captures from the start")
+    parser.add_argument('--defer-indexes', choices=('auto', 'always', 'never'), default=None,
+                        help="Drop the packet indexes during the load and rebuild them afterwards "
+                             "(default: config.INGEST_DEFER_INDEXES)")
+    parser.add_argument('--storage', choices=PACKET_STORAGE_MODES, default=PACKET_STORAGE,
+                        help="Packet layout when the database is created (an existing database keeps its own)")
+    args = parser.parse_args(argv)
+
+    conn, cursor = init_db(DB_PATH, storage=args.storage, indexes=False)
     
-    print("Processing BLE packets (optimized)...")
+    print(f"Processing BLE packets (optimized, {args.engine} engine)...")
+    started = time.perf_counter()
     
     # Choose processing method:
     # 1. Full featured but optimized
-    packet_count = process_ble_packets_optimized(PCAP_FILE, conn, cursor)
+    defer_indexes = {None: INGEST_DEFER_INDEXES, 'auto': 'auto', 'always': True, 'never': False}[args.defer_indexes]
+    results = ingest_captures(args.inputs, conn, cursor, engine=args.engine, workers=max(1, args.workers),
+                              chunk_bytes=int(args.chunk_mb * 2**20), restart=args.restart,
+                              defer_indexes=defer_indexes)
     
     # 2. Ultra-fast minimal processing (uncomment to use)
-    # packet_count = process_ble_packets_ultra_fast(PCAP_FILE, conn, cursor)
+    # packet_count = process_ble_packets_ultra_fast(args.inputs[0], conn, cursor)
     
     conn.close()
-    print(f"✅ {packet_count} BLE packets processed and saved.")
+    if not results:
+        print(f"⚠️ No capture files found in: {', '.join(args.inputs)}")
+        return
+    print_ingest_summary(results, time.perf_counter() - started)
+    print(f"✅ {sum(result['packets'] for result in results)} BLE packets processed and saved.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,148 @@
-import sqlite3
+import argparse
+import numpy as np
 import pandas as pd
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from config import DB_PATH, DOCS_DIR
-
-
-
-def load_data():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("""
-        SELECT 
-        BLEPacket.id,
-        BLEPacket.timestamp,
-        BLEPacket.dmac,
-        BLEPacket.smac,
-        BLEPacket.rssi,
-        BLEPacket.distance,
-        BLEPacket.company_id,
-        BLEPacket.manufacturer_data,
-        BLEPacket.packet_hash,
-        BLEPacketUUID.uuid_type,
-        BLEPacketUUID.uuid
-        FROM BLEPacket
-        LEFT JOIN BLEPacketUUID ON BLEPacket.id = BLEPacketUUID.ble_packet_id
-    """, conn)
+from config import DB_PATH, DOCS_DIR, DETECTOR_BACKENDS
+from utils.db_utils import (connect, packet_fingerprints, update_identity_clusters,
+                            identity_clusters_current, identity_cluster_summary, update_device_stats)
+from utils.frame_utils import read_packet_frame, read_device_stats, fill_missing
+from utils.profile_utils import count_rows_read
+from utils.time_utils import with_local_time
+from utils.incremental_utils import (read_watermark, write_watermark, current_max_id, current_generation,
+                                     max_timestamp_us, upsert_csv)
+
+# Thresholds of analyze_packets; a change makes the next run a full one
+ANALYSIS_PARAMS = {'rssi_thresh': 25, 'dist_thresh': 10, 'top_n': 10}
+# DetectorState row of the incremental run
+MACSPOOF_STATE = 'macSpoof'
+EVENT_COLUMNS = ['smac', 'timestamp', 'prev_fingerprint', 'fingerprint']
+ANOMALY_COLUMNS = ['smac', 'timestamp', 'rssi', 'prev_rssi', 'rssi_diff', 'distance', 'prev_distance', 'distance_diff']
+
+
+
+def has_payload_fingerprints(db_path):
+    """True when every packet carries payload_fingerprint (see dbMaintenance.py migrate)."""
+    conn = connect(db_path)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(BLEPacket)")}
+        if 'payload_fingerprint' not in columns:
+            return False
+        missing = conn.execute("""
+            SELECT EXISTS(SELECT 1 FROM BLEPacket WHERE payload_fingerprint IS NULL)
+        """).fetchone()[0]
+        return not missing
+    finally:
+        conn.close()
+
+def load_data(after_id=0, max_id=None):
+    """One row per packet (id in (after_id, max_id]); the UUIDs are already folded into the integer payload_fingerprint."""
+    conn = connect(DB_PATH)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(BLEPacket)")}
+    fingerprint = 'payload_fingerprint' if 'payload_fingerprint' in columns else 'NULL'
+    df = read_packet_frame(conn, f"""
+        SELECT id, timestamp_us AS timestamp, dmac, smac, rssi, distance, company_id, manufacturer_data,
+               packet_hash, {fingerprint} AS fingerprint
+        FROM BLEPacket WHERE id > ? AND id <= ?
+    """, (after_id, max_id if max_id is not None else 2 ** 63 - 1))
     conn.close()
     return df
 
 def normalize_data(df):
-    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601', errors='coerce')
-    df['dmac'] = df['dmac'].str.lower()
-    df['smac'] = df['smac'].str.lower()
-    df['company_id'] = df['company_id'].fillna('')
-    df['manufacturer_data'] = df['manufacturer_data'].fillna('')
-    df['uuid'] = df['uuid'].fillna('')
-    df['uuid_type'] = df['uuid_type'].fillna('')
-    df['packet_hash'] = df['packet_hash'].fillna('')
+    # Times and lower-case MACs already come from read_packet_frame
+    df['company_id'] = fill_missing(df['company_id'])
+    df['manufacturer_data'] = fill_missing(df['manufacturer_data'])
+    df['packet_hash'] = fill_missing(df['packet_hash'])
     df['rssi'] = pd.to_numeric(df['rssi'], errors='coerce').fillna(0)
     df['distance'] = pd.to_numeric(df['distance'], errors='coerce').fillna(0)
     return df
 
-def generate_fingerprints(df):
-    df['fingerprint'] = (
-        df['company_id'].astype(str) + '|' +
-        df['manufacturer_data'].astype(str) + '|' +
-        df['uuid_type'].astype(str) 
-        + ':' + df['uuid'].astype(str)
-        #making it less sensetive 
-        #   + '|' +
-        # df['rssi'].astype(str) + '|' +
-        # df['distance'].astype(str)
-    )
+def generate_fingerprints(df, batch_size=50000):
+    """Fill fingerprints the database does not store yet, as the ingester would have computed them."""
+    # Nullable integers: a float64 column would round 64-bit fingerprints
+    df['fingerprint'] = df['fingerprint'].astype('Int64')
+    missing = df.index[df['fingerprint'].isna()]
+    if len(missing):
+        print(f"⚠️ {len(missing)} paketin payload_fingerprint değeri yok, bellekte hesaplanıyor "
+              f"(kalıcı olması için: python scripts/dbMaintenance.py migrate).")
+        conn = connect(DB_PATH)
+        try:
+            packets = df.loc[missing, ['id', 'dmac', 'company_id', 'manufacturer_data']].sort_values('id')
+            computed = {}
+            for i in range(0, len(packets), batch_size):
+                chunk = list(packets.iloc[i:i + batch_size].itertuples(index=False, name=None))
+                for _content, payload, packet_id in packet_fingerprints(conn.cursor(), chunk):
+                    computed[packet_id] = payload
+            df.loc[missing, 'fingerprint'] = df.loc[missing, 'id'].map(computed).astype('Int64')
+        finally:
+            conn.close()
     return df
 
 def detect_fingerprint_changes(df):
     df_sorted = df.sort_values(['smac', 'timestamp'])
-    df_sorted['prev_fingerprint'] = df_sorted.groupby('smac')['fingerprint'].shift()
+    df_sorted['prev_fingerprint'] = df_sorted.groupby('smac', observed=True)['fingerprint'].shift()
     df_sorted['fingerprint_changed'] = df_sorted['fingerprint'] != df_sorted['prev_fingerprint']
     return df_sorted[df_sorted['fingerprint_changed'] & df_sorted['prev_fingerprint'].notnull()]
 
+# load_data() + normalize_data() as SQL, with LAG() over one smac ordering; ties keep the pandas order (packet id)
+SEQUENCE_SQL = """
+    WITH packets AS (
+        SELECT id, timestamp_us AS timestamp, lower(dmac) AS dmac, lower(smac) AS smac,
+               COALESCE(rssi, 0) AS rssi, COALESCE(distance, 0) AS distance,
+               COALESCE(company_id, '') AS company_id, COALESCE(manufacturer_data, '') AS manufacturer_data,
+               COALESCE(packet_hash, '') AS packet_hash, payload_fingerprint AS fingerprint
+        FROM BLEPacket
+        WHERE smac IS NOT NULL
+    ),
+    sequence AS (
+        SELECT *, {lags}
+        FROM packets
+        WINDOW ordered AS (PARTITION BY smac ORDER BY timestamp IS NULL, timestamp, id)
+    )
+    SELECT * FROM sequence
+    WHERE {condition}
+    ORDER BY smac, timestamp IS NULL, timestamp, id
+"""
+
+def read_sequence_alerts(db_path, lags, condition, params=()):
+    conn = connect(db_path)
+    try:
+        df = read_packet_frame(conn, SEQUENCE_SQL.format(lags=lags, condition=condition), params)
+    finally:
+        conn.close()
+    df['fingerprint'] = df['fingerprint'].astype('Int64')
+    return df
+
+def detect_fingerprint_changes_sql(db_path):
+    """SQL backend of detect_fingerprint_changes: only the change events leave SQLite.
+
+    Reads the stored payload_fingerprint, so it needs has_payload_fingerprints(db_path).
+    """
+    df = read_sequence_alerts(db_path, "LAG(fingerprint) OVER ordered AS prev_fingerprint",
+                              "prev_fingerprint IS NOT NULL AND fingerprint <> prev_fingerprint")
+    df['prev_fingerprint'] = df['prev_fingerprint'].astype('Int64')
+    df['fingerprint_changed'] = True
+    return df
+
+def detect_rssi_distance_anomalies_sql(db_path, rssi_thresh=25, dist_thresh=10):
+    """SQL backend of detect_rssi_distance_anomalies: only the anomalous rows leave SQLite."""
+    df = read_sequence_alerts(db_path, "LAG(rssi) OVER ordered AS prev_rssi, LAG(distance) OVER ordered AS prev_distance",
+                              "prev_rssi IS NOT NULL AND (abs(rssi - prev_rssi) > ? OR abs(distance - prev_distance) > ?)",
+                              (rssi_thresh, dist_thresh))
+    df['prev_rssi'] = df['prev_rssi'].astype(float)
+    df['rssi_diff'] = (df['rssi'] - df['prev_rssi']).abs()
+    df['distance_diff'] = (df['distance'] - df['prev_distance']).abs()
+    return df
+
 def detect_packet_hash_anomalies(df):
-    return df.groupby('smac')['packet_hash'].nunique().reset_index(name='hash_variants')
+    return df.groupby('smac', observed=True)['packet_hash'].nunique().reset_index(name='hash_variants')
 
 def detect_rssi_distance_anomalies(df, rssi_thresh=25, dist_thresh=10):
     df_sorted = df.sort_values(['smac', 'timestamp'])
-    df_sorted['prev_rssi'] = df_sorted.groupby('smac')['rssi'].shift()
-    df_sorted['prev_distance'] = df_sorted.groupby('smac')['distance'].shift()
+    by_smac = df_sorted.groupby('smac', observed=True)
+    df_sorted['prev_rssi'] = by_smac['rssi'].shift()
+    df_sorted['prev_distance'] = by_smac['distance'].shift()
     df_sorted['rssi_diff'] = abs(df_sorted['rssi'] - df_sorted['prev_rssi'])
     df_sorted['distance_diff'] = abs(df_sorted['distance'] - df_sorted['prev_distance'])
     anomalies = df_sorted[
@@ -77,10 +153,10 @@ def detect_rssi_distance_anomalies(df, rssi_thresh=25, dist_thresh=10):
     return anomalies
 
 def generate_statistics(df):
-    fingerprint_counts = df.groupby('smac')['fingerprint'].nunique().reset_index()
+    fingerprint_counts = df.groupby('smac', observed=True)['fingerprint'].nunique().reset_index()
     fingerprint_counts.columns = ['smac', 'unique_fingerprints']
 
-    heuristic_stats = df.groupby('smac').agg({
+    heuristic_stats = df.groupby('smac', observed=True).agg({
         'dmac': pd.Series.nunique,
         'timestamp': ['min', 'max', 'count']
     }).reset_index()
@@ -88,6 +164,23 @@ def generate_statistics(df):
 
     return fingerprint_counts, heuristic_stats
 
+def load_device_stats(db_path):
+    """generate_statistics' two frames from DeviceStats, after folding in the packets since its last update.
+
+    packet_count is every packet of the device; the reference counts those with a timestamp.
+    """
+    conn = connect(db_path, 'state')
+    cursor = conn.cursor()
+    try:
+        update_device_stats(cursor)
+        conn.commit()
+        stats = read_device_stats(conn)
+    finally:
+        conn.close()
+    fingerprint_counts = stats[['smac', 'unique_fingerprints']]
+    heuristic_stats = stats[['smac', 'unique_dmacs', 'first_seen', 'last_seen', 'packet_count']]
+    return fingerprint_counts, heuristic_stats
+
 def generate_alerts(fingerprint_counts, heuristic_stats, hash_anomalies):
     merged = pd.merge(fingerprint_counts, heuristic_stats, on='smac', how='outer').fillna(0)
     merged = pd.merge(merged, hash_anomalies, on='smac', how='left')
@@ -102,44 +195,373 @@ def generate_alerts(fingerprint_counts, heuristic_stats, hash_anomalies):
     ].copy()
     return alerts, merged
 
-def export_top_patterns(df):
-    top_uuids = df['uuid'].value_counts().head(10).reset_index()
-    top_uuids.columns = ['uuid', 'count']
-    top_uuids.to_csv(os.path.join(DOCS_DIR, "Top_UUIDs.csv"), index=False)
+def _group_codes(values):
+    """Integer codes in sorted value order (NA = -1), reusing a categorical's own codes."""
+    if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.is_monotonic_increasing:
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values, sort=True)
+
+def _nunique_per_group(group_ids, n_groups, values):
+    """values.groupby(group_ids).nunique(), counted from the distinct (group, value) pairs; -1 = no group."""
+    codes, uniques = pd.factorize(values)
+    keep = (codes >= 0) & (group_ids >= 0)
+    pairs = pd.unique(group_ids[keep] * (len(uniques) + 1) + codes[keep])
+    return np.bincount(pairs // (len(uniques) + 1), minlength=n_groups)
+
+def analyze_packets(df, rssi_thresh=25, dist_thresh=10, top_n=10, statistics=True):
+    """Every per-device pandas step of main() from one (smac, timestamp) ordering.
+
+    Same results as detect_fingerprint_changes, detect_rssi_distance_anomalies,
+    generate_statistics, detect_packet_hash_anomalies and the manufacturer
+    counts of export_top_patterns (kept as the reference). One stable argsort
+    replaces their two full-frame sorts and five groupbys: shifts, group
+    boundaries and per-device aggregates are array operations on the sorted
+    row order, each temporary is released after its step, and only the alert
+    rows are copied out of df. With statistics=False the distinct counts
+    of generate_statistics are skipped and fingerprint_counts /
+    heuristic_stats are None (main() reads them from DeviceStats).
+    last_packets holds each device's latest row, where an incremental run
+    picks up the sequence.
+    """
+    smac_codes, smacs = _group_codes(df['smac'])
+    # NaT sorts last within a device, as in sort_values
+    sort_key = df['timestamp'].to_numpy(dtype='datetime64[us]').view('int64').copy()
+    missing_time = sort_key == np.iinfo(np.int64).min
+    sort_key[missing_time] = np.iinfo(np.int64).max
+    order = np.lexsort((sort_key, smac_codes))
+    order = order[smac_codes[order] >= 0]  # rows without a smac are not grouped
 
-    top_manufacturers = df['manufacturer_data'].value_counts().head(10).reset_index()
+    sorted_groups = smac_codes[order]
+    first_of_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]] if len(order) else np.zeros(0, bool)
+    starts = np.flatnonzero(first_of_group)
+    has_prev = ~first_of_group
+    n_groups = len(starts)
+    devices = smacs.take(sorted_groups[starts])
+    last_packets = df.iloc[order[np.r_[starts[1:], len(order)] - 1]] if n_groups else df.iloc[:0]
+    last_packets = last_packets[['smac', 'timestamp', 'fingerprint', 'rssi', 'distance']].copy()
+    del sorted_groups
+
+    # Change events: position k of the sorted order against k - 1
+    fingerprints = df['fingerprint'].astype('Int64').array
+    ordered = fingerprints[order]
+    prev_fingerprints = ordered.shift(1)
+    changed = ((ordered != prev_fingerprints).fillna(False) & ~prev_fingerprints.isna()).to_numpy(bool) & has_prev
+    steps = np.flatnonzero(changed)
+    fingerprint_change_events = df.iloc[order[steps]].copy()
+    fingerprint_change_events['prev_fingerprint'] = prev_fingerprints[steps]
+    fingerprint_change_events['fingerprint_changed'] = True
+    del ordered, prev_fingerprints, changed
+
+    rssi = df['rssi'].to_numpy(dtype='float64')[order]
+    distance = df['distance'].to_numpy(dtype='float64')[order]
+    rssi_diff = np.abs(np.diff(rssi, prepend=np.nan))
+    distance_diff = np.abs(np.diff(distance, prepend=np.nan))
+    steps = np.flatnonzero(((rssi_diff > rssi_thresh) | (distance_diff > dist_thresh)) & has_prev)
+    rssi_distance_anomalies = df.iloc[order[steps]].copy()
+    rssi_distance_anomalies['prev_rssi'] = rssi[steps - 1]
+    rssi_distance_anomalies['prev_distance'] = distance[steps - 1]
+    rssi_distance_anomalies['rssi_diff'] = rssi_diff[steps]
+    rssi_distance_anomalies['distance_diff'] = distance_diff[steps]
+    del rssi, distance, rssi_diff, distance_diff
+
+    # Per-device aggregates over the contiguous groups of the sorted order
+    if n_groups:
+        sorted_times = sort_key[order]
+        first_seen = np.minimum.reduceat(sorted_times, starts)
+        sorted_times[sorted_times == np.iinfo(np.int64).max] = np.iinfo(np.int64).min
+        last_seen = np.maximum.reduceat(sorted_times, starts)
+        # Like the reference's timestamp 'count': packets with a time
+        packet_count = np.add.reduceat(~missing_time[order], starts, dtype='int64')
+        del sorted_times
+    else:
+        first_seen = last_seen = packet_count = np.zeros(0, dtype='int64')
+    first_seen[first_seen == np.iinfo(np.int64).max] = np.iinfo(np.int64).min
+    del sort_key, missing_time
+
+    # Group of every row in df's own order, so the value columns need no reordering
+    group_ids = np.full(len(df), -1, dtype='int64')
+    group_ids[order] = np.cumsum(first_of_group) - 1
+    del order, has_prev, first_of_group
+    fingerprint_counts = heuristic_stats = None
+    if statistics:
+        fingerprint_counts = pd.DataFrame({
+            'smac': devices,
+            'unique_fingerprints': _nunique_per_group(group_ids, n_groups, df['fingerprint']),
+        })
+        heuristic_stats = pd.DataFrame({
+            'smac': devices,
+            'unique_dmacs': _nunique_per_group(group_ids, n_groups, df['dmac']),
+            'first_seen': first_seen.view('datetime64[us]'),
+            'last_seen': last_seen.view('datetime64[us]'),
+            'packet_count': packet_count,
+        })
+    hash_anomalies = pd.DataFrame({
+        'smac': devices,
+        'hash_variants': _nunique_per_group(group_ids, n_groups, df['packet_hash']),
+    })
+    del group_ids
+
+    manufacturer_counts = df['manufacturer_data'].value_counts()
+    top_manufacturers = manufacturer_counts.head(top_n).reset_index()
     top_manufacturers.columns = ['manufacturer_data', 'count']
+    return {
+        'fingerprint_change_events': fingerprint_change_events,
+        'rssi_distance_anomalies': rssi_distance_anomalies,
+        'fingerprint_counts': fingerprint_counts,
+        'heuristic_stats': heuristic_stats,
+        'hash_anomalies': hash_anomalies,
+        'top_manufacturers': top_manufacturers,
+        'manufacturer_counts': manufacturer_counts,
+        'last_packets': last_packets,
+    }
+
+def load_top_uuids(limit=10):
+    conn = connect(DB_PATH)
+    try:
+        top_uuids = pd.read_sql_query("""
+            SELECT uuid, COUNT(*) AS count FROM BLEPacketUUID
+            GROUP BY uuid ORDER BY count DESC, uuid LIMIT ?
+        """, conn, params=(limit,))
+    finally:
+        conn.close()
+    count_rows_read(len(top_uuids))
+    return top_uuids
+
+def export_top_patterns(top_manufacturers, top_uuids=None):
+    if top_uuids is None:
+        top_uuids = load_top_uuids()
+    top_uuids.to_csv(os.path.join(DOCS_DIR, "Top_UUIDs.csv"), index=False)
+
     top_manufacturers.to_csv(os.path.join(DOCS_DIR, "Top_ManufacturerData.csv"), index=False)
 
-def save_csvs(fingerprint_change_events, alerts, rssi_distance_anomalies):
-    fingerprint_change_events[['smac', 'timestamp', 'prev_fingerprint', 'fingerprint']].to_csv(
-        os.path.join(DOCS_DIR, "Fingerprint_Change_Events.csv"), index=False)
+def export_identity_clusters(db_path):
+    """Bring IdentityCluster up to date with the packets since the last run and export the multi-MAC clusters.
+
+    A graph built before packet rows were rewritten in place is rebuilt from every packet.
+    """
+    conn = connect(db_path, 'state')
+    cursor = conn.cursor()
+    try:
+        if not identity_clusters_current(cursor):
+            print("🔁 Kimlik grafiği yeniden kuruluyor: paket satırları yerinde değiştirildi.")
+        _graph, consumed = update_identity_clusters(cursor)
+        conn.commit()
+        count_rows_read(consumed)
+        summary = identity_cluster_summary(cursor)
+        clusters = pd.read_sql_query("""
+            SELECT cluster, COUNT(*) AS mac_count, GROUP_CONCAT(mac, ';') AS macs
+            FROM IdentityCluster GROUP BY cluster HAVING COUNT(*) > 1
+            ORDER BY mac_count DESC, cluster
+        """, conn)
+    finally:
+        conn.close()
+    count_rows_read(len(clusters))
+    clusters.to_csv(os.path.join(DOCS_DIR, "MAC_Identity_Clusters.csv"), index=False)
+    print(f"🧩 Kimlik grafiği: {consumed:,} yeni paket işlendi; {summary['macs']:,} MAC -> "
+          f"{summary['clusters']:,} cihaz kümesi ({len(clusters):,} küme birden fazla MAC içeriyor). "
+          f"MAC_Identity_Clusters.csv kaydedildi.")
+
+def count_uuids(db_path, after_id=0, max_id=None):
+    """uuid -> BLEPacketUUID rows of the packets with id in (after_id, max_id]."""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT uuid, COUNT(*) FROM BLEPacketUUID
+            WHERE ble_packet_id > ? AND ble_packet_id <= ? AND uuid IS NOT NULL GROUP BY uuid
+        """, (after_id, max_id if max_id is not None else 2 ** 63 - 1)).fetchall()
+    finally:
+        conn.close()
+    count_rows_read(len(rows))
+    return dict(rows)
+
+def count_new_hash_variants(db_path, after_id, max_id):
+    """Per smac, the packet_hash values of packets (after_id, max_id] none of its earlier packets had.
+
+    One query: the distinct (smac, packet_hash) pairs of the new packets, less
+    the pairs already seen up to after_id, which are looked up by hash on
+    idx_blepacket_hash_time. A missing hash counts as '' like in fill_missing;
+    MACs are stored lower-case (dbMaintenance.py lowercase-macs).
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("""
+            WITH new AS (
+                SELECT DISTINCT smac, COALESCE(packet_hash, '') AS packet_hash FROM BLEPacket
+                WHERE id > :after_id AND id <= :max_id AND smac IS NOT NULL
+            ),
+            earlier AS (
+                SELECT p.smac, COALESCE(p.packet_hash, '') AS packet_hash
+                FROM (SELECT DISTINCT packet_hash FROM new) h
+                JOIN BLEPacket p ON p.packet_hash = h.packet_hash
+                WHERE p.id <= :after_id
+                UNION
+                SELECT smac, '' FROM BLEPacket
+                WHERE packet_hash IS NULL AND id <= :after_id AND EXISTS (SELECT 1 FROM new WHERE packet_hash = '')
+            )
+            SELECT smac, COUNT(*) FROM (SELECT smac, packet_hash FROM new EXCEPT SELECT smac, packet_hash FROM earlier)
+            GROUP BY smac
+        """, {'after_id': after_id, 'max_id': max_id}).fetchall()
+        count_rows_read(len(rows))
+        return dict(rows)
+    finally:
+        conn.close()
+
+def top_counts(counts, column, top_n):
+    """The top_n entries of a value -> count dict as a two-column frame, ties in value order ('' last, as in value_counts)."""
+    top = sorted(counts.items(), key=lambda item: (-item[1], item[0] == '', item[0]))[:top_n]
+    return pd.DataFrame(top, columns=[column, 'count'])
+
+def latest_packets(last_packets):
+    """smac -> [fingerprint, rssi, distance, timestamp_us] of analyze_packets' last_packets, as JSON values."""
+    return {smac: [int(fingerprint), float(rssi), float(distance), int(timestamp.value // 1000)]
+            for smac, timestamp, fingerprint, rssi, distance in zip(
+                last_packets['smac'].astype(str), last_packets['timestamp'], last_packets['fingerprint'],
+                last_packets['rssi'], last_packets['distance'])}
+
+def spoofing_state(analysis, uuid_counts, untimed):
+    """Carry-over of a full run: each device's latest packet, the hash variant counts and the pattern counters."""
+    hash_anomalies = analysis['hash_anomalies']
+    return {
+        'devices': latest_packets(analysis['last_packets']),
+        'hash_variants': dict(zip(hash_anomalies['smac'].astype(str), hash_anomalies['hash_variants'].tolist())),
+        'manufacturers': {str(value): int(count) for value, count in analysis['manufacturer_counts'].items() if count},
+        'uuids': uuid_counts,
+        'untimed': bool(untimed),
+    }
+
+def update_spoofing_analysis(db_path, watermark):
+    """analyze_packets over the packets after the watermark, continuing each device's sequence from the state.
+
+    Each device's latest earlier packet is put in front of its new ones, so
+    fingerprint changes and RSSI / distance jumps across the watermark are
+    found too; the new events are merged into the CSVs in the full run's
+    (smac, timestamp) order. Hash variants and the manufacturer / UUID
+    counters are carried as counts, the per-device statistics come from
+    DeviceStats. Returns the analysis for generate_alerts / save_csvs and the
+    updated state; the event frames hold only the new rows.
+    """
+    last_id, max_id = watermark['last_id'], watermark['max_id']
+    state = watermark['state']
+    df = normalize_data(load_data(last_id, max_id))
+    df['fingerprint'] = df['fingerprint'].astype('Int64')
+    df['smac'] = df['smac'].astype('str')
+    carried = [(smac, *state['devices'][smac]) for smac in df['smac'].dropna().unique() if smac in state['devices']]
+    carry = pd.DataFrame(carried, columns=['smac', 'fingerprint', 'rssi', 'distance', 'timestamp'])
+    carry['fingerprint'] = carry['fingerprint'].astype('Int64')
+    carry['timestamp'] = carry['timestamp'].astype('int64').astype('datetime64[us]')
+    carry = carry.astype({'rssi': df['rssi'].dtype, 'distance': df['distance'].dtype})
+    combined = pd.concat([carry, df[carry.columns]], ignore_index=True)
+    combined['packet_hash'] = ''
+    combined['manufacturer_data'] = ''
+    analysis = analyze_packets(combined, ANALYSIS_PARAMS['rssi_thresh'], ANALYSIS_PARAMS['dist_thresh'],
+                               statistics=False)
+    del combined, carry
+
+    for smac, variants in count_new_hash_variants(db_path, last_id, max_id).items():
+        state['hash_variants'][smac] = state['hash_variants'].get(smac, 0) + variants
+    for value, count in df['manufacturer_data'].astype(str).value_counts().items():
+        state['manufacturers'][value] = state['manufacturers'].get(value, 0) + int(count)
+    for uuid, count in count_uuids(db_path, last_id, max_id).items():
+        state['uuids'][uuid] = state['uuids'].get(uuid, 0) + count
+    del df
+
+    state['devices'].update(latest_packets(analysis['last_packets']))
+    analysis['hash_anomalies'] = pd.DataFrame(list(state['hash_variants'].items()), columns=['smac', 'hash_variants'])
+    analysis['top_manufacturers'] = top_counts(state['manufacturers'], 'manufacturer_data', ANALYSIS_PARAMS['top_n'])
+    analysis['top_uuids'] = top_counts(state['uuids'], 'uuid', ANALYSIS_PARAMS['top_n'])
+    return analysis, state
+
+def save_csvs(fingerprint_change_events, alerts, rssi_distance_anomalies, merge=False):
+    """Write the three result CSVs, times in local time; with merge=True the event frames are new rows merged into the existing files."""
+    events_path = os.path.join(DOCS_DIR, "Fingerprint_Change_Events.csv")
+    anomalies_path = os.path.join(DOCS_DIR, "RSSI_Distance_Anomalies.csv")
+    if merge:
+        by_time = {'timestamp': lambda values: pd.to_datetime(values, format='ISO8601')}
+        upsert_csv(events_path, with_local_time(fingerprint_change_events[EVENT_COLUMNS], ['timestamp']), (),
+                   sort_by=['smac', 'timestamp'], parse=by_time)
+    else:
+        with_local_time(fingerprint_change_events[EVENT_COLUMNS], ['timestamp']).to_csv(events_path, index=False)
     print("📌 Fingerprint_Change_Events.csv kaydedildi.")
 
     alerts.sort_values('packet_count', ascending=False, inplace=True)
-    alerts.to_csv(os.path.join(DOCS_DIR, "MACSpoofing_CombinedAlerts.csv"), index=False)
+    with_local_time(alerts, ['first_seen', 'last_seen']).to_csv(
+        os.path.join(DOCS_DIR, "MACSpoofing_CombinedAlerts.csv"), index=False)
     print("✔️ MACSpoofing_CombinedAlerts.csv dosyası oluşturuldu.")
 
-    rssi_distance_anomalies[['smac', 'timestamp', 'rssi', 'prev_rssi', 'rssi_diff', 'distance', 'prev_distance', 'distance_diff']].to_csv(
-        os.path.join(DOCS_DIR, "RSSI_Distance_Anomalies.csv"), index=False)
+    if merge:
+        upsert_csv(anomalies_path, with_local_time(rssi_distance_anomalies[ANOMALY_COLUMNS], ['timestamp']), (),
+                   sort_by=['smac', 'timestamp'], parse=by_time)
+    else:
+        with_local_time(rssi_distance_anomalies[ANOMALY_COLUMNS], ['timestamp']).to_csv(anomalies_path, index=False)
     print("⚠️ RSSI_Distance_Anomalies.csv kaydedildi.")
 
     print("📌 Top_UUIDs.csv ve Top_ManufacturerData.csv oluşturuldu.")
 
-def main():
-    df = load_data()
-    df = normalize_data(df)
-    df = generate_fingerprints(df)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect MAC spoofing")
+    parser.add_argument('--backend', choices=('pandas', 'sql'),
+                        help="Run the fingerprint-change and RSSI/distance detectors in pandas or as SQLite "
+                             "window-function queries (default: DETECTOR_BACKENDS in config.py)")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-analyze every packet instead of only those added since the last run, "
+                             "with the per-device statistics recomputed from BLEPacket rather than read from DeviceStats")
+    args = parser.parse_args(argv)
+    backends = {name: args.backend or DETECTOR_BACKENDS[name] for name in ('fingerprint_changes', 'rssi_distance')}
+
+    # Only the packets after the last run's watermark are analyzed, unless --full
+    stored_fingerprints = has_payload_fingerprints(DB_PATH)
+    outputs = [os.path.join(DOCS_DIR, name) for name in ("Fingerprint_Change_Events.csv", "RSSI_Distance_Anomalies.csv")]
+    if args.full:
+        watermark, reason = None, "--full"
+    elif not stored_fingerprints:
+        watermark, reason = None, "payload_fingerprint is incomplete"
+    else:
+        watermark, reason = read_watermark(DB_PATH, MACSPOOF_STATE, ANALYSIS_PARAMS)
+        if watermark is not None and watermark['state']['untimed']:
+            watermark, reason = None, "the last run saw packets without a timestamp"
+
+    if watermark is not None:
+        max_id, generation = watermark['max_id'], watermark['generation']
+        analysis, state = update_spoofing_analysis(DB_PATH, watermark)
+        print(f"⏩ Packets {watermark['last_id'] + 1:,}-{max_id:,} analyzed: "
+              f"{len(analysis['fingerprint_change_events'])} new fingerprint change(s), "
+              f"{len(analysis['rssi_distance_anomalies'])} new RSSI/distance jump(s).")
+        analysis['fingerprint_counts'], analysis['heuristic_stats'] = load_device_stats(DB_PATH)
+    else:
+        print(f"🔁 Full analysis ({reason}).")
+        max_id, generation = current_max_id(DB_PATH), current_generation(DB_PATH)
+        df = load_data(max_id=max_id)
+        df = normalize_data(df)
+        df = generate_fingerprints(df)
+        untimed = df['timestamp'].isna().any()
+        if backends['fingerprint_changes'] == 'sql' and not stored_fingerprints:
+            print("⚠️ SQL backend saklanan payload_fingerprint değerlerini okur; parmak izi değişimleri pandas ile aranıyor.")
+            backends['fingerprint_changes'] = 'pandas'
 
-    fingerprint_change_events = detect_fingerprint_changes(df)
-    fingerprint_counts, heuristic_stats = generate_statistics(df)
-    hash_anomalies = detect_packet_hash_anomalies(df)
-    rssi_distance_anomalies = detect_rssi_distance_anomalies(df)
+        # Per-device counts come from DeviceStats once the stored fingerprints are complete;
+        # --full recomputes them from the packets themselves
+        from_packets = args.full or not stored_fingerprints
+        analysis = analyze_packets(df, ANALYSIS_PARAMS['rssi_thresh'], ANALYSIS_PARAMS['dist_thresh'],
+                                   ANALYSIS_PARAMS['top_n'], statistics=from_packets)
+        del df
+        if not from_packets:
+            analysis['fingerprint_counts'], analysis['heuristic_stats'] = load_device_stats(DB_PATH)
+        if backends['fingerprint_changes'] == 'sql':
+            analysis['fingerprint_change_events'] = detect_fingerprint_changes_sql(DB_PATH)
+        if backends['rssi_distance'] == 'sql':
+            analysis['rssi_distance_anomalies'] = detect_rssi_distance_anomalies_sql(DB_PATH)
+        state = spoofing_state(analysis, count_uuids(DB_PATH, max_id=max_id), untimed) if stored_fingerprints else None
 
-    alerts, merged = generate_alerts(fingerprint_counts, heuristic_stats, hash_anomalies)
+    alerts, merged = generate_alerts(analysis['fingerprint_counts'], analysis['heuristic_stats'],
+                                     analysis['hash_anomalies'])
 
-    export_top_patterns(df)
-    save_csvs(fingerprint_change_events, alerts, rssi_distance_anomalies)
+    export_top_patterns(analysis['top_manufacturers'], analysis.get('top_uuids'))
+    export_identity_clusters(DB_PATH)
+    save_csvs(analysis['fingerprint_change_events'], alerts, analysis['rssi_distance_anomalies'],
+              merge=watermark is not None)
+    if state is not None:
+        state['max_ts_us'] = max_timestamp_us(DB_PATH, max_id)
+        write_watermark(DB_PATH, MACSPOOF_STATE, max_id, ANALYSIS_PARAMS, state, outputs, generation)
 
 if __name__ == "__main__":
     main()
@@ -1,57 +1,145 @@
-import sqlite3
+import argparse
+import math
 import pandas as pd
 import numpy as np
 import os
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from config import DB_PATH, DOCS_DIR
+from config import DB_PATH, DOCS_DIR, DETECTOR_BACKENDS
+from utils.db_utils import connect
+from utils.frame_utils import read_packet_frame
+from utils.profile_utils import count_rows_read, counted_rows
+from utils.time_utils import with_local_time
+from utils.incremental_utils import (read_watermark, write_watermark, current_max_id, current_generation,
+                                     max_timestamp_us, append_csv, upsert_csv)
 
 # === Parameters ===
 DISTANCE_THRESHOLD_M = 40      # meters
 MIN_TIME_WINDOW_SEC = 1        # seconds
 
+# ProximityAnomalyAlerts.csv: one row per episode; timestamp_1 ... distance_2 describe its largest jump
+EPISODE_COLUMNS = ['smac', 'start', 'end', 'duration_sec', 'pair_count', 'peak_distance_diff',
+                   'timestamp_1', 'distance_1', 'timestamp_2', 'distance_2', 'time_window_sec']
+EPISODE_TIME_COLUMNS = ('start', 'end', 'timestamp_1', 'timestamp_2')
+# The times of a pair; like the episode times, UTC in the analysis and local time in the CSVs
+PAIR_TIME_COLUMNS = ('timestamp_1', 'timestamp_2')
+# DetectorState row of the incremental run
+PROXIMITY_STATE = 'proximityAlert'
+
 
 
 def load_distance_data(db_path):
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query("""
-        SELECT timestamp, smac, distance
+    conn = connect(db_path)
+    df = read_packet_frame(conn, """
+        SELECT timestamp_us AS timestamp, smac, distance
         FROM BLEPacket
         WHERE distance IS NOT NULL
-        ORDER BY smac, timestamp
-    """, conn)
+        ORDER BY smac, timestamp_us
+    """)
     conn.close()
     
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df['smac'] = df['smac'].str.lower()
-    
     # Hatalı timestamp'leri temizle
     df = df.dropna(subset=['timestamp'])
     
     return df
 
+def adaptive_time_windows(df, min_window=MIN_TIME_WINDOW_SEC):
+    """Per-smac pairing window: twice the mean gap between packets, at least min_window seconds."""
+    delta = df.groupby('smac', observed=True)['timestamp'].diff().dt.total_seconds()
+    avg_interval = delta.groupby(df['smac'], observed=True).mean().fillna(min_window)
+    return np.maximum(min_window, avg_interval * 2)
+
+def window_bounds(ts_us, time_window_sec):
+    """[start, end) of the earlier packets within time_window_sec of each packet (ts_us sorted).
+
+    Gaps are compared in whole microseconds: (ts_i - ts_j) <= window exactly
+    when ts_j >= ts_i - floor(window * 1e6).
+    """
+    window_us = math.floor(time_window_sec * 1_000_000)
+    return (np.searchsorted(ts_us, ts_us - window_us, side='left'),
+            np.searchsorted(ts_us, ts_us, side='left'))
+
+def sliding_window_pairs(values, starts, ends, threshold):
+    """Yield (i, js) for the rows js in [starts[i], ends[i]) with |values[i] - values[j]| >= threshold.
+
+    Both bounds must be non-decreasing. The window's min and max are kept in
+    monotonic deques, so a row whose window stays within the threshold of its
+    own value costs O(1) amortized and is never compared pairwise.
+    """
+    lows, highs = deque(), deque()
+    vals, starts, ends = values.tolist(), starts.tolist(), ends.tolist()
+    added = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        while added < end:
+            v = vals[added]
+            while lows and vals[lows[-1]] >= v:
+                lows.pop()
+            lows.append(added)
+            while highs and vals[highs[-1]] <= v:
+                highs.pop()
+            highs.append(added)
+            added += 1
+        while lows and lows[0] < start:
+            lows.popleft()
+        while highs and highs[0] < start:
+            highs.popleft()
+        if not lows:
+            continue
+        v = vals[i]
+        if vals[highs[0]] - v >= threshold or v - vals[lows[0]] >= threshold:
+            yield i, start + np.flatnonzero(np.abs(values[start:end] - v) >= threshold)
+
+def iter_proximity_anomalies(df, distance_threshold=DISTANCE_THRESHOLD_M, min_window=MIN_TIME_WINDOW_SEC):
+    """Sliding-window version of detect_proximity_anomalies_matrix (kept as the reference).
+
+    Yields the same (later, earlier) pairs in the same order, but each device
+    is walked once with searchsorted window bounds and min/max deques instead
+    of n x n matrices: memory is linear and time O(n log n) plus the pairs.
+    """
+    df = df.sort_values(['smac', 'timestamp']).reset_index(drop=True)
+    smac_windows = adaptive_time_windows(df, min_window)
+
+    for smac, group in df.groupby('smac', observed=True):
+        if len(group) < 2:
+            continue
+
+        time_window_sec = smac_windows[smac]
+        timestamp_vals = group['timestamp'].to_numpy(dtype='datetime64[us]')
+        dist_vals = group['distance'].to_numpy(dtype='float64')
+        starts, ends = window_bounds(timestamp_vals.view('int64'), time_window_sec)
+
+        for i, j_indices in sliding_window_pairs(dist_vals, starts, ends, distance_threshold):
+            for j in j_indices:
+                yield {
+                    'smac': smac,
+                    'timestamp_1': timestamp_vals[i],
+                    'distance_1': dist_vals[i],
+                    'timestamp_2': timestamp_vals[j],
+                    'distance_2': dist_vals[j],
+                    'distance_diff': abs(dist_vals[i] - dist_vals[j]),
+                    'time_window_sec': time_window_sec
+                }
+
 def detect_proximity_anomalies_ultra_fast(df, distance_threshold=DISTANCE_THRESHOLD_M, min_window=MIN_TIME_WINDOW_SEC):
-    """Ultra-optimized version with minimal loops"""
+    return list(iter_proximity_anomalies(df, distance_threshold, min_window))
+
+def detect_proximity_anomalies_matrix(df, distance_threshold=DISTANCE_THRESHOLD_M, min_window=MIN_TIME_WINDOW_SEC):
+    """Pairwise n x n reference: O(n^2) memory per device, use on small inputs only"""
     
     # Sort and prepare data
     df = df.sort_values(['smac', 'timestamp']).reset_index(drop=True)
-    df['delta'] = df.groupby('smac')['timestamp'].diff().dt.total_seconds()
+    smac_windows = adaptive_time_windows(df, min_window)
     
-    # Pre-calculate time windows for each smac
-    smac_windows = {}
-    for smac, group in df.groupby('smac'):
-        avg_interval = group['delta'].mean()
-        if pd.isna(avg_interval):
-            avg_interval = min_window
-        smac_windows[smac] = max(min_window, avg_interval * 2)
-    
-    # Convert timestamps to numeric for faster comparison
-        df['ts_numeric'] = df['timestamp'].astype('int64') // 10**9
+    # Microseconds, so sub-second gaps are not truncated away
+    df['ts_numeric'] = df['timestamp'].astype('datetime64[us]').astype('int64')
     
     anomalies = []
     
     # Group processing with batch operations
-    for smac, group in df.groupby('smac'):
+    for smac, group in df.groupby('smac', observed=True):
         if len(group) < 2:
             continue
             
@@ -72,7 +160,7 @@ def detect_proximity_anomalies_ultra_fast(df, distance_threshold=DISTANCE_THRESH
         # Find valid pairs (within time window and distance threshold)
         valid_pairs = (
             (time_matrix > 0) & 
-            (time_matrix <= time_window_sec) & 
+            (time_matrix <= math.floor(time_window_sec * 1_000_000)) & 
             (dist_matrix >= distance_threshold)
         )
         
@@ -92,25 +180,257 @@ def detect_proximity_anomalies_ultra_fast(df, distance_threshold=DISTANCE_THRESH
     
     return anomalies
 
-def save_anomalies(anomalies, output_file):
+def detect_proximity_anomalies_sql(db_path, distance_threshold=DISTANCE_THRESHOLD_M, min_window=MIN_TIME_WINDOW_SEC):
+    """SQL backend of detect_proximity_anomalies_ultra_fast; only the anomaly pairs leave SQLite.
+
+    The adaptive window is AVG of the LAG() gaps per smac, and the pairs come
+    from a range self-join on idx_blepacket_smac_time instead of an n x n
+    matrix; gaps are compared in whole microseconds, as in window_bounds().
+    Devices are partitioned by smac, which PacketStore stores lower-case
+    (older databases: dbMaintenance.py lowercase-macs).
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("""
+            WITH windows AS (
+                SELECT smac, MAX(:min_window, AVG(delta) * 2) AS time_window_sec
+                FROM (
+                    SELECT smac, (timestamp_us - LAG(timestamp_us) OVER (PARTITION BY smac ORDER BY timestamp_us))
+                                 / 1e6 AS delta
+                    FROM BLEPacket
+                    WHERE distance IS NOT NULL AND timestamp_us IS NOT NULL
+                )
+                GROUP BY smac
+                HAVING COUNT(*) >= 2
+            )
+            SELECT a.smac, a.timestamp_us, a.distance, b.timestamp_us, b.distance,
+                   abs(a.distance - b.distance), w.time_window_sec
+            FROM windows w
+            JOIN BLEPacket a ON a.smac = w.smac AND a.timestamp_us IS NOT NULL AND a.distance IS NOT NULL
+            JOIN BLEPacket b ON b.smac = a.smac AND b.distance IS NOT NULL
+                AND b.timestamp_us >= a.timestamp_us - CAST(w.time_window_sec * 1000000 AS INTEGER)
+                AND b.timestamp_us < a.timestamp_us
+            WHERE abs(a.distance - b.distance) >= :threshold
+            ORDER BY a.smac, a.timestamp_us, a.distance, a.id, b.timestamp_us, b.distance, b.id
+        """, {'min_window': min_window, 'threshold': distance_threshold}).fetchall()
+        count_rows_read(len(rows))
+    finally:
+        conn.close()
+    return [{
+        'smac': smac,
+        'timestamp_1': np.datetime64(ts_1, 'us'),
+        'distance_1': distance_1,
+        'timestamp_2': np.datetime64(ts_2, 'us'),
+        'distance_2': distance_2,
+        'distance_diff': distance_diff,
+        'time_window_sec': time_window_sec
+    } for smac, ts_1, distance_1, ts_2, distance_2, distance_diff, time_window_sec in rows]
+
+def aggregate_episodes(anomalies, previous=None):
+    """Merge each device's overlapping anomaly pairs into episodes, in one pass.
+
+    A pair spans [timestamp_2, timestamp_1]. Pairs arrive grouped by smac with
+    non-decreasing timestamp_1 (the order every detector here emits), so a new
+    pair can only overlap the device's latest episodes; they are merged off a
+    stack, amortized O(1) per pair. An episode keeps its span, pair count and
+    the pair with the largest distance jump (timestamp_1 ... distance_2).
+    ``previous`` (smac -> episode) continues each device's last episode of an
+    earlier run, which is then returned again, extended or not.
+    """
+    episodes = []
+    device_start, smac = 0, None
+    for pair in anomalies:
+        if pair['smac'] != smac:
+            smac, device_start = pair['smac'], len(episodes)
+            if previous and smac in previous:
+                episodes.append(dict(previous[smac]))
+        episode = {
+            'smac': smac,
+            'start': pair['timestamp_2'],
+            'end': pair['timestamp_1'],
+            'pair_count': 1,
+            'peak_distance_diff': pair['distance_diff'],
+            'timestamp_1': pair['timestamp_1'],
+            'distance_1': pair['distance_1'],
+            'timestamp_2': pair['timestamp_2'],
+            'distance_2': pair['distance_2'],
+            'time_window_sec': pair['time_window_sec']
+        }
+        while len(episodes) > device_start and episodes[-1]['end'] >= episode['start']:
+            earlier = episodes.pop()
+            peak = episode if episode['peak_distance_diff'] > earlier['peak_distance_diff'] else earlier
+            episode = {**peak,
+                       'start': min(earlier['start'], episode['start']),
+                       'end': max(earlier['end'], episode['end']),
+                       'pair_count': earlier['pair_count'] + episode['pair_count']}
+        episodes.append(episode)
+
+    for episode in episodes:
+        episode['duration_sec'] = (episode['end'] - episode['start']) / np.timedelta64(1, 's')
+    return [{column: episode[column] for column in EPISODE_COLUMNS} for episode in episodes]
+
+def _encode_episode(episode):
+    """An episode as JSON-safe values (times in microseconds) for the carry-over state."""
+    if episode is None:
+        return None
+    encoded = {column: episode[column] for column in EPISODE_COLUMNS if column != 'duration_sec'}
+    for column in EPISODE_TIME_COLUMNS:
+        encoded[column] = int(np.datetime64(encoded[column], 'us').astype('int64'))
+    return {column: value.item() if isinstance(value, np.generic) else value for column, value in encoded.items()}
+
+def _decode_episode(encoded):
+    episode = dict(encoded)
+    for column in EPISODE_TIME_COLUMNS:
+        episode[column] = np.datetime64(episode[column], 'us')
+    return episode
+
+def proximity_state(db_path, max_id, episodes):
+    """Carry-over of a full run: packets / first / last timestamp_us and the last episode per stored smac."""
+    last_episode = {episode['smac']: episode for episode in episodes}
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT smac, COUNT(*), MIN(timestamp_us), MAX(timestamp_us) FROM BLEPacket
+            WHERE id <= ? AND distance IS NOT NULL AND timestamp_us IS NOT NULL AND smac IS NOT NULL
+            GROUP BY smac
+        """, (max_id,)).fetchall()
+        count_rows_read(len(rows))
+    finally:
+        conn.close()
+    return {smac: [packets, first_us, last_us, _encode_episode(last_episode.get(smac.lower()))]
+            for smac, packets, first_us, last_us in rows}
+
+def update_proximity_alerts(db_path, watermark, alerts_path, pairs_path=None,
+                            distance_threshold=DISTANCE_THRESHOLD_M, min_window=MIN_TIME_WINDOW_SEC):
+    """iter_proximity_anomalies for the packets after the watermark, merged into the episode CSV.
+
+    Per device the state keeps the packet count and first / last timestamp, so
+    the adaptive window (twice the mean gap) covers every packet so far; the
+    stored packets within one window of a device's first new packet are read
+    back off idx_blepacket_smac_time. Only pairs ending in a new packet are
+    produced: pairs of earlier runs are not re-judged with the updated window
+    (--full does that). An episode still open at the watermark is continued.
+    Returns (new state devices, new pairs, episodes written).
+    """
+    last_id, max_id = watermark['last_id'], watermark['max_id']
+    devices = watermark['state']['devices']
+    pairs, previous = [], {}
+    conn = connect(db_path)
+    try:
+        rows = counted_rows(conn.execute("""
+            SELECT smac, timestamp_us, distance FROM BLEPacket
+            WHERE id > ? AND id <= ? AND distance IS NOT NULL AND timestamp_us IS NOT NULL AND smac IS NOT NULL
+            ORDER BY smac, timestamp_us, id
+        """, (last_id, max_id)))
+        for smac, group in groupby(rows, key=itemgetter(0)):
+            group = list(group)
+            packets, first_us, last_us, episode = devices.get(smac, [0, None, None, None])
+            packets += len(group)
+            first_us = group[0][1] if first_us is None else first_us
+            devices[smac] = [packets, first_us, group[-1][1], episode]
+            if episode is not None:
+                previous[smac.lower()] = _decode_episode(episode)
+            if packets < 2:
+                continue
+            time_window_sec = float(max(min_window, 2 * (group[-1][1] - first_us) / 1e6 / (packets - 1)))
+            earlier = conn.execute("""
+                SELECT timestamp_us, distance FROM BLEPacket
+                WHERE smac = ? AND timestamp_us >= ? AND id <= ? AND distance IS NOT NULL
+                ORDER BY timestamp_us, id
+            """, (smac, group[0][1] - math.floor(time_window_sec * 1_000_000), last_id)).fetchall()
+            count_rows_read(len(earlier))
+            ts_us = np.array([row[0] for row in earlier] + [row[1] for row in group], dtype='int64')
+            dist_vals = np.array([row[1] for row in earlier] + [row[2] for row in group], dtype='float64')
+            timestamp_vals = ts_us.view('datetime64[us]')
+            starts, ends = window_bounds(ts_us, time_window_sec)
+            for i, j_indices in sliding_window_pairs(dist_vals, starts, ends, distance_threshold):
+                if i < len(earlier):
+                    continue
+                for j in j_indices:
+                    pairs.append({
+                        'smac': smac.lower(),
+                        'timestamp_1': timestamp_vals[i],
+                        'distance_1': dist_vals[i],
+                        'timestamp_2': timestamp_vals[j],
+                        'distance_2': dist_vals[j],
+                        'distance_diff': abs(dist_vals[i] - dist_vals[j]),
+                        'time_window_sec': time_window_sec
+                    })
+    finally:
+        conn.close()
+
+    if pairs_path is not None and pairs:
+        append_csv(with_local_time(pd.DataFrame(pairs), PAIR_TIME_COLUMNS), pairs_path)
+    # pairs are grouped by stored smac; episodes need each lower-cased device contiguous
+    pairs.sort(key=itemgetter('smac'))
+    episodes = aggregate_episodes(pairs, previous)
+    if episodes:
+        touched = {episode['smac'] for episode in episodes}
+        drop = pd.DataFrame([{'smac': smac, 'start': previous[smac]['start']} for smac in touched if smac in previous],
+                            columns=['smac', 'start'])
+        upsert_csv(alerts_path, with_local_time(pd.DataFrame(episodes), EPISODE_TIME_COLUMNS), ['smac', 'start'],
+                   sort_by=['smac', 'start'],
+                   parse={'start': lambda values: pd.to_datetime(values, format='ISO8601')},
+                   drop=with_local_time(drop, ['start']))
+        last_episode = {episode['smac']: episode for episode in episodes}
+        for smac, state in devices.items():
+            if smac.lower() in last_episode:
+                state[3] = _encode_episode(last_episode[smac.lower()])
+    return devices, len(pairs), len(episodes)
+
+def save_anomalies(anomalies, output_file, label="anomaly(ies)"):
     if not anomalies:
         print("✔️ No anomalies found.")
         return
         
-    df = pd.DataFrame(anomalies)
+    df = with_local_time(pd.DataFrame(anomalies), EPISODE_TIME_COLUMNS)
     df.to_csv(output_file, index=False)
-    print(f"✔️ {len(df)} anomaly(ies) logged in {output_file}.")
+    print(f"✔️ {len(df)} {label} logged in {output_file}.")
 
-def main():
-    
-    print("Loading data...")
-    df = load_distance_data(DB_PATH)
-    print(f"Loaded {len(df)} records.")
-    
-    print("Detecting anomalies (ultra-fast)...")
-    anomalies = detect_proximity_anomalies_ultra_fast(df)
-    
-    save_anomalies(anomalies, os.path.join(DOCS_DIR, "ProximityAnomalyAlerts.csv"))
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect BLE proximity anomalies")
+    parser.add_argument('--backend', choices=('pandas', 'sql'), default=DETECTOR_BACKENDS['proximity'],
+                        help="Load the packets into pandas, or let SQLite compute the pairs")
+    parser.add_argument('--pairs', action='store_true',
+                        help="Also write every anomalous packet pair to ProximityAnomalyPairs.csv")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-analyze every packet instead of only those added since the last run")
+    args = parser.parse_args(argv)
+
+    alerts_path = os.path.join(DOCS_DIR, "ProximityAnomalyAlerts.csv")
+    pairs_path = os.path.join(DOCS_DIR, "ProximityAnomalyPairs.csv") if args.pairs else None
+    # Only the packets after the last run's watermark are analyzed, unless --full
+    params = {'distance_threshold': DISTANCE_THRESHOLD_M, 'min_window': MIN_TIME_WINDOW_SEC, 'pairs': args.pairs}
+    watermark, reason = (None, "--full") if args.full else read_watermark(DB_PATH, PROXIMITY_STATE, params)
+    if watermark is not None:
+        max_id, generation = watermark['max_id'], watermark['generation']
+        devices, pair_count, episode_count = update_proximity_alerts(DB_PATH, watermark, alerts_path, pairs_path)
+        print(f"⏩ Packets {watermark['last_id'] + 1:,}-{max_id:,} analyzed: {pair_count} new anomalous pair(s), "
+              f"{episode_count} episode(s) added or extended in {alerts_path}.")
+    else:
+        print(f"🔁 Full analysis ({reason}).")
+        max_id, generation = current_max_id(DB_PATH), current_generation(DB_PATH)
+        if args.backend == 'sql':
+            print("Detecting anomalies (SQL)...")
+            anomalies = detect_proximity_anomalies_sql(DB_PATH)
+        else:
+            print("Loading data...")
+            df = load_distance_data(DB_PATH)
+            print(f"Loaded {len(df)} records.")
+
+            print("Detecting anomalies (ultra-fast)...")
+            # Without --pairs the pairs are folded into episodes as they are found
+            anomalies = iter_proximity_anomalies(df)
+        if args.pairs:
+            anomalies = list(anomalies)
+            save_anomalies(anomalies, pairs_path, "anomalous pair(s)")
+
+        episodes = aggregate_episodes(anomalies)
+        save_anomalies(episodes, alerts_path, "anomaly episode(s)")
+        devices = proximity_state(DB_PATH, max_id, episodes)
+    write_watermark(DB_PATH, PROXIMITY_STATE, max_id, params,
+                    {'max_ts_us': max_timestamp_us(DB_PATH, max_id), 'devices': devices},
+                    [path for path in (alerts_path, pairs_path) if path], generation)
 
 if __name__ == "__main__":
     main()
@@ -1,23 +1,38 @@
-import sqlite3
+import argparse
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from config import DB_PATH, DOCS_DIR, REPLAY_TIME_WINDOW_SEC
+from config import (DB_PATH, DOCS_DIR, REPLAY_TIME_WINDOW_SEC, REPLAY_BLOOM_CAPACITY, REPLAY_BLOOM_FP_RATE,
+                    DETECTOR_BACKENDS)
+from utils.time_utils import timestamp_us_to_datetime, with_local_time
+from utils.db_utils import connect, ensure_indexes
+from utils.frame_utils import read_packet_frame
+from utils.profile_utils import count_rows_read, counted_rows
+from utils.replay_utils import TimeSlicedBloomFilter
+from utils.incremental_utils import (read_watermark, write_watermark, current_max_id, current_generation,
+                                     max_timestamp_us, read_text_csv, as_text, upsert_csv)
 
+# DetectorState row of the incremental fingerprint scan
+REPLAY_STATE = 'replayAttack'
+ALERT_COLUMNS = ['packet_hash', 'first_seen', 'repeated_at', 'time_diff_secs', 'repetition_count',
+                 'dmac', 'smac', 'rssi', 'distance']
+# Kept as UTC instants by the detectors, written as local time
+ALERT_TIME_COLUMNS = ('first_seen', 'repeated_at')
 
 
 def load_packet_hash_data(db_path):
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query("""
-        SELECT timestamp, dmac, smac, rssi, distance, packet_hash
+    conn = connect(db_path)
+    df = read_packet_frame(conn, """
+        SELECT timestamp_us AS timestamp, dmac, smac, rssi, distance, packet_hash
         FROM BLEPacket
-        ORDER BY timestamp
-    """, conn)
+        ORDER BY timestamp_us
+    """)
     conn.close()
-
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
     return df
 
 def detect_replay_attacks(df, replay_window_sec):
@@ -48,15 +63,367 @@ def detect_replay_attacks(df, replay_window_sec):
                 break  # One alert per packet hash
     return alerts
 
+def detect_replay_attacks_vectorized(df, replay_window_sec):
+    """Array version of detect_replay_attacks (kept as the reference); returns the alerts as a DataFrame.
+
+    One stable sort on (packet_hash, timestamp) replaces the per-hash loop. A row
+    is a replay when the row before it has the same hash and is less than the
+    window older; only the first such row per hash is reported. As in the
+    reference, NaT sorts last within a hash and never matches.
+    """
+    codes, hashes = pd.factorize(df['packet_hash'], sort=True)
+    timestamps = df['timestamp'].to_numpy(dtype='datetime64[us]')
+    # NaT is the smallest int64; move it to the end of its hash group
+    sort_key = timestamps.view('int64').copy()
+    sort_key[np.isnat(timestamps)] = np.iinfo(np.int64).max
+    order = np.lexsort((sort_key, codes))
+    order = order[codes[order] >= 0]  # rows without a hash are not grouped
+
+    window = np.timedelta64(round(replay_window_sec * 1_000_000), 'us')
+    sorted_codes = codes[order]
+    sorted_times = timestamps[order]
+    hits = np.flatnonzero((sorted_codes[1:] == sorted_codes[:-1]) &
+                          (sorted_times[1:] - sorted_times[:-1] < window)) + 1
+    first_hit = np.ones(len(hits), dtype=bool)
+    first_hit[1:] = sorted_codes[hits[1:]] != sorted_codes[hits[:-1]]
+    hits = hits[first_hit]
+
+    repeated, previous = order[hits], order[hits - 1]
+    hit_codes = sorted_codes[hits]
+    alerts = pd.DataFrame({
+        'packet_hash': hashes.take(hit_codes),
+        'first_seen': timestamps[previous],
+        'repeated_at': timestamps[repeated],
+        'time_diff_secs': (timestamps[repeated] - timestamps[previous]).view('int64') / 1_000_000,
+        'repetition_count': np.bincount(codes[order], minlength=len(hashes))[hit_codes],
+    })
+    details = df.iloc[repeated][['dmac', 'smac', 'rssi', 'distance']].reset_index(drop=True)
+    return pd.concat([alerts, details], axis=1)[ALERT_COLUMNS]
+
+def has_content_fingerprints(db_path):
+    """True when every packet carries content_fingerprint and timestamp_us (see dbMaintenance.py migrate).
+
+    Only the stored values decide; the fingerprint index is built by
+    ensure_fingerprint_index, not checked here.
+    """
+    conn = connect(db_path)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(BLEPacket)")}
+        if not {'content_fingerprint', 'timestamp_us'} <= columns:
+            return False
+        missing = conn.execute("""
+            SELECT EXISTS(SELECT 1 FROM BLEPacket WHERE content_fingerprint IS NULL OR timestamp_us IS NULL)
+        """).fetchone()[0]
+        return not missing
+    finally:
+        conn.close()
+
+def ensure_fingerprint_index(db_path):
+    """Build idx_blepacket_fingerprint_time if it is missing, which the fingerprint scans read in order."""
+    built = ensure_indexes(db_path, ['idx_blepacket_fingerprint_time'])
+    if built:
+        print(f"🔧 {', '.join(built)} was missing and has been built.")
+
+def detect_replay_attacks_by_fingerprint(db_path, replay_window_sec):
+    """Replay detection over the content fingerprint index.
+
+    Packets are read in (content_fingerprint, timestamp_us) order straight off
+    idx_blepacket_fingerprint_time, so each fingerprint group arrives
+    contiguous and time-sorted, and time gaps are plain integer differences.
+    """
+    alerts = []
+    window_us = int(replay_window_sec * 1_000_000)
+    conn = connect(db_path)
+    try:
+        rows = counted_rows(conn.execute("""
+            SELECT content_fingerprint, timestamp_us, dmac, smac, rssi, distance, packet_hash
+            FROM BLEPacket
+            WHERE content_fingerprint IS NOT NULL AND timestamp_us IS NOT NULL
+            ORDER BY content_fingerprint, timestamp_us
+        """))
+        for fingerprint, group in groupby(rows, key=itemgetter(0)):
+            group = list(group)
+            if len(group) <= 1:
+                continue
+
+            for i in range(1, len(group)):
+                previous, current = group[i - 1][1], group[i][1]
+                if current - previous < window_us:
+                    _, _, dmac, smac, rssi, distance, packet_hash = group[i]
+                    alerts.append(fingerprint_alert(packet_hash, fingerprint, previous, current, len(group),
+                                                    dmac, smac, rssi, distance))
+                    break  # One alert per content fingerprint
+    finally:
+        conn.close()
+    return alerts
+
+def replay_window_query(key):
+    """First replay per ``key`` group, computed by SQLite: LAG() over (key, timestamp_us, id).
+
+    Rows without a timestamp sort last in their group and never match, as in
+    the pandas detectors; repetition_count counts them only for packet_hash.
+    The fingerprint query is read in idx_blepacket_fingerprint_time order.
+    """
+    if key == 'content_fingerprint':
+        counted, order = "timestamp_us IS NOT NULL", "timestamp_us, id"
+    else:
+        counted, order = "1", "timestamp_us IS NULL, timestamp_us, id"
+    return f"""
+        WITH gaps AS (
+            SELECT {key} AS key, timestamp_us, dmac, smac, rssi, distance, packet_hash,
+                   LAG(timestamp_us) OVER ordered AS previous_us,
+                   ROW_NUMBER() OVER ordered AS position,
+                   COUNT(*) OVER (ordered ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+                       AS repetition_count
+            FROM BLEPacket
+            WHERE {key} IS NOT NULL AND {counted}
+            WINDOW ordered AS (PARTITION BY {key} ORDER BY {order})
+        )
+        -- With MIN(), SQLite takes the bare columns from the row holding the minimum
+        SELECT packet_hash, key, previous_us, timestamp_us, repetition_count, dmac, smac, rssi, distance,
+               MIN(position) AS first_position
+        FROM gaps
+        WHERE timestamp_us - previous_us < :window_us
+        GROUP BY key
+        ORDER BY key
+    """
+
+def detect_replay_attacks_sql(db_path, replay_window_sec):
+    """SQL backend of detect_replay_attacks_by_fingerprint: only the alert rows leave SQLite."""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(replay_window_query('content_fingerprint'),
+                            {'window_us': int(replay_window_sec * 1_000_000)}).fetchall()
+        count_rows_read(len(rows))
+    finally:
+        conn.close()
+    return [fingerprint_alert(*row[:-1]) for row in rows]
+
+def detect_replay_attacks_by_hash_sql(db_path, replay_window_sec):
+    """SQL backend of detect_replay_attacks_vectorized over packet_hash; same DataFrame."""
+    conn = connect(db_path)
+    try:
+        df = pd.read_sql_query(replay_window_query('packet_hash'), conn,
+                               params={'window_us': round(replay_window_sec * 1_000_000)})
+        count_rows_read(len(df))
+    finally:
+        conn.close()
+    first_seen = timestamp_us_to_datetime(df.pop('previous_us'))
+    repeated_at = timestamp_us_to_datetime(df.pop('timestamp_us'))
+    df = df.drop(columns=['key', 'first_position']).assign(first_seen=first_seen, repeated_at=repeated_at,
+                                       time_diff_secs=(repeated_at - first_seen).dt.total_seconds())
+    return df[ALERT_COLUMNS]
+
+def detect_replay_attacks_bloom(db_path, replay_window_sec, capacity=REPLAY_BLOOM_CAPACITY,
+                                fp_rate=REPLAY_BLOOM_FP_RATE, stats=None):
+    """Replay detection in one time-ordered pass with a fixed-size working set.
+
+    Packets stream off idx_blepacket_time; a TimeSlicedBloomFilter answers
+    "fingerprint seen in the last window?" in a few MB whatever the capture
+    length. Each candidate is confirmed with an index lookup of the previous
+    sighting, so false positives cost one query and never reach the alerts:
+    the result equals detect_replay_attacks_by_fingerprint. ``stats`` (a dict)
+    receives packets / candidates / confirmed / false_candidates / filter_bytes.
+    """
+    window_us = int(replay_window_sec * 1_000_000)
+    bloom = TimeSlicedBloomFilter(window_us, capacity, fp_rate)
+    alerted = {}  # fingerprint -> alert; grows with the output only
+    counts = dict.fromkeys(('packets', 'candidates', 'confirmed', 'false_candidates'), 0)
+    conn = connect(db_path)
+    lookup = connect(db_path)
+    try:
+        rows = counted_rows(conn.execute("""
+            SELECT id, content_fingerprint, timestamp_us, dmac, smac, rssi, distance, packet_hash
+            FROM BLEPacket
+            WHERE content_fingerprint IS NOT NULL AND timestamp_us IS NOT NULL
+            ORDER BY timestamp_us, id
+        """))
+        for packet_id, fingerprint, timestamp_us, dmac, smac, rssi, distance, packet_hash in rows:
+            counts['packets'] += 1
+            if not bloom.check_and_add(fingerprint, timestamp_us) or fingerprint in alerted:
+                continue
+            counts['candidates'] += 1
+            previous = lookup.execute("""
+                SELECT timestamp_us FROM BLEPacket
+                WHERE content_fingerprint = ? AND (timestamp_us < ? OR (timestamp_us = ? AND id < ?))
+                ORDER BY timestamp_us DESC, id DESC LIMIT 1
+            """, (fingerprint, timestamp_us, timestamp_us, packet_id)).fetchone()
+            if previous is None or timestamp_us - previous[0] >= window_us:
+                counts['false_candidates'] += 1
+                continue
+            counts['confirmed'] += 1
+            alerted[fingerprint] = fingerprint_alert(packet_hash, fingerprint, previous[0], timestamp_us, None,
+                                                     dmac, smac, rssi, distance)
+        for fingerprint, alert in alerted.items():
+            alert['repetition_count'] = lookup.execute("""
+                SELECT COUNT(*) FROM BLEPacket WHERE content_fingerprint = ? AND timestamp_us IS NOT NULL
+            """, (fingerprint,)).fetchone()[0]
+    finally:
+        lookup.close()
+        conn.close()
+    if stats is not None:
+        stats.update(counts, filter_bytes=bloom.nbytes, filter_hashes=bloom.hashes)
+    return [alerted[fingerprint] for fingerprint in sorted(alerted)]
+
+def fingerprint_alert(packet_hash, fingerprint, first_seen_us, repeated_at_us, repetition_count,
+                      dmac, smac, rssi, distance):
+    return {
+        'packet_hash': packet_hash,
+        'content_fingerprint': fingerprint,
+        'first_seen': pd.Timestamp(first_seen_us, unit='us'),
+        'repeated_at': pd.Timestamp(repeated_at_us, unit='us'),
+        'time_diff_secs': (repeated_at_us - first_seen_us) / 1_000_000,
+        'repetition_count': repetition_count,
+        'dmac': dmac,
+        'smac': smac,
+        'rssi': rssi,
+        'distance': distance
+    }
+
+def update_replay_alerts(db_path, replay_window_sec, watermark, output_path):
+    """detect_replay_attacks_by_fingerprint for the packets after the watermark, merged into output_path.
+
+    The new packets are walked in (timestamp_us, id) order, each fingerprint
+    compared with its previous sighting. Sightings older than one window before
+    the watermark can no longer match, so only the stored packets of that last
+    window are read back as carry-over. A fingerprint that already has an alert
+    gets no second one, only its repetition_count raised by its new packets.
+    Returns (new alerts, updated alerts).
+    """
+    window_us = int(replay_window_sec * 1_000_000)
+    last_id, max_id = watermark['last_id'], watermark['max_id']
+    newest = watermark['state'].get('max_ts_us')
+    existing = read_text_csv(output_path, ('content_fingerprint', 'repetition_count'))
+    alerted = set() if existing is None else set(existing['content_fingerprint'].astype('int64'))
+    last_seen, new_alerts, new_counts = {}, {}, {}
+    conn = connect(db_path)
+    try:
+        if newest is not None:
+            last_seen.update(counted_rows(conn.execute("""
+                SELECT content_fingerprint, timestamp_us FROM BLEPacket
+                WHERE timestamp_us > ? AND id <= ? AND content_fingerprint IS NOT NULL
+                ORDER BY timestamp_us, id
+            """, (newest - window_us, last_id))))
+        rows = counted_rows(conn.execute("""
+            SELECT content_fingerprint, timestamp_us, dmac, smac, rssi, distance, packet_hash
+            FROM BLEPacket
+            WHERE id > ? AND id <= ? AND content_fingerprint IS NOT NULL AND timestamp_us IS NOT NULL
+            ORDER BY timestamp_us, id
+        """, (last_id, max_id)))
+        for fingerprint, timestamp_us, dmac, smac, rssi, distance, packet_hash in rows:
+            new_counts[fingerprint] = new_counts.get(fingerprint, 0) + 1
+            previous = last_seen.get(fingerprint)
+            last_seen[fingerprint] = timestamp_us
+            if (previous is not None and timestamp_us - previous < window_us
+                    and fingerprint not in alerted and fingerprint not in new_alerts):
+                new_alerts[fingerprint] = fingerprint_alert(packet_hash, fingerprint, previous, timestamp_us, None,
+                                                            dmac, smac, rssi, distance)
+        for fingerprint, alert in new_alerts.items():
+            alert['repetition_count'] = conn.execute("""
+                SELECT COUNT(*) FROM BLEPacket
+                WHERE content_fingerprint = ? AND timestamp_us IS NOT NULL AND id <= ?
+            """, (fingerprint, max_id)).fetchone()[0]
+    finally:
+        conn.close()
+
+    updated = None
+    if existing is not None:
+        touched = existing['content_fingerprint'].astype('int64').map(new_counts)
+        updated = existing[touched.notna()].copy()
+        updated['repetition_count'] = (updated['repetition_count'].astype('int64')
+                                       + touched.dropna().astype('int64')).astype(str)
+    fresh = [as_text(with_local_time(pd.DataFrame([new_alerts[fingerprint] for fingerprint in sorted(new_alerts)]),
+                                     ALERT_TIME_COLUMNS))] if new_alerts else []
+    if updated is not None and len(updated):
+        fresh.insert(0, updated)
+    if fresh:
+        upsert_csv(output_path, pd.concat(fresh, ignore_index=True), ['content_fingerprint'],
+                   sort_by=['content_fingerprint'], parse={'content_fingerprint': lambda values: values.astype('int64')})
+    return len(new_alerts), 0 if updated is None else len(updated)
+
+def load_streaming_alerts(db_path):
+    """Alerts written during ingest by StreamingReplayDetector (ReplayAlerts), in the batch format.
+
+    repetition_count is counted at read time, over the same packets the batch
+    fingerprint detector groups.
+    """
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT a.packet_hash, a.content_fingerprint, a.first_seen_us, a.repeated_at_us,
+                   (SELECT COUNT(*) FROM BLEPacket p
+                    WHERE p.content_fingerprint = a.content_fingerprint AND p.timestamp_us IS NOT NULL),
+                   a.dmac, a.smac, a.rssi, a.distance
+            FROM ReplayAlerts a
+            ORDER BY a.content_fingerprint
+        """).fetchall()
+        count_rows_read(len(rows))
+    finally:
+        conn.close()
+    return [fingerprint_alert(*row) for row in rows]
+
 def save_alerts(alerts, output_path):
-    df = pd.DataFrame(alerts)
+    """Write the alerts to output_path, their times in local wall-clock time."""
+    df = with_local_time(pd.DataFrame(alerts), ALERT_TIME_COLUMNS)
     df.to_csv(output_path, index=False)
     print(f"✔️ {len(df)} replay attack(s) logged in {output_path}.")
 
-def main():
-    df = load_packet_hash_data(DB_PATH)
-    alerts = detect_replay_attacks(df, REPLAY_TIME_WINDOW_SEC)
-    save_alerts(alerts, os.path.join(DOCS_DIR, "ReplayAttackAlerts.csv"))
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect replayed BLE advertisements")
+    parser.add_argument('--source', choices=('batch', 'stream', 'bloom'), default='batch',
+                        help="'batch' scans the packet table, 'stream' reads the alerts flagged during ingest, "
+                             "'bloom' scans in time order with fixed-size Bloom filters (exact alerts)")
+    parser.add_argument('--backend', choices=('pandas', 'sql'), default=DETECTOR_BACKENDS['replay'],
+                        help="Batch scan in Python/pandas or as a SQLite window-function query")
+    parser.add_argument('--fp-rate', type=float, default=REPLAY_BLOOM_FP_RATE,
+                        help="False-positive rate of the Bloom filters (--source bloom)")
+    parser.add_argument('--capacity', type=int, default=REPLAY_BLOOM_CAPACITY,
+                        help="Distinct fingerprints expected per window (--source bloom)")
+    parser.add_argument('--full', action='store_true',
+                        help="Rescan every packet instead of only those added since the last run (--source batch)")
+    args = parser.parse_args(argv)
+
+    output_path = os.path.join(DOCS_DIR, "ReplayAttackAlerts.csv")
+    if args.source == 'stream':
+        alerts = load_streaming_alerts(DB_PATH)
+    elif args.source == 'bloom' and has_content_fingerprints(DB_PATH):
+        ensure_fingerprint_index(DB_PATH)
+        stats = {}
+        alerts = detect_replay_attacks_bloom(DB_PATH, REPLAY_TIME_WINDOW_SEC, args.capacity, args.fp_rate, stats)
+        observed = stats['false_candidates'] / max(1, stats['packets'] - stats['confirmed'])
+        print(f"🌸 {stats['packets']:,} packets, {stats['candidates']:,} candidate(s), "
+              f"{stats['confirmed']:,} confirmed, {stats['false_candidates']:,} rejected ({observed:.2%}); "
+              f"filters {stats['filter_bytes'] / 2**20:.1f} MB, {stats['filter_hashes']} hashes")
+    elif has_content_fingerprints(DB_PATH):
+        ensure_fingerprint_index(DB_PATH)
+        # Only the packets after the last run's watermark are scanned, unless --full
+        params = {'window_sec': REPLAY_TIME_WINDOW_SEC}
+        watermark, reason = (None, "--full") if args.full else read_watermark(DB_PATH, REPLAY_STATE, params)
+        if watermark is not None:
+            max_id, generation = watermark['max_id'], watermark['generation']
+            added, updated = update_replay_alerts(DB_PATH, REPLAY_TIME_WINDOW_SEC, watermark, output_path)
+            print(f"⏩ Packets {watermark['last_id'] + 1:,}-{max_id:,} scanned: {added} new replay attack(s), "
+                  f"{updated} repetition count(s) updated in {output_path}.")
+        else:
+            print(f"🔁 Full scan ({reason}).")
+            max_id, generation = current_max_id(DB_PATH), current_generation(DB_PATH)
+            if args.backend == 'sql':
+                alerts = detect_replay_attacks_sql(DB_PATH, REPLAY_TIME_WINDOW_SEC)
+            else:
+                alerts = detect_replay_attacks_by_fingerprint(DB_PATH, REPLAY_TIME_WINDOW_SEC)
+            save_alerts(alerts, output_path)
+        write_watermark(DB_PATH, REPLAY_STATE, max_id, params, {'max_ts_us': max_timestamp_us(DB_PATH, max_id)},
+                        [output_path], generation)
+        return
+    else:
+        print("⚠️ Some packets have no content_fingerprint/timestamp_us; falling back to packet_hash grouping "
+              "(run: python scripts/dbMaintenance.py migrate)")
+        if args.backend == 'sql':
+            alerts = detect_replay_attacks_by_hash_sql(DB_PATH, REPLAY_TIME_WINDOW_SEC)
+        else:
+            df = load_packet_hash_data(DB_PATH)
+            alerts = detect_replay_attacks_vectorized(df, REPLAY_TIME_WINDOW_SEC)
+    save_alerts(alerts, output_path)
 
 if __name__ == "__main__":
     main()
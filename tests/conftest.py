@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+from utils.db_utils import init_db, PacketStore, PACKET_COLUMNS
+
+START_US = 1_748_260_800_000_000  # 2025-05-26 12:00:00 UTC
+
+
+def packet_row(offset_sec=None, smac=None, dmac='ff:ff:ff:ff:ff:ff', rssi=-60, distance=None, packet_hash=None,
+               content_fingerprint=None, payload_fingerprint=None):
+    """One PACKET_COLUMNS row, ``offset_sec`` seconds after START_US (None: no timestamp)."""
+    values = {'smac': smac, 'dmac': dmac, 'rssi': rssi, 'distance': distance, 'packet_hash': packet_hash,
+              'content_fingerprint': content_fingerprint, 'payload_fingerprint': payload_fingerprint,
+              'timestamp_us': None if offset_sec is None else START_US + round(offset_sec * 1_000_000)}
+    return tuple(values.get(column) for column in PACKET_COLUMNS)
+
+
+@pytest.fixture
+def packet_db(tmp_path):
+    """Factory: a database holding ``rows`` (packet_row tuples) in insertion (id) order; returns its path."""
+    def build(rows, storage='flat'):
+        db_path = str(tmp_path / f'{storage}.db')
+        conn, cursor = init_db(db_path, storage=storage)
+        PacketStore(cursor).insert_many(rows)
+        conn.commit()
+        conn.close()
+        return db_path
+    return build
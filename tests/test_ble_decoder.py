@@ -0,0 +1,98 @@
+import pytest
+from conftest import START_US
+from logs_to_db import iter_native_packets, prepare_packet
+from utils.ble_utils import (decode_ble_frame, LINKTYPE_NORDIC_BLE, LINKTYPE_BLUETOOTH_LE_LL,
+                             LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR)
+from utils.pcapng_utils import write_pcapng
+
+# Link-layer advertising PDUs, byte by byte: access address, PDU header (type, length), payload, CRC
+ADV_IND = bytes.fromhex(
+    'd6be898e' '001f'
+    '554433221100'                                        # AdvA 00:11:22:33:44:55
+    '020106'                                              # flags
+    '05030f180a18'                                        # 16-bit UUID list: 0x180f, 0x180a
+    '0516aafe1000'                                        # service data of 0xfeaa
+    '07ff4c000215aabb'                                    # manufacturer 0x004c, data 02:15:aa:bb
+    '0c0b'                                                # truncated AD structure: ignored
+    '000000')
+ADV_NONCONN_IND_128 = bytes.fromhex(
+    'd6be898e' '0218'
+    '665544332211'                                        # AdvA 11:22:33:44:55:66
+    '1107' '000102030405060708090a0b0c0d0e0f'             # 128-bit UUID list
+    '000000')
+SCAN_REQ = bytes.fromhex(
+    'd6be898e' '030c'
+    'a5a4a3a2a1a0'                                        # ScanA a0:a1:a2:a3:a4:a5
+    '554433221100'                                        # AdvA 00:11:22:33:44:55
+    '000000')
+DATA_PDU = bytes.fromhex('78563412' '0100' '000000')      # data channel access address
+
+
+def nordic(ll, rssi=60, protover=3, packet_id=0x02):
+    """nRF Sniffer frame: board id, packet header, event header (flags, channel, |rssi|, counter, timestamp)."""
+    event = bytes([0x01, 37, rssi]) + bytes(6)
+    if protover < 3:
+        event = bytes([10]) + event
+    body = event + ll
+    return bytes([0, len(body) & 0xFF, len(body) >> 8, protover, 0, 0, packet_id]) + body
+
+
+def test_nordic_adv_ind():
+    rssi, fields = decode_ble_frame(LINKTYPE_NORDIC_BLE, nordic(ADV_IND))
+    assert rssi == -60
+    assert fields == {
+        'advertising_address': '00:11:22:33:44:55',
+        'scanning_address': None,
+        'uuids': [('16', '0x180f'), ('16', '0x180a'), ('16', '0xfeaa')],
+        'company_id': '0x004c',
+        'manufacturer_data': '02:15:aa:bb',
+    }
+
+
+def test_nordic_legacy_header_and_128_bit_uuids():
+    rssi, fields = decode_ble_frame(LINKTYPE_NORDIC_BLE, nordic(ADV_NONCONN_IND_128, rssi=90, protover=2))
+    assert rssi == -90
+    assert fields['advertising_address'] == '11:22:33:44:55:66'
+    assert fields['uuids'] == [('128', '0f0e0d0c-0b0a-0908-0706-050403020100')]
+    assert fields['company_id'] is None and fields['manufacturer_data'] is None
+
+
+def test_scan_request_addresses():
+    _rssi, fields = decode_ble_frame(LINKTYPE_NORDIC_BLE, nordic(SCAN_REQ))
+    assert (fields['scanning_address'], fields['advertising_address']) == ('a0:a1:a2:a3:a4:a5', '00:11:22:33:44:55')
+    assert fields['uuids'] == []
+
+
+def test_plain_link_layer_frames_have_no_rssi():
+    assert decode_ble_frame(LINKTYPE_BLUETOOTH_LE_LL, ADV_IND) == decode_ble_frame(
+        LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR, bytes(10) + ADV_IND)
+    rssi, fields = decode_ble_frame(LINKTYPE_BLUETOOTH_LE_LL, ADV_IND)
+    assert rssi is None and fields['advertising_address'] == '00:11:22:33:44:55'
+
+
+@pytest.mark.parametrize('linktype, frame', [
+    (LINKTYPE_NORDIC_BLE, nordic(DATA_PDU)),
+    (LINKTYPE_NORDIC_BLE, nordic(ADV_IND, packet_id=0x01)),   # not a packet event
+    (LINKTYPE_NORDIC_BLE, nordic(ADV_IND)[:12]),             # truncated header
+    (LINKTYPE_BLUETOOTH_LE_LL, DATA_PDU),
+    (1, ADV_IND),                                            # Ethernet
+])
+def test_frames_without_advertising_data(linktype, frame):
+    assert decode_ble_frame(linktype, frame) is None
+
+
+def test_capture_rows(tmp_path):
+    path = str(tmp_path / 'known.pcapng')
+    write_pcapng(path, [(START_US, nordic(ADV_IND)), (START_US + 1, nordic(DATA_PDU)),
+                        (START_US + 2, nordic(SCAN_REQ, rssi=70))], LINKTYPE_NORDIC_BLE)
+    packets = list(iter_native_packets(path))
+    assert [(pkt['ts_us'], pkt['rssi']) for pkt in packets] == [(START_US, -60), (START_US + 2, -70)]
+
+    # Scan requests carry no UUIDs and are not stored
+    assert prepare_packet(packets[1]) is None
+    ts_us, row, uuids = prepare_packet(packets[0])
+    assert ts_us == START_US
+    assert row[1:4] == ('ff:ff:ff:ff:ff:ff', '00:11:22:33:44:55', -60)
+    assert row[5:7] == ('0x004c', '02:15:aa:bb')
+    # Every UUID of a list is kept (pyshark reports only the first 16-bit one, see README)
+    assert uuids == [('16', '0x180f'), ('16', '0x180a'), ('16', '0xfeaa')]
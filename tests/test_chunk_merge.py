@@ -0,0 +1,68 @@
+import pytest
+from benchmarks.synthetic import iter_synthetic_frames
+from logs_to_db import merge_chunk_rows, decode_chunk, iter_prepared_packets
+from utils.ble_utils import LINKTYPE_NORDIC_BLE
+from utils.pcapng_utils import split_chunks, write_pcapng
+
+
+def chunk(start, end, *timestamps):
+    """One decoded chunk as merge_chunk_rows receives it (the state stands in for the section table)."""
+    return (start, end, f's{start}', f's{end}'), [(ts, f'p{ts}', []) for ts in timestamps]
+
+
+def emitted(stream):
+    """Rows as their timestamp, resume markers as ('resume', offset)."""
+    return [ts if ts is not None else ('resume', resume[0]) for ts, _row, _uuids, resume in stream]
+
+
+def test_rows_are_merged_across_chunk_boundaries():
+    chunks = [chunk(0, 10, 1, 5, 9), chunk(10, 20, 7, 12), chunk(20, 30), chunk(30, 40, 30)]
+    # 9 waits for chunk 10-20's 7; no resume point is offered until every held-back row is out
+    assert emitted(merge_chunk_rows(chunks)) == [1, 5, 7, 9, 12, ('resume', 30), 30, ('resume', 40)]
+
+
+def test_resume_points_between_ordered_chunks():
+    chunks = [chunk(0, 10, 1, 2), chunk(10, 20), chunk(20, 30, 3, 3)]
+    # Held rows wait for the next non-empty chunk, whose start then covers the empty one too
+    assert emitted(merge_chunk_rows(chunks)) == [1, 2, ('resume', 20), 3, 3, ('resume', 30)]
+    assert emitted(merge_chunk_rows([chunk(0, 10)])) == [('resume', 10)]
+    assert emitted(merge_chunk_rows([])) == []
+
+
+def test_equal_timestamps_keep_capture_order():
+    chunks = [((0, 10, 's0', 's10'), [(1, 'a', []), (4, 'b', [])]),
+              ((10, 20, 's10', 's20'), [(4, 'c', []), (4, 'd', []), (5, 'e', [])])]
+    assert [row for _ts, row, _uuids, _resume in merge_chunk_rows(chunks) if row] == ['a', 'b', 'c', 'd', 'e']
+
+
+@pytest.fixture
+def disordered_capture(tmp_path):
+    """800 synthetic packets, every 7th one stamped before its predecessor."""
+    frames = list(iter_synthetic_frames(800, n_devices=40, seed=3))
+    for i in range(7, len(frames), 7):
+        (ts_a, frame_a), (ts_b, frame_b) = frames[i - 1], frames[i]
+        frames[i - 1], frames[i] = (ts_b, frame_a), (ts_a, frame_b)
+    path = str(tmp_path / 'capture.pcapng')
+    write_pcapng(path, frames, LINKTYPE_NORDIC_BLE)
+    return path
+
+
+def test_chunked_decode_matches_a_single_pass(disordered_capture):
+    single = [(ts, row) for ts, row, _uuids, _resume in iter_prepared_packets(disordered_capture) if ts is not None]
+    chunks = split_chunks(disordered_capture, 4096)
+    assert len(chunks) > 5
+    results = [decode_chunk((disordered_capture, start, end, state)) for start, end, state, _ in chunks]
+    merged = list(merge_chunk_rows(zip(chunks, results)))
+
+    rows = [(ts, row) for ts, row, _uuids, _resume in merged if ts is not None]
+    assert rows == sorted(single, key=lambda item: item[0])
+
+    # Reading on from any resume point yields exactly the rows merged after it
+    markers = [i for i, (ts, _row, _uuids, _resume) in enumerate(merged) if ts is None]
+    assert merged[markers[-1]][3][0] == chunks[-1][1]
+    for i in markers[::3]:
+        offset, state = merged[i][3]
+        after = [(ts, row) for ts, row, _uuids, _resume in merged[i + 1:] if ts is not None]
+        resumed = [(ts, row) for ts, row, _uuids, _resume in iter_prepared_packets(disordered_capture, start=offset,
+                                                                                   state=state) if ts is not None]
+        assert after == sorted(resumed, key=lambda item: item[0])
@@ -0,0 +1,78 @@
+import random
+from conftest import packet_row
+from utils.db_utils import init_db, PacketStore, update_identity_clusters
+from utils.identity_utils import IdentityGraph, EMPTY_PAYLOAD_FINGERPRINT
+
+
+def observations(seed=11, count=200):
+    """(mac, payload_fingerprint) pairs: 100 MACs over 150 fingerprints, with gaps and empty payloads."""
+    rng = random.Random(seed)
+    choices = list(range(150)) + [None, EMPTY_PAYLOAD_FINGERPRINT]
+    return [(f'aa:bb:cc:00:00:{rng.randrange(100):02x}', rng.choice(choices)) for _ in range(count)]
+
+
+def components(pairs):
+    """Brute-force reference: connected components of the MAC - fingerprint graph, as a set of MAC sets."""
+    neighbours = {}
+    for mac, fingerprint in pairs:
+        neighbours.setdefault(mac, set())
+        if fingerprint is not None and fingerprint != EMPTY_PAYLOAD_FINGERPRINT:
+            neighbours[mac].add(('fp', fingerprint))
+            neighbours.setdefault(('fp', fingerprint), set()).add(mac)
+    seen, clusters = set(), set()
+    for start in [node for node in neighbours if isinstance(node, str)]:
+        if start in seen:
+            continue
+        stack, macs = [start], set()
+        seen.add(start)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                macs.add(node)
+            for other in neighbours[node] - seen:
+                seen.add(other)
+                stack.append(other)
+        clusters.add(frozenset(macs))
+    return clusters
+
+
+def partition(cluster_of):
+    clusters = {}
+    for mac, cluster in cluster_of:
+        clusters.setdefault(cluster, set()).add(mac)
+    return {frozenset(macs) for macs in clusters.values()}
+
+
+def stored_partition(cursor):
+    return partition(cursor.execute('SELECT mac, cluster FROM IdentityCluster').fetchall())
+
+
+def test_union_find_matches_connected_components():
+    pairs = observations()
+    graph = IdentityGraph()
+    for mac, fingerprint in pairs:
+        graph.observe(mac, fingerprint)
+    expected = components(pairs)
+    assert partition(graph.cluster_of.items()) == expected
+    assert len(expected) > 1 and any(len(macs) > 1 for macs in expected)
+    # The label of a cluster is one of its members, and the sizes agree with the members
+    assert all(graph.cluster_of[cluster] == cluster for cluster in graph.members)
+    assert sorted(graph.cluster_sizes().values()) == sorted(len(macs) for macs in expected)
+
+
+def test_incremental_updates_match_one_pass(tmp_path):
+    pairs = observations(seed=12)
+    db_path = str(tmp_path / 'clusters.db')
+    conn, cursor = init_db(db_path)
+    store = PacketStore(cursor)
+    graph = None
+    # Batches of packets, each folded in on its own; the graph is reloaded from the tables every other time
+    for i, start in enumerate(range(0, len(pairs), 70)):
+        store.insert_many([packet_row(n, mac, payload_fingerprint=fingerprint)
+                           for n, (mac, fingerprint) in enumerate(pairs[start:start + 70], start)])
+        graph, consumed = update_identity_clusters(cursor, graph if i % 2 else None, batch_size=32)
+        conn.commit()
+        assert consumed == len(pairs[start:start + 70])
+        assert stored_partition(cursor) == components(pairs[:start + 70])
+    assert update_identity_clusters(cursor, graph)[1] == 0
+    conn.close()
@@ -0,0 +1,124 @@
+import sqlite3
+import pytest
+import logs_to_db
+from benchmarks.synthetic import iter_synthetic_frames
+from logs_to_db import ingest_captures
+from utils.ble_utils import LINKTYPE_NORDIC_BLE
+from utils.db_utils import init_db
+from utils.pcapng_utils import write_pcapng
+
+FRAMES = list(iter_synthetic_frames(3000, n_devices=60, seed=5))
+
+
+def write_capture(path, frames=FRAMES):
+    write_pcapng(str(path), frames, LINKTYPE_NORDIC_BLE)
+    return str(path)
+
+
+def ingest(db_path, capture, storage='flat', **kwargs):
+    """Run one ingest; returns each capture's status."""
+    conn, cursor = init_db(db_path, storage=storage)
+    try:
+        return [result['status'] for result in ingest_captures([capture], conn, cursor, **kwargs)]
+    finally:
+        conn.close()
+
+
+def stored(db_path):
+    """Packets in id order and their UUID rows, keyed by packet position rather than id."""
+    conn = sqlite3.connect(db_path)
+    packets = conn.execute('''
+        SELECT id, timestamp_us, dmac, smac, rssi, packet_hash, source_file, sensor_id FROM BLEPacket ORDER BY id
+    ''').fetchall()
+    position = {row[0]: i for i, row in enumerate(packets)}
+    uuids = sorted((position[packet_id], uuid_type, uuid) for packet_id, uuid_type, uuid
+                   in conn.execute('SELECT ble_packet_id, uuid_type, uuid FROM BLEPacketUUID'))
+    conn.close()
+    return [row[1:] for row in packets], uuids
+
+
+@pytest.fixture
+def reference(tmp_path):
+    """What a single clean ingest of FRAMES stores (reference.db, from tmp_path/capture.pcapng)."""
+    db_path = str(tmp_path / 'reference.db')
+    ingest(db_path, write_capture(tmp_path / 'capture.pcapng'))
+    return stored(db_path)
+
+
+def test_unchanged_capture_is_skipped(tmp_path, reference):
+    db_path = str(tmp_path / 'reference.db')
+    assert ingest(db_path, str(tmp_path / 'capture.pcapng')) == ['skipped']
+    assert stored(db_path) == reference
+
+
+def test_grown_capture_resumes(tmp_path, reference):
+    db_path = str(tmp_path / 'grown.db')
+    capture = write_capture(tmp_path / 'capture.pcapng', FRAMES[:1800])
+    assert ingest(db_path, capture) == ['ingested']
+    write_capture(capture)
+    assert ingest(db_path, capture) == ['resumed']
+    assert stored(db_path) == reference
+
+
+@pytest.mark.parametrize('storage', ['flat', 'normalized'])
+def test_restart_replaces_the_earlier_rows(tmp_path, reference, storage):
+    db_path = str(tmp_path / f'{storage}.db')
+    capture = str(tmp_path / 'capture.pcapng')
+    ingest(db_path, capture, storage)
+    assert ingest(db_path, capture, storage, restart=True) == ['ingested']
+    assert stored(db_path) == reference
+
+
+def test_changed_capture_replaces_the_earlier_rows(tmp_path, reference):
+    db_path = str(tmp_path / 'changed.db')
+    capture = write_capture(tmp_path / 'capture.pcapng', list(iter_synthetic_frames(500, n_devices=10, seed=9)))
+    ingest(db_path, capture)
+    write_capture(capture)
+    assert ingest(db_path, capture) == ['ingested']
+    assert stored(db_path) == reference
+
+
+def test_interrupted_ingest_continues_from_its_checkpoint(tmp_path, reference, monkeypatch):
+    db_path = str(tmp_path / 'interrupted.db')
+    capture = str(tmp_path / 'capture.pcapng')
+    decode = logs_to_db.decode_native_records
+
+    def interrupted(reader):
+        for i, record in enumerate(decode(reader)):
+            if i == 1500:
+                raise RuntimeError('capture read failed')
+            yield record
+
+    monkeypatch.setattr(logs_to_db, 'decode_native_records', interrupted)
+    assert ingest(db_path, capture) == ['failed']
+    partial, _ = stored(db_path)
+    assert 0 < len(partial) < len(reference[0])
+    monkeypatch.undo()
+    assert ingest(db_path, capture) == ['resumed']
+    assert stored(db_path) == reference
+
+
+def test_run_interrupted_before_its_first_checkpoint_is_replaced(tmp_path, reference):
+    db_path = str(tmp_path / 'reference.db')
+    capture = str(tmp_path / 'capture.pcapng')
+    # What start_capture records before the first checkpoint, left behind with rows already written
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE IngestState SET content_hash = NULL, hashed_bytes = 0, completed = 0')
+    conn.commit()
+    conn.close()
+    assert ingest(db_path, capture) == ['ingested']
+    assert stored(db_path) == reference
+
+
+def test_restart_refuses_captures_sharing_a_file_name(tmp_path):
+    db_path = str(tmp_path / 'shared.db')
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first = write_capture(tmp_path / 'a' / 'capture.pcapng', FRAMES[:300])
+    second = write_capture(tmp_path / 'b' / 'capture.pcapng', FRAMES[300:600])
+    ingest(db_path, first)
+    ingest(db_path, second)
+    before = stored(db_path)
+    # Its rows cannot be told apart from the other capture's, so nothing is deleted
+    assert ingest(db_path, second, restart=True) == ['failed']
+    assert stored(db_path) == before
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+from conftest import packet_row
+import macSpoof
+
+COLUMNS = ['id', 'timestamp', 'smac', 'dmac', 'rssi', 'distance', 'fingerprint']
+
+PACKETS = [
+    packet_row(0.0, 'aa:bb:cc:00:00:01', rssi=-40, distance=1.0, payload_fingerprint=11),
+    packet_row(1.0, 'aa:bb:cc:00:00:01', rssi=-80, distance=30.0, payload_fingerprint=12),   # both jump
+    packet_row(1.0, 'aa:bb:cc:00:00:01', rssi=-81, distance=31.0, payload_fingerprint=11),   # same timestamp
+    packet_row(2.0, 'aa:bb:cc:00:00:01', rssi=None, distance=None, payload_fingerprint=11),  # missing rssi / distance
+    packet_row(None, 'aa:bb:cc:00:00:01', rssi=-40, distance=1.0, payload_fingerprint=13),   # no timestamp: last
+    packet_row(0.5, 'aa:bb:cc:00:00:02', rssi=-50, distance=2.0, payload_fingerprint=21),    # single packet
+    packet_row(0.2, 'AA:BB:CC:00:00:03', dmac='FF:FF:FF:FF:FF:FF', rssi=-45, distance=1.5, payload_fingerprint=31),
+    packet_row(0.3, 'AA:BB:CC:00:00:03', dmac='FF:FF:FF:FF:FF:FF', rssi=-90, distance=60.0, payload_fingerprint=32),
+    packet_row(0.9, 'AA:BB:CC:00:00:03', dmac='FF:FF:FF:FF:FF:FF', rssi=-88, distance=58.0, payload_fingerprint=32),
+]
+
+
+def comparable(frame):
+    frame = frame[COLUMNS + [column for column in ('prev_fingerprint', 'prev_rssi', 'prev_distance')
+                             if column in frame.columns]]
+    return frame.astype({'smac': object, 'dmac': object}).reset_index(drop=True)
+
+
+@pytest.fixture
+def spoof_db(packet_db, monkeypatch):
+    db_path = packet_db(PACKETS)
+    monkeypatch.setattr(macSpoof, 'DB_PATH', db_path)
+    return db_path
+
+
+def pandas_frame():
+    return macSpoof.generate_fingerprints(macSpoof.normalize_data(macSpoof.load_data()))
+
+
+def test_fingerprint_changes_sql_matches_pandas(spoof_db):
+    reference = macSpoof.detect_fingerprint_changes(pandas_frame())
+    sql = macSpoof.detect_fingerprint_changes_sql(spoof_db)
+    pd.testing.assert_frame_equal(comparable(sql), comparable(reference), check_dtype=False)
+    assert reference['fingerprint'].tolist() == [12, 11, 13, 32]
+
+
+@pytest.mark.parametrize('rssi_thresh, dist_thresh', [(25, 10), (0, 0), (100, 100)])
+def test_rssi_distance_sql_matches_pandas(spoof_db, rssi_thresh, dist_thresh):
+    reference = macSpoof.detect_rssi_distance_anomalies(pandas_frame(), rssi_thresh, dist_thresh)
+    sql = macSpoof.detect_rssi_distance_anomalies_sql(spoof_db, rssi_thresh, dist_thresh)
+    pd.testing.assert_frame_equal(comparable(sql), comparable(reference), check_dtype=False)
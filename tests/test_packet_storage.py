@@ -0,0 +1,145 @@
+import hashlib
+import sqlite3
+from conftest import packet_row
+from utils.ble_utils import format_timestamp, timestamp_to_us
+import pytest
+from utils.db_utils import (init_db, normalize_packet_storage, lowercase_macs, packet_fingerprints, packet_generation,
+                            insert_malicious_attack_data, PACKET_COLUMNS, PACKET_HASH_BLOB_STATE)
+
+HASHES = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(4)]
+
+
+def complete_row(offset_sec, smac, packet_hash, fingerprint):
+    """packet_row with the timestamp text and both fingerprints, as the ingester writes it."""
+    row = dict(zip(PACKET_COLUMNS, packet_row(offset_sec, smac, distance=offset_sec, packet_hash=packet_hash,
+                                              content_fingerprint=fingerprint, payload_fingerprint=fingerprint)))
+    row['timestamp'] = format_timestamp(row['timestamp_us'])
+    return tuple(row.values())
+
+
+PACKETS = [
+    complete_row(0.0, 'aa:bb:cc:00:00:01', HASHES[0], 1),
+    complete_row(0.5, 'aa:bb:cc:00:00:02', HASHES[1], 2),
+    complete_row(1.0, 'aa:bb:cc:00:00:01', HASHES[0], 1),
+    complete_row(1.5, 'aa:bb:cc:00:00:03', 'replayhash1', 3),          # not a hex hash: kept as text
+    complete_row(2.0, 'aa:bb:cc:00:00:03', HASHES[2].upper(), 3),      # upper case: kept as text
+    complete_row(2.5, 'aa:bb:cc:00:00:04', None, 4),
+]
+
+
+def view_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f"SELECT {', '.join(PACKET_COLUMNS)} FROM BLEPacket ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+def stored_hash_types(db_path):
+    conn = sqlite3.connect(db_path)
+    types = [row[0] for row in conn.execute('SELECT typeof(packet_hash) FROM BLEPacketCompact ORDER BY id')]
+    conn.close()
+    return types
+
+
+def test_normalized_hashes_are_stored_as_blobs(packet_db):
+    flat = packet_db(PACKETS)
+    normalized = packet_db(PACKETS, storage='normalized')
+    assert view_rows(normalized) == view_rows(flat)
+    assert stored_hash_types(normalized) == ['blob', 'blob', 'blob', 'text', 'text', 'null']
+    conn = sqlite3.connect(normalized)
+    assert conn.execute('SELECT length(packet_hash) FROM BLEPacketCompact WHERE id = 1').fetchone() == (32,)
+    conn.close()
+
+
+def test_flat_database_is_normalized_with_blob_hashes(packet_db):
+    flat = packet_db(PACKETS)
+    expected = view_rows(flat)
+    conn, _cursor = init_db(flat)
+    assert normalize_packet_storage(conn) == len(PACKETS)
+    conn.close()
+    assert view_rows(flat) == expected
+    assert stored_hash_types(flat)[:3] == ['blob'] * 3
+
+
+def test_older_normalized_database_is_upgraded(packet_db):
+    db_path = packet_db(PACKETS, storage='normalized')
+    expected = view_rows(db_path)
+    # As an earlier version left it: hex text hashes and binary copies of the MAC and payload text
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE BLEPacketCompact SET packet_hash = lower(hex(packet_hash)) WHERE typeof(packet_hash) = 'blob'")
+    conn.execute('ALTER TABLE Device ADD COLUMN mac48 INTEGER')
+    conn.execute('ALTER TABLE Payload ADD COLUMN bytes BLOB')
+    conn.execute('DELETE FROM DetectorState WHERE name = ?', (PACKET_HASH_BLOB_STATE,))
+    conn.commit()
+    conn.close()
+    assert set(stored_hash_types(db_path)) == {'text', 'null'}
+
+    init_db(db_path)[0].close()
+    assert view_rows(db_path) == expected
+    assert stored_hash_types(db_path) == ['blob', 'blob', 'blob', 'text', 'text', 'null']
+    conn = sqlite3.connect(db_path)
+    assert 'mac48' not in {row[1] for row in conn.execute('PRAGMA table_info(Device)')}
+    assert 'bytes' not in {row[1] for row in conn.execute('PRAGMA table_info(Payload)')}
+    conn.close()
+
+
+@pytest.mark.parametrize('storage', ['flat', 'normalized'])
+def test_upper_case_macs_are_lower_cased_once(packet_db, storage):
+    db_path = packet_db(PACKETS, storage=storage)
+    expected = view_rows(db_path)
+    # As an earlier version stored them: packet 1 with an upper-case smac (and device id in the
+    # normalized layout), packet 2 with an upper-case dmac and the fingerprint hashed from it
+    conn = sqlite3.connect(db_path)
+    if storage == 'normalized':
+        conn.execute("INSERT INTO Device (mac) VALUES ('AA:BB:CC:00:00:01'), ('FF:FF:FF:FF:FF:FF')")
+        conn.execute("UPDATE BLEPacketCompact SET smac_id = (SELECT id FROM Device WHERE mac = 'AA:BB:CC:00:00:01') "
+                     "WHERE id = 1")
+        conn.execute("UPDATE BLEPacketCompact SET dmac_id = (SELECT id FROM Device WHERE mac = 'FF:FF:FF:FF:FF:FF') "
+                     "WHERE id = 2")
+    else:
+        conn.execute("UPDATE BLEPacket SET smac = upper(smac) WHERE id = 1")
+        conn.execute("UPDATE BLEPacket SET dmac = upper(dmac) WHERE id = 2")
+    conn.commit()
+    conn.close()
+    assert view_rows(db_path)[0][2] == 'AA:BB:CC:00:00:01'
+
+    conn, cursor = init_db(db_path)
+    generation = packet_generation(cursor)
+    assert lowercase_macs(conn) == 2
+    assert packet_generation(cursor) == generation + 1
+    fingerprints = packet_fingerprints(cursor, [(2, 'ff:ff:ff:ff:ff:ff', None, None)])[0][:2]
+    assert lowercase_macs(conn) == 0
+    assert packet_generation(cursor) == generation + 1
+    if storage == 'normalized':
+        assert cursor.execute("SELECT COUNT(*) FROM Device WHERE mac <> lower(mac)").fetchone() == (0,)
+    conn.close()
+    index = PACKET_COLUMNS.index('content_fingerprint')
+    expected[1] = expected[1][:index] + fingerprints + expected[1][index + 2:]
+    assert view_rows(db_path) == expected
+
+
+@pytest.mark.parametrize('storage', ['flat', 'normalized'])
+def test_mock_rows_are_written_complete_and_once(packet_db, storage):
+    db_path = packet_db([complete_row(i, 'aa:bb:cc:00:00:01', None, 1) for i in range(20)], storage=storage)
+    conn, cursor = init_db(db_path)
+    generation = packet_generation(cursor)
+    conn.close()
+
+    insert_malicious_attack_data(db_path)
+    conn, cursor = init_db(db_path)
+    # Ids 1-15 replace packets the watermarks have passed: one rewrite, and no backfill after it
+    assert packet_generation(cursor) == generation + 1
+    rows = cursor.execute('SELECT id, dmac, company_id, manufacturer_data, content_fingerprint, payload_fingerprint, '
+                          'timestamp, timestamp_us, smac FROM BLEPacket WHERE id <= 15 ORDER BY id').fetchall()
+    assert [row[7] for row in rows] == [timestamp_to_us(row[6]) for row in rows]
+    assert [row[4:6] for row in rows] == [fingerprints[:2] for fingerprints in
+                                          packet_fingerprints(cursor, [row[:4] for row in rows])]
+    assert all(row[8] == row[8].lower() for row in rows)
+    stored = view_rows(db_path)
+    conn.close()
+
+    insert_malicious_attack_data(db_path)
+    conn, cursor = init_db(db_path)
+    assert packet_generation(cursor) == generation + 1
+    conn.close()
+    assert view_rows(db_path) == stored
@@ -0,0 +1,101 @@
+import os
+import pytest
+from utils.pipeline_utils import Stage, StageCache, run_pipeline
+
+
+class Counter:
+    """Stage bodies that write a file and count their runs; ``settings`` stands in for config values."""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.runs = {}
+        self.settings = {'threshold': 1, 'db': 0}
+        self.contents = {'raw.csv': 'a,b\n1,2\n'}
+
+    def path(self, name):
+        return str(self.tmp_path / name)
+
+    def writer(self, stage_name, output, content=None):
+        def run(values):
+            self.runs[stage_name] = self.runs.get(stage_name, 0) + 1
+            with open(self.path(output), 'w') as f:
+                f.write(content(values) if content else self.contents.get(output, stage_name))
+        return run
+
+    def stages(self):
+        def shared(values):
+            self.runs['frame'] = self.runs.get('frame', 0) + 1
+            return 'frame'
+        return [
+            Stage('detect', self.writer('detect', 'raw.csv'), inputs=lambda: {'threshold': self.settings['threshold']},
+                  outputs=[self.path('raw.csv')]),
+            Stage('frame', shared, shared=True),
+            Stage('report', self.writer('report', 'report.txt', lambda values: values['frame']),
+                  deps=['detect', 'frame'], inputs=lambda: {}, outputs=[self.path('report.txt')]),
+        ]
+
+    def run(self, force=False):
+        cache = StageCache(self.path('manifest.json'), force=force)
+        results = run_pipeline(self.stages(), cache=cache, log=lambda message: None)
+        return {name: result['status'] for name, result in results.items()}
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    return Counter(tmp_path)
+
+
+def test_unchanged_inputs_are_hits(pipeline):
+    assert pipeline.run() == {'detect': 'ok', 'frame': 'ok', 'report': 'ok'}
+    assert pipeline.run() == {'detect': 'cached', 'frame': 'unused', 'report': 'cached'}
+    assert pipeline.runs == {'detect': 1, 'frame': 1, 'report': 1}
+    assert pipeline.run(force=True) == {'detect': 'ok', 'frame': 'ok', 'report': 'ok'}
+
+
+def test_changed_input_reruns_only_what_reads_a_changed_artifact(pipeline):
+    pipeline.run()
+    pipeline.settings['threshold'] = 2
+    # detect re-runs but writes the same contents: report stays cached
+    assert pipeline.run() == {'detect': 'ok', 'frame': 'unused', 'report': 'cached'}
+    pipeline.settings['threshold'] = 3
+    pipeline.contents['raw.csv'] = 'a,b\n1,3\n'
+    assert pipeline.run() == {'detect': 'ok', 'frame': 'ok', 'report': 'ok'}
+
+
+def test_outputs_are_checked_by_content(pipeline):
+    pipeline.run()
+    # Same contents, new mtime: re-hashed and still a hit
+    os.utime(pipeline.path('report.txt'), ns=(0, 0))
+    assert pipeline.run()['report'] == 'cached'
+    with open(pipeline.path('report.txt'), 'w') as f:
+        f.write('edited')
+    assert pipeline.run()['report'] == 'ok'
+    os.remove(pipeline.path('raw.csv'))
+    assert pipeline.run() == {'detect': 'ok', 'frame': 'unused', 'report': 'cached'}
+
+
+def test_a_failed_stage_is_forgotten(pipeline):
+    pipeline.run()
+    stages = pipeline.stages()
+    stages[2].run = lambda values: 1 / 0
+    cache = StageCache(pipeline.path('manifest.json'))
+    pipeline.settings['threshold'] = 2
+    pipeline.contents['raw.csv'] = 'changed'
+    results = run_pipeline(stages, cache=cache, log=lambda message: None)
+    assert results['report']['status'] == 'failed' and 'ZeroDivisionError' in results['report']['error']
+    assert 'report' not in StageCache(pipeline.path('manifest.json')).entries
+    assert pipeline.run()['report'] == 'ok'
+
+
+def test_a_database_writer_is_keyed_after_its_own_writes(pipeline):
+    def ingest(values):
+        pipeline.runs['ingest'] = pipeline.runs.get('ingest', 0) + 1
+        pipeline.settings['db'] += 1
+    stages = [Stage('ingest', ingest, inputs=lambda: {'db': pipeline.settings['db']}, writes_db=True)]
+    cache_path = pipeline.path('manifest.json')
+    assert run_pipeline(stages, cache=StageCache(cache_path), log=lambda message: None)['ingest']['status'] == 'ok'
+    assert run_pipeline(stages, cache=StageCache(cache_path), log=lambda message: None)['ingest']['status'] == 'cached'
+    # A write from outside the pipeline is a miss
+    pipeline.settings['db'] += 1
+    assert run_pipeline(stages, cache=StageCache(cache_path), log=lambda message: None)['ingest']['status'] == 'ok'
+    assert pipeline.runs['ingest'] == 2
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import packet_row, START_US
+from proximityAlert import (load_distance_data, detect_proximity_anomalies_matrix, detect_proximity_anomalies_sql,
+                            iter_proximity_anomalies, aggregate_episodes)
+
+PACKETS = [
+    packet_row(0.0, 'aa:bb:cc:00:00:01', distance=1.0),
+    packet_row(0.5, 'aa:bb:cc:00:00:01', distance=50.0),
+    packet_row(1.0, 'aa:bb:cc:00:00:01', distance=2.0),
+    packet_row(1.0, 'aa:bb:cc:00:00:01', distance=70.0),    # same timestamp: never paired with each other
+    packet_row(1.2, 'aa:bb:cc:00:00:01', distance=None),    # no distance
+    packet_row(None, 'aa:bb:cc:00:00:01', distance=90.0),   # no timestamp
+    packet_row(6.0, 'aa:bb:cc:00:00:01', distance=3.0),
+    packet_row(2.0, 'aa:bb:cc:00:00:02', distance=80.0),    # single packet
+    packet_row(3.0, 'AA:BB:CC:00:00:03', distance=5.0),     # upper-case input: stored lower-case
+    packet_row(3.4, 'AA:BB:CC:00:00:03', distance=60.0),
+    packet_row(3.5, 'AA:BB:CC:00:00:03', distance=15.0),
+    packet_row(0.2, 'aa:bb:cc:00:00:04', distance=10.0),
+    packet_row(0.7, 'aa:bb:cc:00:00:04', distance=20.0),    # within the threshold
+    packet_row(4.0, 'aa:bb:cc:00:00:05', distance=0.5),
+    packet_row(4.0, 'aa:bb:cc:00:00:05', distance=99.0),    # only equal timestamps
+]
+
+
+def crowded_frame(seed=7):
+    """60 packets of three devices on a coarse 100 ms grid, so many share a timestamp."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'timestamp': (START_US + rng.integers(0, 40, 60) * 100_000).astype('datetime64[us]'),
+        'smac': pd.Categorical(rng.choice(['aa:bb:cc:00:00:01', 'aa:bb:cc:00:00:02', 'aa:bb:cc:00:00:03'], 60)),
+        'distance': rng.choice([1.0, 5.0, 20.0, 45.0, 90.0], 60),
+    })
+
+
+def raw_pairs(anomalies):
+    """The pairs as plain tuples, in the order they were produced."""
+    return [(pair['smac'], pair['timestamp_1'], pair['distance_1'], pair['timestamp_2'], pair['distance_2'],
+             pair['distance_diff'], pair['time_window_sec']) for pair in anomalies]
+
+
+def pair_keys(anomalies):
+    """Order-free comparison key of anomaly pairs."""
+    return sorted((pair['smac'], int(pair['timestamp_1'].astype('datetime64[us]').astype('int64')), pair['distance_1'],
+                   int(pair['timestamp_2'].astype('datetime64[us]').astype('int64')), pair['distance_2'],
+                   pair['distance_diff'], round(float(pair['time_window_sec']), 9))
+                  for pair in anomalies)
+
+
+@pytest.fixture
+def proximity_db(packet_db):
+    return packet_db(PACKETS)
+
+
+def test_matrix_finds_the_expected_pairs(proximity_db):
+    pairs = pair_keys(detect_proximity_anomalies_matrix(load_distance_data(proximity_db)))
+    assert [(smac, d1, d2) for smac, _t1, d1, _t2, d2, _diff, _window in pairs] == [
+        ('aa:bb:cc:00:00:01', 50.0, 1.0),
+        ('aa:bb:cc:00:00:01', 2.0, 50.0),
+        ('aa:bb:cc:00:00:01', 70.0, 1.0),
+        ('aa:bb:cc:00:00:03', 60.0, 5.0),
+        ('aa:bb:cc:00:00:03', 15.0, 60.0),
+    ]
+
+
+@pytest.mark.parametrize('threshold, min_window', [(40, 1), (5, 0.1), (5, 10)])
+def test_sql_matches_matrix(proximity_db, threshold, min_window):
+    reference = detect_proximity_anomalies_matrix(load_distance_data(proximity_db), threshold, min_window)
+    sql = detect_proximity_anomalies_sql(proximity_db, threshold, min_window)
+    assert pair_keys(sql) == pair_keys(reference)
+    # aggregate_episodes needs each device's pairs in non-decreasing timestamp_1 order
+    keys = [(pair['smac'], pair['timestamp_1']) for pair in sql]
+    assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize('threshold, min_window', [(40, 1), (5, 0.1), (5, 10), (0, 1)])
+def test_sliding_window_matches_matrix(proximity_db, threshold, min_window):
+    df = load_distance_data(proximity_db)
+    reference = detect_proximity_anomalies_matrix(df, threshold, min_window)
+    # Same pairs in the same order, not just the same set
+    assert raw_pairs(iter_proximity_anomalies(df, threshold, min_window)) == raw_pairs(reference)
+
+
+@pytest.mark.parametrize('threshold', [0, 10, 40, 100])
+def test_sliding_window_matches_matrix_on_equal_timestamps(threshold):
+    df = crowded_frame()
+    reference = detect_proximity_anomalies_matrix(df, threshold, 0.2)
+    assert raw_pairs(iter_proximity_anomalies(df, threshold, 0.2)) == raw_pairs(reference)
+    # A packet is only paired with strictly earlier ones
+    assert all(pair['timestamp_1'] > pair['timestamp_2'] for pair in reference)
+    if threshold == 0:
+        assert reference
+
+
+def test_sliding_window_matches_sql(proximity_db):
+    df = load_distance_data(proximity_db)
+    assert pair_keys(iter_proximity_anomalies(df)) == pair_keys(detect_proximity_anomalies_sql(proximity_db))
+
+
+def union_episodes(anomalies):
+    """Brute-force reference: per smac, the union of the closed [timestamp_2, timestamp_1] spans."""
+    by_device = {}
+    for pair in anomalies:
+        by_device.setdefault(pair['smac'], []).append(pair)
+    episodes = []
+    for smac, pairs in sorted(by_device.items()):
+        merged = []
+        for pair in sorted(pairs, key=lambda pair: pair['timestamp_2']):
+            if merged and pair['timestamp_2'] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], pair['timestamp_1'])
+                merged[-1][2].append(pair)
+            else:
+                merged.append([pair['timestamp_2'], pair['timestamp_1'], [pair]])
+        episodes += [(smac, start, end, len(group), max(pair['distance_diff'] for pair in group))
+                     for start, end, group in merged]
+    return episodes
+
+
+def episode_keys(episodes):
+    return [(episode['smac'], episode['start'], episode['end'], episode['pair_count'], episode['peak_distance_diff'])
+            for episode in episodes]
+
+
+@pytest.mark.parametrize('threshold, min_window', [(40, 1), (5, 0.1), (5, 10), (0, 1)])
+def test_episodes_are_the_union_of_overlapping_pairs(proximity_db, threshold, min_window):
+    pairs = list(iter_proximity_anomalies(load_distance_data(proximity_db), threshold, min_window))
+    episodes = aggregate_episodes(pairs)
+    assert episode_keys(episodes) == union_episodes(pairs)
+    assert sum(episode['pair_count'] for episode in episodes) == len(pairs)
+    for episode in episodes:
+        assert episode['duration_sec'] == (episode['end'] - episode['start']) / np.timedelta64(1, 's')
+        # The reported pair is the largest jump of the episode
+        assert episode['peak_distance_diff'] == abs(episode['distance_1'] - episode['distance_2'])
+
+
+@pytest.mark.parametrize('threshold', [0, 10, 40])
+def test_episodes_on_equal_timestamps(threshold):
+    pairs = list(iter_proximity_anomalies(crowded_frame(), threshold, 0.2))
+    assert episode_keys(aggregate_episodes(pairs)) == union_episodes(pairs)
+
+
+def test_episodes_continue_across_runs():
+    pairs = list(iter_proximity_anomalies(crowded_frame(), 10, 0.2))
+    full = sorted(episode_keys(aggregate_episodes(pairs)))
+    for split in range(len(pairs) + 1):
+        stored = aggregate_episodes(pairs[:split])
+        # As update_proximity_alerts: each device's last episode is continued, and replaces the stored one
+        previous = {episode['smac']: episode for episode in stored}
+        added = aggregate_episodes(pairs[split:], previous)
+        touched = {episode['smac'] for episode in added}
+        kept = [episode for episode in stored
+                if episode['smac'] not in touched or previous[episode['smac']] is not episode]
+        assert sorted(episode_keys(kept + added)) == full
@@ -0,0 +1,196 @@
+import random
+import sqlite3
+import pandas as pd
+import pytest
+from conftest import packet_row, START_US
+from benchmarks.synthetic import iter_synthetic_frames
+from config import REPLAY_TIME_WINDOW_SEC
+from logs_to_db import ingest_captures
+from utils.ble_utils import LINKTYPE_NORDIC_BLE
+from utils.db_utils import PACKET_COLUMNS, ensure_indexes, init_db
+from utils.pcapng_utils import write_pcapng
+from replayAttack import (ALERT_COLUMNS, load_packet_hash_data, detect_replay_attacks, detect_replay_attacks_vectorized,
+                          detect_replay_attacks_by_fingerprint, detect_replay_attacks_bloom, detect_replay_attacks_sql,
+                          detect_replay_attacks_by_hash_sql, has_content_fingerprints, load_streaming_alerts)
+from utils.replay_utils import StreamingReplayDetector
+
+WINDOW_SEC = 1.0
+
+# One fingerprint per packet_hash, so the packet_hash and fingerprint detectors see the same groups
+PACKETS = [
+    packet_row(0.0, 'aa:bb:cc:00:00:01', packet_hash='h1', content_fingerprint=1),
+    packet_row(0.5, 'aa:bb:cc:00:00:02', packet_hash='h1', content_fingerprint=1),   # replay of the first
+    packet_row(3.0, 'aa:bb:cc:00:00:01', packet_hash='h1', content_fingerprint=1),
+    packet_row(10.0, 'aa:bb:cc:00:00:03', packet_hash='h2', content_fingerprint=2),
+    packet_row(10.0, 'aa:bb:cc:00:00:04', packet_hash='h2', content_fingerprint=2),  # same timestamp
+    packet_row(12.0, 'aa:bb:cc:00:00:05', packet_hash='h3', content_fingerprint=3),  # seen once
+    packet_row(20.0, 'AA:BB:CC:00:00:06', packet_hash='h4', content_fingerprint=4),
+    packet_row(22.0, 'AA:BB:CC:00:00:06', packet_hash='h4', content_fingerprint=4),  # outside the window
+    packet_row(23.0, 'aa:bb:cc:00:00:07', packet_hash='h5', content_fingerprint=5),
+    packet_row(23.0 + WINDOW_SEC, 'aa:bb:cc:00:00:08', packet_hash='h5', content_fingerprint=5),  # exactly one window
+    packet_row(30.0, 'aa:bb:cc:00:00:09', packet_hash='h6', content_fingerprint=6),
+    packet_row(30.2, 'AA:BB:CC:00:00:0A', packet_hash='h6', content_fingerprint=6),  # upper-case input: stored lower-case
+    packet_row(31.0, 'aa:bb:cc:00:00:09', packet_hash='h6', content_fingerprint=6),
+    packet_row(5.0, 'aa:bb:cc:00:00:0b', packet_hash='h7', content_fingerprint=7),   # stored out of time order
+    packet_row(4.9, 'aa:bb:cc:00:00:0c', packet_hash='h7', content_fingerprint=7),
+    packet_row(None, 'aa:bb:cc:00:00:0d', packet_hash='h3'),                         # no timestamp
+    packet_row(40.0, 'aa:bb:cc:00:00:0e'),                                           # no hash
+]
+# (fingerprint, first_seen_us, repeated_at_us, repeating smac)
+EXPECTED = [
+    (1, 0.0, 0.5, 'aa:bb:cc:00:00:02'),
+    (2, 10.0, 10.0, 'aa:bb:cc:00:00:04'),
+    (6, 30.0, 30.2, 'aa:bb:cc:00:00:0a'),
+    (7, 4.9, 5.0, 'aa:bb:cc:00:00:0b'),
+]
+
+
+def expected_events():
+    return [(fingerprint, START_US + round(first * 1_000_000), START_US + round(repeated * 1_000_000), smac)
+            for fingerprint, first, repeated, smac in EXPECTED]
+
+
+def fingerprint_events(alerts):
+    """(fingerprint, first_seen_us, repeated_at_us, smac) of fingerprint-detector alerts."""
+    frame = pd.DataFrame(alerts)
+    first = frame['first_seen'].to_numpy(dtype='datetime64[us]').view('int64')
+    repeated = frame['repeated_at'].to_numpy(dtype='datetime64[us]').view('int64')
+    return sorted(zip(frame['content_fingerprint'].tolist(), first.tolist(), repeated.tolist(), frame['smac']))
+
+
+def plain(frame):
+    """String and categorical columns as object, so the frames compare on values rather than on string dtypes."""
+    return frame.astype({column: object for column in ('packet_hash', 'dmac', 'smac')})
+
+
+@pytest.fixture
+def replay_db(packet_db):
+    return packet_db(PACKETS)
+
+
+def test_vectorized_matches_reference(replay_db):
+    df = load_packet_hash_data(replay_db)
+    reference = pd.DataFrame(detect_replay_attacks(df, WINDOW_SEC), columns=ALERT_COLUMNS)
+    vectorized = detect_replay_attacks_vectorized(df, WINDOW_SEC)
+    pd.testing.assert_frame_equal(plain(reference), plain(vectorized))
+    assert reference['packet_hash'].tolist() == ['h1', 'h2', 'h6', 'h7']
+    # Missing timestamps still count as repetitions of their hash
+    assert reference['repetition_count'].tolist() == [3, 2, 3, 2]
+
+
+def test_vectorized_reference_on_a_frame_without_replays(replay_db):
+    df = load_packet_hash_data(replay_db)
+    df = df[~df['packet_hash'].isin(['h1', 'h2', 'h6', 'h7'])].reset_index(drop=True)
+    assert detect_replay_attacks(df, WINDOW_SEC) == []
+    assert detect_replay_attacks_vectorized(df, WINDOW_SEC).empty
+
+
+def test_hash_sql_matches_vectorized(replay_db):
+    vectorized = detect_replay_attacks_vectorized(load_packet_hash_data(replay_db), WINDOW_SEC)
+    sql = detect_replay_attacks_by_hash_sql(replay_db, WINDOW_SEC)
+    pd.testing.assert_frame_equal(plain(sql), plain(vectorized), check_dtype=False)
+
+
+def test_fingerprint_scan_finds_the_expected_replays(replay_db):
+    alerts = detect_replay_attacks_by_fingerprint(replay_db, WINDOW_SEC)
+    assert fingerprint_events(alerts) == expected_events()
+    assert [alert['repetition_count'] for alert in alerts] == [3, 2, 3, 2]
+
+
+def test_fingerprint_sql_matches_the_fingerprint_scan(replay_db):
+    reference = detect_replay_attacks_by_fingerprint(replay_db, WINDOW_SEC)
+    assert detect_replay_attacks_sql(replay_db, WINDOW_SEC) == reference
+
+
+def test_bloom_scan_matches_the_fingerprint_scan(replay_db):
+    reference = detect_replay_attacks_by_fingerprint(replay_db, WINDOW_SEC)
+    stats = {}
+    # A tiny, crowded filter: false candidates must be rejected by the exact lookup
+    bloom = detect_replay_attacks_bloom(replay_db, WINDOW_SEC, capacity=2, fp_rate=0.5, stats=stats)
+    assert fingerprint_events(bloom) == fingerprint_events(reference)
+    assert [alert['repetition_count'] for alert in bloom] == [alert['repetition_count'] for alert in reference]
+    assert stats['confirmed'] == len(EXPECTED)
+
+
+def streaming_events(rows, detector):
+    """Feed PACKET_COLUMNS dicts to the detector in the given order; the earliest alert per fingerprint, as upserted."""
+    events = {}
+    for row in rows:
+        alert = detector.observe(row['content_fingerprint'], row['timestamp_us'], row['smac'].lower())
+        fingerprint = row['content_fingerprint']
+        if alert is not None and (fingerprint not in events or alert[1] < events[fingerprint][1]):
+            events[fingerprint] = alert
+    return sorted((fingerprint, *alert) for fingerprint, alert in events.items())
+
+
+def test_streaming_detector_matches_the_fingerprint_scan(replay_db):
+    rows = [dict(zip(PACKET_COLUMNS, row)) for row in PACKETS]
+    # Stored (id) order: the h7 pair arrives newest first, 26 seconds late
+    detector = StreamingReplayDetector(WINDOW_SEC, reorder_sec=30)
+    events = streaming_events(rows, detector)
+    assert not detector.recheck
+    assert events == fingerprint_events(detect_replay_attacks_by_fingerprint(replay_db, WINDOW_SEC))
+
+
+def test_streaming_detector_compares_a_late_packet_with_both_neighbours():
+    detector = StreamingReplayDetector(window_sec=60, reorder_sec=600)
+    assert detector.observe(1, 100_000_000, 'a') is None
+    assert detector.observe(1, 0, 'b') is None
+    assert detector.observe(1, 50_000_000, 'c') == (0, 50_000_000, 'c')
+    assert detector.observe(1, 40_000_000, 'd') == (0, 40_000_000, 'd')
+    assert detector.observe(1, 45_000_000, 'e') is None  # a later pair than the alert
+    assert not detector.recheck
+
+
+def test_streaming_detector_within_the_reorder_horizon(packet_db):
+    rng = random.Random(7)
+    rows = [packet_row(rng.uniform(0, 600), f'aa:bb:cc:00:00:{i % 40:02x}', content_fingerprint=rng.randrange(30))
+            for i in range(1500)]
+    # Sorted by time, then shuffled within blocks of up to 5 seconds
+    rows.sort(key=lambda row: (row[PACKET_COLUMNS.index('timestamp_us')] - START_US) // 5_000_000 + rng.random())
+    db_path = packet_db(rows)
+    detector = StreamingReplayDetector(window_sec=5, reorder_sec=10)
+    events = streaming_events([dict(zip(PACKET_COLUMNS, row)) for row in rows], detector)
+    assert not detector.recheck
+    assert events == fingerprint_events(detect_replay_attacks_by_fingerprint(db_path, 5))
+
+
+def test_multi_file_ingest_matches_the_fingerprint_scan(tmp_path):
+    rng = random.Random(3)
+    frames = [frame for _ts, frame in iter_synthetic_frames(2000, n_devices=40, seed=5)]
+    times = sorted(START_US + rng.randrange(900_000_000) for _ in frames)
+    # a_ holds the last third of the time range, b_ the middle and c_ the first: ingested newest first
+    thirds = [list(zip(times, frames))[i::3] for i in range(3)]
+    captures = []
+    for name, part in zip(('c', 'b', 'a'), (thirds[0][:len(thirds[0]) // 2], thirds[1], thirds[2])):
+        captures.append(str(tmp_path / f'{name}_sensor.pcapng'))
+        write_pcapng(captures[-1], sorted(part), LINKTYPE_NORDIC_BLE)
+    # A late sensor covering the whole range
+    captures.append(str(tmp_path / 'd_sensor.pcapng'))
+    write_pcapng(captures[-1], sorted(thirds[0][len(thirds[0]) // 2:]), LINKTYPE_NORDIC_BLE)
+    db_path = str(tmp_path / 'ingest.db')
+    conn, cursor = init_db(db_path)
+    ingest_captures(captures, conn, cursor)
+    queued = cursor.execute('SELECT COUNT(*) FROM ReplayRecheck').fetchone()[0]
+    conn.close()
+    assert queued == 0
+    batch = detect_replay_attacks_by_fingerprint(db_path, REPLAY_TIME_WINDOW_SEC)
+    assert len(batch) > 20
+    assert load_streaming_alerts(db_path) == batch
+
+
+def test_fingerprint_path_does_not_depend_on_the_index(packet_db):
+    rows = [dict(zip(PACKET_COLUMNS, row)) for row in PACKETS]
+    db_path = packet_db([tuple(row.values()) for row in rows
+                         if row['content_fingerprint'] is not None and row['timestamp_us'] is not None])
+    conn = sqlite3.connect(db_path)
+    conn.execute('DROP INDEX idx_blepacket_fingerprint_time')
+    conn.commit()
+    assert has_content_fingerprints(db_path)
+    assert ensure_indexes(db_path, ['idx_blepacket_fingerprint_time']) == ['idx_blepacket_fingerprint_time']
+    assert ensure_indexes(db_path, ['idx_blepacket_fingerprint_time']) == []
+    # A packet without a fingerprint, not a missing index, sends the scan to packet_hash grouping
+    conn.execute('UPDATE BLEPacket SET content_fingerprint = NULL WHERE id = 1')
+    conn.commit()
+    conn.close()
+    assert not has_content_fingerprints(db_path)
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import time
+from datetime import datetime
+import pytest
+from benchmarks.synthetic import iter_synthetic_frames
+from logs_to_db import ingest_captures, iter_native_packets, prepare_packet
+from utils.ble_utils import LINKTYPE_NORDIC_BLE, format_timestamp, timestamp_to_us
+from utils.db_utils import init_db, PacketStore, packet_generation, TIMESTAMP_UTC_STATE
+from utils.pcapng_utils import write_pcapng
+from utils.time_utils import local_time, timestamp_us_to_datetime, utc_offset_us
+
+HOUR_US = 3600 * 1_000_000
+# 2025-11-02 04:50 UTC, 00:50 EDT: New York falls back to EST at 06:00 UTC, repeating 01:00-02:00 local
+FALL_BACK_US = 1_762_059_000_000_000
+# Every 20 minutes for three hours across the change
+TIMES_US = [FALL_BACK_US + i * 20 * 60 * 1_000_000 for i in range(10)]
+
+
+@pytest.fixture
+def new_york():
+    """Run the test with the local clock in America/New_York."""
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def stored_times(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT timestamp_us, timestamp FROM BLEPacket ORDER BY id').fetchall()
+    conn.close()
+    return rows
+
+
+def test_format_and_parse_across_the_fall_back(new_york):
+    texts = [format_timestamp(ts_us) for ts_us in TIMES_US]
+    assert texts[0] == '2025-11-02 00:50:00.000000'
+    # The local text repeats 01:10-01:50 (the 5th to 7th packet), the stored value does not
+    assert texts.count('2025-11-02 01:30:00.000000') == 2
+    assert texts != sorted(texts)
+    first_pass = [timestamp_to_us(text) for text in texts]
+    assert first_pass == [ts_us - HOUR_US if 4 <= i <= 6 else ts_us for i, ts_us in enumerate(TIMES_US)]
+
+
+def test_local_time_matches_the_local_clock(new_york):
+    shown = local_time(timestamp_us_to_datetime(TIMES_US + [None]))
+    assert [value.to_pydatetime() for value in shown[:-1]] == [
+        datetime.fromtimestamp(ts_us / 1_000_000) for ts_us in TIMES_US]
+    assert shown.isna().tolist() == [False] * len(TIMES_US) + [True]
+
+
+@pytest.mark.parametrize('storage', ['flat', 'normalized'])
+def test_ingest_stores_utc_timestamps(tmp_path, new_york, storage):
+    frames = [(ts_us, frame) for ts_us, (_ts, frame) in zip(TIMES_US, iter_synthetic_frames(len(TIMES_US), seed=1))]
+    capture = str(tmp_path / 'capture.pcapng')
+    write_pcapng(capture, frames, LINKTYPE_NORDIC_BLE)
+    db_path = str(tmp_path / 'packets.db')
+    conn, cursor = init_db(db_path, storage=storage)
+    ingest_captures([capture], conn, cursor)
+    conn.close()
+    # Packets without UUIDs are not stored
+    expected = [prepared[0] for prepared in map(prepare_packet, iter_native_packets(capture)) if prepared]
+    assert len(expected) > 5 and set(expected) <= set(TIMES_US)
+    rows = stored_times(db_path)
+    assert [ts_us for ts_us, _text in rows] == expected
+    assert [text for _ts_us, text in rows] == [format_timestamp(ts_us) for ts_us in expected]
+
+
+def test_wall_clock_database_is_converted_once(tmp_path, new_york):
+    db_path = str(tmp_path / 'old.db')
+    conn, cursor = init_db(db_path, storage='flat')
+    # What an earlier version stored: microseconds of the local wall clock from a naive epoch
+    wall = [ts_us + utc_offset_us(ts_us) for ts_us in TIMES_US]
+    PacketStore(cursor).insert_many([(format_timestamp(ts_us), 'ff:ff:ff:ff:ff:ff', 'aa:bb:cc:00:00:01', -60, 1.0,
+                                      None, None, f'h{i}', i, i, wall_us, 'old.pcapng', None)
+                                     for i, (ts_us, wall_us) in enumerate(zip(TIMES_US, wall))])
+    cursor.execute('INSERT INTO ReplayAlerts (content_fingerprint, first_seen_us, repeated_at_us) VALUES (1, ?, ?)',
+                   (wall[0], wall[1]))
+    cursor.execute('DELETE FROM DetectorState WHERE name = ?', (TIMESTAMP_UTC_STATE,))
+    conn.commit()
+    generation = packet_generation(cursor)
+    conn.close()
+
+    conn, cursor = init_db(db_path)
+    assert packet_generation(cursor) == generation + 1
+    assert cursor.execute('SELECT first_seen_us, repeated_at_us FROM ReplayAlerts').fetchone() == tuple(TIMES_US[:2])
+    conn.close()
+    converted = [ts_us for ts_us, _text in stored_times(db_path)]
+    # The second pass of the repeated hour cannot be told from the first in wall-clock values
+    assert converted == [ts_us - HOUR_US if 4 <= i <= 6 else ts_us for i, ts_us in enumerate(TIMES_US)]
+
+    conn, cursor = init_db(db_path)
+    assert packet_generation(cursor) == generation + 1
+    conn.close()
+    assert [ts_us for ts_us, _text in stored_times(db_path)] == converted
@@ -1,12 +1,258 @@
 import hashlib
-from config import RSSI_REFERENCE, ENVIRONMENTAL_FACTOR
+import struct
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from config import RSSI_REFERENCE, ENVIRONMENTAL_FACTOR, DISTANCE_CALIBRATION
+
+# === Link-layer types carrying BLE frames ===
+LINKTYPE_BLUETOOTH_LE_LL = 251
+LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR = 256
+LINKTYPE_NORDIC_BLE = 272
+
+ADVERTISING_ACCESS_ADDRESS = 0x8E89BED6
+BROADCAST_MAC = 'ff:ff:ff:ff:ff:ff'
+
+# Nordic sniffer packet ids that carry a BLE link-layer packet
+NORDIC_EVENT_PACKET_ADV_PDU = 0x02
+NORDIC_EVENT_PACKET_DATA_PDU = 0x06
+
+# Advertising channel PDU types
+ADV_IND, ADV_DIRECT_IND, ADV_NONCONN_IND, SCAN_REQ, SCAN_RSP, CONNECT_IND, ADV_SCAN_IND, ADV_EXT_IND = range(8)
+
+# AD types -> UUID size; service data types carry a single UUID before the data
+AD_UUID_LISTS = {0x02: '16', 0x03: '16', 0x14: '16',
+                 0x04: '32', 0x05: '32', 0x1F: '32',
+                 0x06: '128', 0x07: '128', 0x15: '128'}
+AD_SERVICE_DATA = {0x16: '16', 0x20: '32', 0x21: '128'}
+AD_MANUFACTURER_SPECIFIC = 0xFF
+UUID_SIZES = {'16': 2, '32': 4, '128': 16}
+
 
 def rssi_to_distance(rssi, p0=RSSI_REFERENCE, n=ENVIRONMENTAL_FACTOR):
+    """Log-distance path loss: metres at rssi dBm, rounded to cm; None when rssi is missing or not a number."""
     try:
         return round(10 ** ((p0 - int(rssi)) / (10 * n)), 2)
-    except:
+    except (TypeError, ValueError):
         return None
 
+def rssi_to_distance_array(rssi, p0=RSSI_REFERENCE, n=ENVIRONMENTAL_FACTOR):
+    """rssi_to_distance over arrays; p0 and n may be per-row arrays. Missing rssi gives NaN."""
+    rssi = np.trunc(np.asarray(rssi, dtype='float64'))
+    return np.round(10.0 ** ((p0 - rssi) / (10 * np.asarray(n, dtype='float64'))), 2)
+
+def calibration_for(company_id, smac, calibration=DISTANCE_CALIBRATION):
+    """(p0, n) for one advertiser: its device entry, else its company's, else the config defaults."""
+    devices, companies = calibration.get('device'), calibration.get('company')
+    if devices and smac and smac.lower() in devices:
+        return devices[smac.lower()]
+    if companies and company_id and company_id.lower() in companies:
+        return companies[company_id.lower()]
+    return RSSI_REFERENCE, ENVIRONMENTAL_FACTOR
+
+def calibration_arrays(company_ids, smacs, calibration=DISTANCE_CALIBRATION):
+    """Per-row (p0, n) arrays with calibration_for's precedence, looking up each distinct key once."""
+    p0 = np.full(len(smacs), RSSI_REFERENCE, dtype='float64')
+    n = np.full(len(smacs), ENVIRONMENTAL_FACTOR, dtype='float64')
+    # Company entries first, so device entries overwrite them
+    for table, keys in ((calibration.get('company'), company_ids), (calibration.get('device'), smacs)):
+        if not table:
+            continue
+        uniques, inverse = np.unique(np.array([(key or '').lower() for key in keys], dtype=str),
+                                     return_inverse=True)
+        values = np.array([table.get(key, (np.nan, np.nan)) for key in uniques], dtype='float64').reshape(-1, 2)
+        rows = ~np.isnan(values[inverse, 0])
+        p0[rows] = values[inverse[rows], 0]
+        n[rows] = values[inverse[rows], 1]
+    return p0, n
+
 def generate_packet_hash(fields):
     combined = f"{fields['timestamp']}_{fields['dmac']}_{fields['uuids_16']}_{fields['uuids_32']}_{fields['uuids_128']}_{fields['company_id']}_{fields['manufacturer_data']}_{fields['rssi']}"
     return hashlib.sha256(combined.encode()).hexdigest()
+
+def generate_content_fingerprint(fields):
+    """Content-only 64-bit fingerprint (no timestamp or RSSI), as a signed SQLite INTEGER.
+
+    Unlike packet_hash, a replayed advertisement gets the same value as the original.
+    """
+    combined = f"{fields['dmac']}_{fields['uuids_16']}_{fields['uuids_32']}_{fields['uuids_128']}_{fields['company_id']}_{fields['manufacturer_data']}"
+    return int.from_bytes(hashlib.blake2b(combined.encode(), digest_size=8).digest(), 'little', signed=True)
+
+def generate_payload_fingerprint(fields):
+    """What macSpoof compares per advertiser: the UUID sets and manufacturer payload as a signed 64-bit INTEGER.
+
+    Like generate_content_fingerprint but without dmac, so the value stays the
+    same when a device changes the address it advertises to.
+    """
+    combined = f"{fields['uuids_16']}_{fields['uuids_32']}_{fields['uuids_128']}_{fields['company_id']}_{fields['manufacturer_data']}"
+    return int.from_bytes(hashlib.blake2b(combined.encode(), digest_size=8).digest(), 'little', signed=True)
+
+
+# BLEPacket.timestamp_us counts UTC microseconds from the Unix epoch, so it never runs
+# backwards at a DST change; the timestamp text is the local wall clock (see format_timestamp)
+UTC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def format_timestamp(ts_us):
+    """UTC epoch microseconds -> local wall-clock text, as pyshark's sniff_time.strftime writes it.
+
+    The text repeats an hour when the clock falls back at the end of DST;
+    timestamp_us, which the analyzers order by, does not.
+    """
+    seconds, micros = divmod(ts_us, 1_000_000)
+    return (datetime.fromtimestamp(seconds) + timedelta(microseconds=micros)).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def timestamp_to_us(timestamp):
+    """Local wall-clock timestamp text -> the UTC timestamp_us column value (None if unparseable).
+
+    For the text of packets written without timestamp_us; a time the fall-back
+    hour repeats is read as its first (DST) occurrence.
+    """
+    try:
+        return (datetime.fromisoformat(timestamp).astimezone() - UTC_EPOCH) // timedelta(microseconds=1)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_mac(raw):
+    return raw[::-1].hex(':')
+
+
+def _format_uuid(raw, uuid_type):
+    if uuid_type == '16':
+        return f'0x{struct.unpack("<H", raw)[0]:04x}'
+    if uuid_type == '32':
+        return f'0x{struct.unpack("<I", raw)[0]:08x}'
+    h = raw[::-1].hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def parse_ad_structures(data):
+    """Decode advertising data into (uuids, company_id, manufacturer_data).
+
+    uuids is a list of (uuid_type, uuid) in the order they appear. Like the
+    pyshark loop, a later manufacturer-specific entry overrides an earlier one.
+    """
+    uuids = []
+    company_id = None
+    manufacturer_data = None
+    pos = 0
+    end = len(data)
+    while pos < end:
+        length = data[pos]
+        if length == 0 or pos + 1 + length > end:
+            break
+        ad_type = data[pos + 1]
+        value = data[pos + 2:pos + 1 + length]
+        pos += 1 + length
+
+        if ad_type in AD_UUID_LISTS:
+            uuid_type = AD_UUID_LISTS[ad_type]
+            size = UUID_SIZES[uuid_type]
+            for i in range(0, len(value) - size + 1, size):
+                uuids.append((uuid_type, _format_uuid(value[i:i + size], uuid_type)))
+        elif ad_type in AD_SERVICE_DATA:
+            uuid_type = AD_SERVICE_DATA[ad_type]
+            size = UUID_SIZES[uuid_type]
+            if len(value) >= size:
+                uuids.append((uuid_type, _format_uuid(value[:size], uuid_type)))
+        elif ad_type == AD_MANUFACTURER_SPECIFIC and len(value) >= 2:
+            company_id = f'0x{struct.unpack_from("<H", value)[0]:04x}'
+            if len(value) > 2:
+                manufacturer_data = value[2:].hex(':')
+    return uuids, company_id, manufacturer_data
+
+
+def _parse_extended_header(payload):
+    """Return (advertising_address, adv_data) of an ADV_EXT_IND / AUX_* payload."""
+    if not payload:
+        return None, b''
+    ext_len = payload[0] & 0x3F
+    adv_data = payload[1 + ext_len:]
+    if ext_len == 0:
+        return None, adv_data
+    flags = payload[1]
+    if flags & 0x01 and ext_len >= 7:
+        return _format_mac(payload[2:8]), adv_data
+    return None, adv_data
+
+
+def decode_btle_advertising(data, pos=0):
+    """Decode a BLE link-layer advertising channel packet starting at ``pos``.
+
+    Returns None for data channel packets, otherwise a dict with the same
+    fields the pyshark ingest reads: advertising_address, scanning_address,
+    uuids, company_id and manufacturer_data.
+    """
+    if len(data) < pos + 6:
+        return None
+    access_address = struct.unpack_from('<I', data, pos)[0]
+    if access_address != ADVERTISING_ACCESS_ADDRESS:
+        return None
+    pdu_type = data[pos + 4] & 0x0F
+    length = data[pos + 5]
+    payload = data[pos + 6:pos + 6 + length]
+
+    advertising_address = None
+    scanning_address = None
+    adv_data = b''
+    if pdu_type in (ADV_IND, ADV_NONCONN_IND, ADV_SCAN_IND, SCAN_RSP) and len(payload) >= 6:
+        advertising_address = _format_mac(payload[:6])
+        adv_data = payload[6:]
+    elif pdu_type == ADV_DIRECT_IND and len(payload) >= 6:
+        advertising_address = _format_mac(payload[:6])
+    elif pdu_type in (SCAN_REQ, CONNECT_IND) and len(payload) >= 12:
+        if pdu_type == SCAN_REQ:
+            scanning_address = _format_mac(payload[:6])
+        advertising_address = _format_mac(payload[6:12])
+    elif pdu_type == ADV_EXT_IND:
+        advertising_address, adv_data = _parse_extended_header(payload)
+
+    uuids, company_id, manufacturer_data = parse_ad_structures(adv_data)
+    return {
+        'advertising_address': advertising_address,
+        'scanning_address': scanning_address,
+        'uuids': uuids,
+        'company_id': company_id,
+        'manufacturer_data': manufacturer_data,
+    }
+
+
+def decode_nordic_ble(data):
+    """Decode the nRF Sniffer header (board id, packet header, event header).
+
+    Returns (rssi, link_layer_offset) or None when the frame is not an
+    advertising/data PDU event.
+    """
+    if len(data) < 7:
+        return None
+    protover = data[3]
+    if data[6] not in (NORDIC_EVENT_PACKET_ADV_PDU, NORDIC_EVENT_PACKET_DATA_PDU):
+        return None
+    # Protocol versions before 3 carry an extra "packet header length" byte
+    pos = 8 if protover < 3 else 7
+    # flags(1) channel(1) rssi(1) event counter(2) timestamp(4)
+    if len(data) < pos + 9:
+        return None
+    rssi = -data[pos + 2]
+    return rssi, pos + 9
+
+
+def decode_ble_frame(linktype, data):
+    """Decode one captured frame into (rssi, advertising fields) or None."""
+    rssi = None
+    if linktype == LINKTYPE_NORDIC_BLE:
+        header = decode_nordic_ble(data)
+        if header is None:
+            return None
+        rssi, pos = header
+    elif linktype == LINKTYPE_BLUETOOTH_LE_LL_WITH_PHDR:
+        pos = 10
+    elif linktype == LINKTYPE_BLUETOOTH_LE_LL:
+        pos = 0
+    else:
+        return None
+    fields = decode_btle_advertising(data, pos)
+    if fields is None:
+        return None
+    return rssi, fields
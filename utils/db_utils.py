@@ -1,22 +1,108 @@
+import hashlib
+import json
+import os
 import sqlite3
+import time
+from contextlib import contextmanager
 from datetime import datetime
+import numpy as np
+from config import (PACKET_STORAGE, SQLITE_CACHE_MB, SQLITE_MMAP_MB, SQLITE_BUSY_TIMEOUT_SEC,
+                    SQLITE_BULK_SYNCHRONOUS, SQLITE_BULK_EXCLUSIVE, DISTANCE_CALIBRATION, REPLAY_TIME_WINDOW_SEC)
+from utils.ble_utils import (generate_content_fingerprint, generate_payload_fingerprint, timestamp_to_us, rssi_to_distance_array,
+                             calibration_arrays)
+from utils.identity_utils import IdentityGraph
+from utils.time_utils import OFFSET_BUCKET_US, wall_clock_offset_us
 
-def init_db(db_path):
-    conn = sqlite3.connect(db_path)
+# Packet row layout accepted by PacketStore, whatever the storage mode
+PACKET_COLUMNS = ('timestamp', 'dmac', 'smac', 'rssi', 'distance', 'company_id', 'manufacturer_data',
+                  'packet_hash', 'content_fingerprint', 'payload_fingerprint', 'timestamp_us', 'source_file',
+                  'sensor_id')
+PACKET_STORAGE_MODES = ('flat', 'normalized')
+CONNECTION_PROFILES = ('read', 'bulk', 'state')
+
+# Secondary indexes by access pattern, in flat BLEPacket column names
+# (index_definitions maps them onto BLEPacketCompact for the normalized layout)
+PACKET_INDEXES = (
+    # Replay / dashboard loads: ORDER BY timestamp_us
+    ('idx_blepacket_time', ('timestamp_us',)),
+    # Proximity: WHERE distance IS NOT NULL ORDER BY smac, timestamp_us, answered from the index alone
+    ('idx_blepacket_smac_time', ('smac', 'timestamp_us', 'distance')),
+    # packet_hash lookups and GROUP BY packet_hash in time order
+    ('idx_blepacket_hash_time', ('packet_hash', 'timestamp_us')),
+    # Replay detection walks packets in (fingerprint, time) order straight off this index
+    ('idx_blepacket_fingerprint_time', ('content_fingerprint', 'timestamp_us')),
+)
+UUID_INDEXES = (
+    # BLEPacket JOIN BLEPacketUUID ON ble_packet_id, covering the uuid columns
+    ('idx_blepacketuuid_packet', ('ble_packet_id', 'uuid_type', 'uuid')),
+)
+COMPACT_INDEX_COLUMNS = {'smac': 'smac_id', 'dmac': 'dmac_id'}
+# DetectorState rows holding the IdentityGraph and DeviceStats watermarks
+IDENTITY_GRAPH_STATE = 'identity_graph'
+DEVICE_STATS_STATE = 'device_stats'
+# DetectorState row whose last_id counts the in-place rewrites of existing packet rows (see mark_packets_rewritten)
+PACKET_GENERATION_STATE = 'packet_generation'
+# DetectorState row marking a database whose timestamp_us values are UTC (see convert_timestamps_to_utc)
+TIMESTAMP_UTC_STATE = 'timestamp_utc'
+# DetectorState row marking a normalized database whose hex packet hashes are stored as BLOBs
+PACKET_HASH_BLOB_STATE = 'packet_hash_blob'
+
+def connect(db_path, profile='read'):
+    """Open a connection tuned for ``profile``.
+
+    'bulk': WAL journal, relaxed fsync (SQLITE_BULK_SYNCHRONOUS) and a large page
+    cache; the caller commits in batches. 'read': query_only with memory-mapped
+    I/O. Once a writer has switched the file to WAL, readers see a consistent
+    snapshot per statement (or per read_snapshot block) while ingestion runs.
+    'state': writable, keeping the file's journal mode and the default fsync,
+    for the small state rows the analyzers keep (DetectorState, DeviceStats,
+    IdentityCluster); it creates no schema, the tables come from init_db
+    (ingest / dbMaintenance).
+    """
+    if profile not in CONNECTION_PROFILES:
+        raise ValueError(f"Unknown connection profile: {profile} (expected one of {', '.join(CONNECTION_PROFILES)})")
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SEC)
+    pragmas = {'cache_size': -SQLITE_CACHE_MB * 1024, 'temp_store': 'MEMORY'}
+    if profile == 'bulk':
+        # locking_mode has to be set before journal_mode for an exclusive WAL (no shared memory)
+        pragmas.update(locking_mode='EXCLUSIVE' if SQLITE_BULK_EXCLUSIVE else 'NORMAL',
+                       journal_mode='WAL', synchronous=SQLITE_BULK_SYNCHRONOUS)
+    elif profile == 'read':
+        pragmas.update(mmap_size=SQLITE_MMAP_MB * 2**20, query_only='ON')
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+@contextmanager
+def read_snapshot(conn):
+    """Run several queries against one database snapshot (a read transaction)."""
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+def init_db(db_path, storage=None, profile='bulk', indexes=True):
+    """Open (and create or upgrade) the database.
+
+    ``storage`` only applies to a new database; an existing one keeps the
+    packet layout it was created with (see get_storage_mode). With
+    ``indexes=False`` missing secondary indexes are left for create_indexes,
+    so a bulk load does not maintain them row by row.
+    """
+    conn = connect(db_path, profile)
     c = conn.cursor()
+    # One transaction for the whole schema instead of an implicit commit per DDL statement
+    c.execute('BEGIN')
 
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS BLEPacket (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        smac TEXT,
-        dmac TEXT,
-        rssi INTEGER,
-        distance REAL,
-        company_id TEXT,
-        manufacturer_data TEXT,
-        packet_hash TEXT
-    )''')
+    storage = get_storage_mode(c) or storage or PACKET_STORAGE
+    if storage == 'normalized':
+        create_normalized_packet_tables(c)
+        create_packet_view(c)
+    elif storage == 'flat':
+        create_flat_packet_table(c)
+    else:
+        raise ValueError(f"Unknown packet storage: {storage} (expected one of {', '.join(PACKET_STORAGE_MODES)})")
 
     c.execute('''
     CREATE TABLE IF NOT EXISTS BLEPacketUUID (
@@ -38,29 +124,449 @@ def init_db(db_path):
         conflicting_macs TEXT
     )''')
 
+    # Written during ingest by StreamingReplayDetector: the first replay of each content fingerprint
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS ReplayAlerts (
+        content_fingerprint INTEGER PRIMARY KEY,
+        packet_hash TEXT,
+        first_seen_us INTEGER,
+        repeated_at_us INTEGER,
+        dmac TEXT,
+        smac TEXT,
+        rssi INTEGER,
+        distance REAL
+    )''')
+
+    # Fingerprints that reached StreamingReplayDetector too late to check in memory; see recheck_replay_alerts
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS ReplayRecheck (
+        content_fingerprint INTEGER PRIMARY KEY
+    )''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS IngestState (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        content_hash TEXT,
+        hashed_bytes INTEGER,
+        last_offset INTEGER,
+        section_state TEXT,
+        packet_count INTEGER DEFAULT 0,
+        completed INTEGER DEFAULT 0,
+        updated_at TEXT
+    )''')
+
+    # Device clusters of utils.identity_utils.IdentityGraph: MACs linked by a shared payload fingerprint
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS IdentityCluster (
+        mac TEXT PRIMARY KEY,
+        cluster TEXT
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_identitycluster_cluster ON IdentityCluster (cluster)')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS IdentityFingerprint (
+        payload_fingerprint INTEGER PRIMARY KEY,
+        mac TEXT
+    )''')
+
+    # Per-device aggregates kept current by update_device_stats, plus the (device, value) pairs behind its distinct counts
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS DeviceStats (
+        smac TEXT PRIMARY KEY,
+        packet_count INTEGER,
+        first_seen_us INTEGER,
+        last_seen_us INTEGER,
+        rssi_count INTEGER,
+        rssi_min INTEGER,
+        rssi_max INTEGER,
+        rssi_sum INTEGER,
+        rssi_sumsq INTEGER,
+        unique_fingerprints INTEGER,
+        unique_dmacs INTEGER
+    )''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS DeviceFingerprint (
+        smac TEXT,
+        payload_fingerprint INTEGER,
+        PRIMARY KEY (smac, payload_fingerprint)
+    ) WITHOUT ROWID''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS DeviceDmac (
+        smac TEXT,
+        dmac TEXT,
+        PRIMARY KEY (smac, dmac)
+    ) WITHOUT ROWID''')
+
+    # Incremental detectors: the last BLEPacket.id each one has consumed, plus any carry-over state
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS DetectorState (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER DEFAULT 0,
+        state TEXT,
+        updated_at TEXT
+    )''')
+    convert_timestamps_to_utc(c)
+    convert_packet_hashes_to_blobs(c)
+
+    if indexes:
+        create_indexes(c)
     conn.commit()
     return conn, c
 
-def insert_packet(cursor, conn, entry):
-    cursor.execute('''
-        INSERT OR IGNORE INTO BLEPacket 
-        (timestamp, smac, dmac, rssi, distance, company_id, manufacturer_data, packet_hash)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        entry['timestamp'], entry['smac'], entry['dmac'], entry['rssi'],
-        entry['distance'], entry['company_id'], entry['manufacturer_data'], entry['packet_hash']
-    ))
+def create_flat_packet_table(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS BLEPacket (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        timestamp_us INTEGER,
+        smac TEXT,
+        dmac TEXT,
+        rssi INTEGER,
+        distance REAL,
+        company_id TEXT,
+        manufacturer_data TEXT,
+        packet_hash TEXT,
+        content_fingerprint INTEGER,
+        payload_fingerprint INTEGER,
+        source_file TEXT,
+        sensor_id TEXT
+    )''')
+    ensure_columns(c, 'BLEPacket', {'timestamp_us': 'INTEGER', 'content_fingerprint': 'INTEGER',
+                                    'payload_fingerprint': 'INTEGER', 'source_file': 'TEXT', 'sensor_id': 'TEXT'})
+    # Replaced by idx_blepacket_fingerprint_time (see PACKET_INDEXES)
+    c.execute('DROP INDEX IF EXISTS idx_blepacket_fingerprint')
+
+def create_normalized_packet_tables(c):
+    """Dictionary-encoded packet storage: BLEPacketCompact rows point into Device/Payload/CaptureSource.
+
+    Device and Payload keep only the text the BLEPacket view returns: it is
+    read for every packet, and one row per distinct value is cheap next to
+    formatting it from an integer or bytes on each read.
+    """
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Device (
+        id INTEGER PRIMARY KEY,
+        mac TEXT UNIQUE
+    )''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Payload (
+        id INTEGER PRIMARY KEY,
+        company_id TEXT,
+        manufacturer_data TEXT,
+        content_hash INTEGER UNIQUE
+    )''')
+    # Binary copies of the text, written by earlier versions and never read
+    drop_columns(c, 'Device', ['mac48'])
+    drop_columns(c, 'Payload', ['bytes'])
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS CaptureSource (
+        id INTEGER PRIMARY KEY,
+        source_file TEXT,
+        sensor_id TEXT,
+        UNIQUE (source_file, sensor_id)
+    )''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS BLEPacketCompact (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp_us INTEGER,
+        smac_id INTEGER REFERENCES Device(id),
+        dmac_id INTEGER REFERENCES Device(id),
+        rssi INTEGER,
+        distance REAL,
+        payload_id INTEGER REFERENCES Payload(id),
+        packet_hash BLOB,
+        content_fingerprint INTEGER,
+        payload_fingerprint INTEGER,
+        source_id INTEGER REFERENCES CaptureSource(id)
+    )''')
+    ensure_columns(c, 'BLEPacketCompact', {'payload_fingerprint': 'INTEGER'})
+
+# BLEPacket compatibility view over the normalized tables. Like the flat table's column, the
+# timestamp text is the local wall clock; timestamp_us is UTC (see format_timestamp). A packet
+# hash stored as a BLOB (see packet_hash_blob) reads back as its lower-case hex text.
+PACKET_VIEW_SQL = '''CREATE VIEW BLEPacket AS
+    SELECT
+        p.id,
+        strftime('%Y-%m-%d %H:%M:%S', p.timestamp_us / 1000000, 'unixepoch', 'localtime')
+            || printf('.%06d', p.timestamp_us % 1000000) AS timestamp,
+        p.timestamp_us,
+        s.mac AS smac,
+        d.mac AS dmac,
+        p.rssi,
+        p.distance,
+        pl.company_id,
+        pl.manufacturer_data,
+        CASE WHEN typeof(p.packet_hash) = 'blob' THEN lower(hex(p.packet_hash)) ELSE p.packet_hash END
+            AS packet_hash,
+        p.content_fingerprint,
+        p.payload_fingerprint,
+        src.source_file,
+        src.sensor_id
+    FROM BLEPacketCompact p
+    LEFT JOIN Device s ON s.id = p.smac_id
+    LEFT JOIN Device d ON d.id = p.dmac_id
+    LEFT JOIN Payload pl ON pl.id = p.payload_id
+    LEFT JOIN CaptureSource src ON src.id = p.source_id'''
+
+def create_packet_view(c):
+    """BLEPacket compatibility view: the flat column set, rebuilt from the lookup tables.
+
+    Its smac / dmac come from a join, so the catalog index on (smac_id, ...)
+    gives no order by MAC text: ORDER BY smac on the view sorts the result.
+    """
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'BLEPacket'")
+    row = c.fetchone()
+    if row is not None and row[0] == PACKET_VIEW_SQL:
+        return
+    if row is not None:
+        # Views cannot be altered: recreate one made by an older version
+        c.execute('DROP VIEW BLEPacket')
+    c.execute(PACKET_VIEW_SQL)
+
+def get_storage_mode(cursor):
+    """'flat' when BLEPacket is a table, 'normalized' when it is the compatibility view, None if absent."""
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = 'BLEPacket'")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return 'normalized' if row[0] == 'view' else 'flat'
+
+def packet_table(cursor):
+    """Physical table behind BLEPacket, for UPDATEs of the columns it stores directly."""
+    return 'BLEPacketCompact' if get_storage_mode(cursor) == 'normalized' else 'BLEPacket'
+
+def index_definitions(cursor):
+    """[(name, table, columns)] of the catalog indexes for this database's packet layout."""
+    table = packet_table(cursor)
+    mapping = COMPACT_INDEX_COLUMNS if table == 'BLEPacketCompact' else {}
+    definitions = [(name, table, tuple(mapping.get(column, column) for column in columns))
+                   for name, columns in PACKET_INDEXES]
+    definitions += [(name, 'BLEPacketUUID', columns) for name, columns in UUID_INDEXES]
+    return definitions
+
+def index_status(cursor):
+    """State of every catalog index: 'ok', 'missing' or 'stale' (other table/columns).
+
+    Other user-created indexes on the same tables are listed as 'extra'.
+    """
+    cursor.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+    existing = {}
+    for name, table in cursor.fetchall():
+        cursor.execute(f"PRAGMA index_info('{name}')")
+        existing[name] = (table, tuple(row[2] for row in sorted(cursor.fetchall())))
+
+    report = []
+    tables = set()
+    for name, table, columns in index_definitions(cursor):
+        tables.add(table)
+        if name not in existing:
+            state = 'missing'
+        else:
+            state = 'ok' if existing.pop(name) == (table, columns) else 'stale'
+        report.append({'name': name, 'table': table, 'columns': columns, 'state': state})
+    for name, (table, columns) in existing.items():
+        if table in tables:
+            report.append({'name': name, 'table': table, 'columns': columns, 'state': 'extra'})
+    return report
+
+def create_indexes(cursor, rebuild=False, names=None):
+    """Build missing and stale catalog indexes (all of them with rebuild=True), caller commits.
+
+    ``names`` limits the build to those indexes. Refreshes the planner
+    statistics when anything was built; returns the built names.
+    """
+    built = []
+    for index in index_status(cursor):
+        if index['state'] == 'extra' or (index['state'] == 'ok' and not rebuild):
+            continue
+        if names is not None and index['name'] not in names:
+            continue
+        cursor.execute(f"DROP INDEX IF EXISTS {index['name']}")
+        cursor.execute(f"CREATE INDEX {index['name']} ON {index['table']}({', '.join(index['columns'])})")
+        built.append(index['name'])
+    if built:
+        # Sampled statistics: enough for the planner, without a full pass over every index
+        cursor.execute('PRAGMA analysis_limit = 1000')
+        cursor.execute('ANALYZE')
+    return built
+
+def drop_indexes(cursor):
+    """Drop the catalog indexes ahead of a bulk load (caller commits); returns the dropped names."""
+    dropped = [index['name'] for index in index_status(cursor) if index['state'] in ('ok', 'stale')]
+    for name in dropped:
+        cursor.execute(f'DROP INDEX {name}')
+    return dropped
+
+def rebuild_indexes(conn, rebuild=False):
+    """create_indexes in its own transaction; returns (built names, seconds)."""
+    start = time.perf_counter()
+    built = create_indexes(conn.cursor(), rebuild=rebuild)
     conn.commit()
-    return cursor.lastrowid
+    return built, time.perf_counter() - start
 
-def insert_uuids(cursor, conn, packet_id, uuids, uuid_type):
-    for uuid in uuids:
-        cursor.execute('''
+def ensure_indexes(db_path, names):
+    """Build any of the named catalog indexes that are missing or stale; returns the built names.
+
+    For analyzers whose scans are only fast with an index, e.g. after an
+    ingest with deferred indexes was interrupted before rebuilding them.
+    """
+    conn = connect(db_path, 'bulk')
+    try:
+        built = create_indexes(conn.cursor(), names=names)
+        conn.commit()
+        return built
+    finally:
+        conn.close()
+
+def packet_hash_blob(packet_hash):
+    """BLEPacketCompact.packet_hash value: a lower-case 64-digit hex hash as its 32 bytes, anything else unchanged."""
+    if isinstance(packet_hash, str) and len(packet_hash) == 64 and packet_hash == packet_hash.lower():
+        try:
+            return bytes.fromhex(packet_hash)
+        except ValueError:
+            pass
+    return packet_hash
+
+def lower_mac(mac):
+    """A MAC address as stored: lower-case text (None stays None)."""
+    return mac.lower() if isinstance(mac, str) else mac
+
+def payload_content_hash(company_id, manufacturer_data):
+    """64-bit key of a (company_id, manufacturer_data) pair in the Payload table."""
+    if company_id is None and manufacturer_data is None:
+        return None
+    combined = f"{company_id is None}|{company_id}|{manufacturer_data is None}|{manufacturer_data}"
+    return int.from_bytes(hashlib.blake2b(combined.encode(), digest_size=8).digest(), 'little', signed=True)
+
+class PacketStore:
+    """Writes packet rows (PACKET_COLUMNS order) in whichever layout the database uses.
+
+    In the normalized layout MAC, payload and source values are replaced by
+    lookup-table ids, cached for the life of the store. Call reset() after a
+    rollback so that rolled-back ids are not reused.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor.connection.cursor()
+        self.normalized = get_storage_mode(self.cursor) == 'normalized'
+        self.reset()
+
+    def reset(self):
+        self._devices = {}
+        self._payloads = {}
+        self._sources = {}
+
+    @property
+    def columns(self):
+        """The physical table's columns, in encode() order."""
+        if self.normalized:
+            return ('timestamp_us', 'smac_id', 'dmac_id', 'rssi', 'distance', 'payload_id',
+                    'packet_hash', 'content_fingerprint', 'payload_fingerprint', 'source_id')
+        return PACKET_COLUMNS
+
+    def _sql(self, conflict=None, with_id=False):
+        verb = f'INSERT OR {conflict}' if conflict else 'INSERT'
+        table = 'BLEPacketCompact' if self.normalized else 'BLEPacket'
+        columns = self.columns
+        if with_id:
+            columns = ('id',) + columns
+        return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+
+    def _lookup(self, cache, key, insert_sql, insert_args, select_sql, select_args):
+        row_id = cache.get(key)
+        if row_id is None:
+            self.cursor.execute(insert_sql, insert_args)
+            self.cursor.execute(select_sql, select_args)
+            row_id = cache[key] = self.cursor.fetchone()[0]
+        return row_id
+
+    def device_id(self, mac):
+        if mac is None:
+            return None
+        return self._lookup(self._devices, mac,
+                            'INSERT OR IGNORE INTO Device (mac) VALUES (?)', (mac,),
+                            'SELECT id FROM Device WHERE mac = ?', (mac,))
+
+    def payload_id(self, company_id, manufacturer_data):
+        content_hash = payload_content_hash(company_id, manufacturer_data)
+        if content_hash is None:
+            return None
+        return self._lookup(self._payloads, content_hash,
+                            'INSERT OR IGNORE INTO Payload (company_id, manufacturer_data, content_hash) '
+                            'VALUES (?, ?, ?)',
+                            (company_id, manufacturer_data, content_hash),
+                            'SELECT id FROM Payload WHERE content_hash = ?', (content_hash,))
+
+    def source_id(self, source_file, sensor_id):
+        if source_file is None and sensor_id is None:
+            return None
+        return self._lookup(self._sources, (source_file, sensor_id),
+                            'INSERT OR IGNORE INTO CaptureSource (source_file, sensor_id) VALUES (?, ?)',
+                            (source_file, sensor_id),
+                            'SELECT id FROM CaptureSource WHERE source_file IS ? AND sensor_id IS ?',
+                            (source_file, sensor_id))
+
+    def encode(self, row):
+        """Packet row -> the tuple inserted into the physical table."""
+        (timestamp, dmac, smac, rssi, distance, company_id, manufacturer_data,
+         packet_hash, content_fingerprint, payload_fingerprint, timestamp_us, source_file, sensor_id) = row
+        if timestamp_us is None:
+            timestamp_us = timestamp_to_us(timestamp)
+        # Stored lower-case, as the ingester decodes them, so a device is one smac value everywhere
+        smac, dmac = lower_mac(smac), lower_mac(dmac)
+        if not self.normalized:
+            return (timestamp, dmac, smac, rssi, distance, company_id, manufacturer_data,
+                    packet_hash, content_fingerprint, payload_fingerprint, timestamp_us, source_file, sensor_id)
+        return (timestamp_us, self.device_id(smac), self.device_id(dmac), rssi, distance,
+                self.payload_id(company_id, manufacturer_data), packet_hash_blob(packet_hash), content_fingerprint,
+                payload_fingerprint, self.source_id(source_file, sensor_id))
+
+    def insert_many(self, rows):
+        encoded = [self.encode(row) for row in rows]
+        self.cursor.executemany(self._sql(), encoded)
+
+    def insert(self, row, packet_id=None, conflict=None):
+        """Insert one row (optionally with an explicit id); returns its rowid."""
+        values = self.encode(row)
+        if packet_id is not None:
+            values = (packet_id,) + values
+        self.cursor.execute(self._sql(conflict, with_id=packet_id is not None), values)
+        return self.cursor.lastrowid
+
+def drop_columns(cursor, table, columns):
+    """Drop columns an older version of init_db created and the current one no longer uses."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name in columns:
+        if name in existing:
+            cursor.execute(f'ALTER TABLE {table} DROP COLUMN {name}')
+
+def ensure_columns(cursor, table, columns):
+    """Add columns missing from a table created by an older version of init_db."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, decl in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
+
+def insert_packet(cursor, conn, entry, commit=True):
+    row = tuple(entry.get(column) for column in PACKET_COLUMNS)
+    packet_id = PacketStore(cursor).insert(row, conflict='IGNORE')
+    if commit:
+        conn.commit()
+    return packet_id
+
+def insert_uuids(cursor, conn, packet_id, uuids, uuid_type, commit=True):
+    cursor.executemany('''
     INSERT INTO BLEPacketUUID (ble_packet_id, uuid_type, uuid) VALUES (?, ?, ?)
-        ''', (packet_id, uuid_type, uuid))
-    conn.commit()
+        ''', [(packet_id, uuid_type, uuid) for uuid in uuids])
+    if commit:
+        conn.commit()
 
-def insert_spoof_alert(cursor, conn, alert):
+def insert_spoof_alert(cursor, conn, alert, commit=True):
     cursor.execute('''
         INSERT INTO MACSpoofingAlerts 
         (timestamp, uuid_type, uuid, company_id, manufacturer_data, conflicting_macs)
@@ -70,13 +576,613 @@ def insert_spoof_alert(cursor, conn, alert):
         alert['company_id'], alert['manufacturer_data'], 
         ', '.join(alert['conflicting_macs'])
     ))
+    if commit:
+        conn.commit()
+
+def insert_replay_alerts(cursor, alerts):
+    """Upsert streaming replay alerts, keeping the earliest replay per fingerprint (caller commits).
+
+    ``alerts`` are (content_fingerprint, packet_hash, first_seen_us, repeated_at_us,
+    dmac, smac, rssi, distance) tuples.
+    """
+    cursor.executemany('''
+        INSERT INTO ReplayAlerts
+        (content_fingerprint, packet_hash, first_seen_us, repeated_at_us, dmac, smac, rssi, distance)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (content_fingerprint) DO UPDATE SET
+            packet_hash = excluded.packet_hash, first_seen_us = excluded.first_seen_us,
+            repeated_at_us = excluded.repeated_at_us, dmac = excluded.dmac, smac = excluded.smac,
+            rssi = excluded.rssi, distance = excluded.distance
+        WHERE excluded.repeated_at_us < ReplayAlerts.repeated_at_us
+    ''', alerts)
+
+def queue_replay_recheck(cursor, fingerprints):
+    """Note fingerprints whose streaming alerts may be incomplete, for recheck_replay_alerts (caller commits)."""
+    cursor.executemany('INSERT OR IGNORE INTO ReplayRecheck (content_fingerprint) VALUES (?)',
+                       ((fingerprint,) for fingerprint in fingerprints))
+
+def recheck_replay_alerts(cursor, window_us):
+    """Recompute the ReplayAlerts rows of the queued fingerprints from BLEPacket; returns how many were queued.
+
+    Same rule as the batch scan: per fingerprint, the first packet less than
+    window_us after the previous one in (timestamp_us, id) order. Caller commits.
+    """
+    queued = cursor.execute('SELECT COUNT(*) FROM ReplayRecheck').fetchone()[0]
+    if not queued:
+        return 0
+    cursor.execute('DELETE FROM ReplayAlerts WHERE content_fingerprint IN (SELECT content_fingerprint FROM ReplayRecheck)')
+    cursor.execute('''
+        WITH gaps AS (
+            SELECT content_fingerprint, timestamp_us, packet_hash, dmac, smac, rssi, distance,
+                   LAG(timestamp_us) OVER ordered AS previous_us,
+                   ROW_NUMBER() OVER ordered AS position
+            FROM BLEPacket
+            WHERE content_fingerprint IN (SELECT content_fingerprint FROM ReplayRecheck)
+              AND timestamp_us IS NOT NULL
+            WINDOW ordered AS (PARTITION BY content_fingerprint ORDER BY timestamp_us, id)
+        ),
+        -- With MIN(), SQLite takes the bare columns from the row holding the minimum
+        firsts AS (
+            SELECT content_fingerprint, packet_hash, previous_us, timestamp_us, dmac, smac, rssi, distance,
+                   MIN(position)
+            FROM gaps
+            WHERE timestamp_us - previous_us < ?
+            GROUP BY content_fingerprint
+        )
+        INSERT INTO ReplayAlerts
+        (content_fingerprint, packet_hash, first_seen_us, repeated_at_us, dmac, smac, rssi, distance)
+        SELECT content_fingerprint, packet_hash, previous_us, timestamp_us, dmac, smac, rssi, distance FROM firsts
+    ''', (window_us,))
+    cursor.execute('DELETE FROM ReplayRecheck')
+    return queued
+
+def get_ingest_state(cursor, path):
+    cursor.execute('''
+        SELECT size, content_hash, hashed_bytes, last_offset, section_state, packet_count, completed
+        FROM IngestState WHERE path = ?
+    ''', (path,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    keys = ('size', 'content_hash', 'hashed_bytes', 'last_offset', 'section_state', 'packet_count', 'completed')
+    return dict(zip(keys, row))
+
+def save_ingest_state(cursor, path, **fields):
+    """Upsert the ingest checkpoint of one capture file (caller commits)."""
+    fields['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    columns = ', '.join(fields)
+    placeholders = ', '.join('?' for _ in fields)
+    updates = ', '.join(f'{col} = excluded.{col}' for col in fields)
+    cursor.execute(f'''
+        INSERT INTO IngestState (path, {columns}) VALUES (?, {placeholders})
+        ON CONFLICT(path) DO UPDATE SET {updates}
+    ''', (path, *fields.values()))
+
+def delete_capture_packets(cursor, source_file, sensor_id):
+    """Delete the packets (and their UUID rows) stored from one capture; returns how many (caller commits).
+
+    Removing rows below the id watermarks marks the packets rewritten, so the
+    aggregates and detector states built from them are recomputed.
+    """
+    if get_storage_mode(cursor) == 'normalized':
+        condition = 'source_id IN (SELECT id FROM CaptureSource WHERE source_file IS ? AND sensor_id IS ?)'
+    else:
+        condition = 'source_file IS ? AND sensor_id IS ?'
+    table = packet_table(cursor)
+    cursor.execute(f'''
+        DELETE FROM BLEPacketUUID WHERE ble_packet_id IN (SELECT id FROM {table} WHERE {condition})
+    ''', (source_file, sensor_id))
+    cursor.execute(f'DELETE FROM {table} WHERE {condition}', (source_file, sensor_id))
+    removed = cursor.rowcount
+    if removed:
+        mark_packets_rewritten(cursor)
+    return removed
+
+def get_detector_state(cursor, name):
+    cursor.execute('SELECT last_id, state FROM DetectorState WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {'last_id': row[0], 'state': row[1]}
+
+def save_detector_state(cursor, name, **fields):
+    """Upsert the watermark / carry-over state of one incremental detector (caller commits)."""
+    fields['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    columns = ', '.join(fields)
+    placeholders = ', '.join('?' for _ in fields)
+    updates = ', '.join(f'{col} = excluded.{col}' for col in fields)
+    cursor.execute(f'''
+        INSERT INTO DetectorState (name, {columns}) VALUES (?, {placeholders})
+        ON CONFLICT(name) DO UPDATE SET {updates}
+    ''', (name, *fields.values()))
+
+def packet_generation(cursor):
+    """How many times existing packet rows were rewritten in place (0 on a database that was only appended to)."""
+    try:
+        state = get_detector_state(cursor, PACKET_GENERATION_STATE)
+    except sqlite3.OperationalError:
+        return 0
+    return state['last_id'] if state else 0
+
+def state_generation(state):
+    """The packet generation a DetectorState row was computed at (0 for rows written before it was recorded)."""
+    if state is None or not state['state']:
+        return 0
+    return json.loads(state['state']).get('generation', 0)
+
+def mark_packets_rewritten(cursor):
+    """Record that existing packet rows were rewritten in place (caller commits); returns the new generation.
+
+    Id watermarks only see appended rows, so whatever was folded in from the
+    old contents is dropped and rebuilt from the first packet on its next
+    update: the identity graph and DeviceStats.
+    """
+    generation = packet_generation(cursor) + 1
+    save_detector_state(cursor, PACKET_GENERATION_STATE, last_id=generation)
+    reset_identity_clusters(cursor)
+    reset_device_stats(cursor)
+    return generation
+
+def convert_timestamps_to_utc(cursor):
+    """Once per database, move timestamp_us values from local wall-clock to UTC microseconds (caller commits).
+
+    Earlier versions counted timestamp_us from a naive epoch in local time, so
+    it ran backwards when DST ended. Each packet and ReplayAlerts time is
+    shifted by the UTC offset its wall-clock quarter hour had (a repeated hour
+    is read as its first pass); a database with no offset to apply is only
+    marked. Changed packets are marked rewritten, which also invalidates the
+    analyzers' watermarks. Returns the number of packet rows changed.
+    """
+    if get_detector_state(cursor, TIMESTAMP_UTC_STATE) is not None:
+        return 0
+    table = packet_table(cursor)
+    cursor.execute(f'''
+        SELECT timestamp_us / {OFFSET_BUCKET_US} FROM {table} WHERE timestamp_us IS NOT NULL
+        UNION SELECT first_seen_us / {OFFSET_BUCKET_US} FROM ReplayAlerts WHERE first_seen_us IS NOT NULL
+        UNION SELECT repeated_at_us / {OFFSET_BUCKET_US} FROM ReplayAlerts WHERE repeated_at_us IS NOT NULL
+    ''')
+    offsets = [(bucket, wall_clock_offset_us(bucket * OFFSET_BUCKET_US)) for (bucket,) in cursor.fetchall()]
+    offsets = [(bucket, offset) for bucket, offset in offsets if offset]
+    changed = 0
+    if offsets:
+        cursor.execute('CREATE TEMP TABLE WallClockOffset (bucket INTEGER PRIMARY KEY, offset_us INTEGER)')
+        cursor.executemany('INSERT INTO WallClockOffset VALUES (?, ?)', offsets)
+        for target, column in ((table, 'timestamp_us'), ('ReplayAlerts', 'first_seen_us'),
+                               ('ReplayAlerts', 'repeated_at_us')):
+            cursor.execute(f'''
+                UPDATE {target}
+                SET {column} = {column} - (SELECT offset_us FROM WallClockOffset
+                                           WHERE bucket = {column} / {OFFSET_BUCKET_US})
+                WHERE {column} / {OFFSET_BUCKET_US} IN (SELECT bucket FROM WallClockOffset)
+            ''')
+            if target == table:
+                changed = cursor.rowcount
+        cursor.execute('DROP TABLE WallClockOffset')
+        mark_packets_rewritten(cursor)
+    save_detector_state(cursor, TIMESTAMP_UTC_STATE, state=json.dumps({'converted_packets': changed}))
+    return changed
+
+def convert_packet_hashes_to_blobs(cursor):
+    """Once per normalized database, store the hex packet hashes of older rows as BLOBs (caller commits).
+
+    The BLEPacket view reads them back as the same text, so nothing is marked
+    rewritten. Returns the number of rows converted.
+    """
+    if get_storage_mode(cursor) != 'normalized' or get_detector_state(cursor, PACKET_HASH_BLOB_STATE) is not None:
+        return 0
+    cursor.connection.create_function('packet_hash_blob', 1, packet_hash_blob, deterministic=True)
+    cursor.execute('''
+        UPDATE BLEPacketCompact SET packet_hash = packet_hash_blob(packet_hash)
+        WHERE typeof(packet_hash) = 'text' AND typeof(packet_hash_blob(packet_hash)) = 'blob'
+    ''')
+    converted = cursor.rowcount
+    save_detector_state(cursor, PACKET_HASH_BLOB_STATE, state=json.dumps({'converted_packets': converted}))
+    return converted
+
+def identity_clusters_current(cursor):
+    """False when IdentityCluster was built before packet rows it covers were rewritten."""
+    return state_generation(get_detector_state(cursor, IDENTITY_GRAPH_STATE)) == packet_generation(cursor)
+
+def update_identity_clusters(cursor, graph=None, batch_size=100000):
+    """Feed the packets after the 'identity_graph' watermark to an IdentityGraph and persist it (caller commits).
+
+    Only rows with a larger id than the last run are read, so the cost follows
+    the new packets, not the history. A graph built before packet rows were
+    rewritten in place is discarded and rebuilt. Returns (graph, packets
+    consumed); pass the graph back in to keep its caches across calls.
+    """
+    if not identity_clusters_current(cursor):
+        reset_identity_clusters(cursor)
+        graph = None
+    if graph is None:
+        graph = IdentityGraph.load(cursor)
+    state = get_detector_state(cursor, IDENTITY_GRAPH_STATE)
+    last_id = state['last_id'] if state else 0
+    generation = json.dumps({'generation': packet_generation(cursor)})
+    consumed = 0
+    while True:
+        cursor.execute('''
+            SELECT id, lower(smac), payload_fingerprint FROM BLEPacket
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for _packet_id, mac, fingerprint in rows:
+            graph.observe(mac, fingerprint)
+        last_id = rows[-1][0]
+        consumed += len(rows)
+        graph.flush(cursor)
+        save_detector_state(cursor, IDENTITY_GRAPH_STATE, last_id=last_id, state=generation)
+    return graph, consumed
+
+def reset_identity_clusters(cursor):
+    """Forget every cluster so the next update_identity_clusters rebuilds them from the first packet."""
+    cursor.execute('DELETE FROM IdentityCluster')
+    cursor.execute('DELETE FROM IdentityFingerprint')
+    cursor.execute('DELETE FROM DetectorState WHERE name = ?', (IDENTITY_GRAPH_STATE,))
+
+def identity_cluster_summary(cursor):
+    """MACs, clusters and the cluster-size histogram straight off IdentityCluster."""
+    cursor.execute('''
+        SELECT size, COUNT(*) FROM (SELECT COUNT(*) AS size FROM IdentityCluster GROUP BY cluster)
+        GROUP BY size ORDER BY size
+    ''')
+    sizes = dict(cursor.fetchall())
+    return {'macs': sum(size * count for size, count in sizes.items()),
+            'clusters': sum(sizes.values()),
+            'cluster_sizes': sizes}
+
+# One upsert per device for the packets of one id range. The distinct counts only add the
+# fingerprints / dmacs not yet in the pair tables, so they must be read before the pairs are inserted.
+DEVICE_STATS_UPSERT = '''
+    WITH batch AS (
+        SELECT lower(smac) AS smac, lower(dmac) AS dmac, timestamp_us, rssi, payload_fingerprint
+        FROM BLEPacket WHERE id > ? AND id <= ? AND smac IS NOT NULL
+    )
+    INSERT INTO DeviceStats (smac, packet_count, first_seen_us, last_seen_us, rssi_count, rssi_min, rssi_max,
+                             rssi_sum, rssi_sumsq, unique_fingerprints, unique_dmacs)
+    SELECT smac, COUNT(*), MIN(timestamp_us), MAX(timestamp_us), COUNT(rssi), MIN(rssi), MAX(rssi),
+           COALESCE(SUM(rssi), 0), COALESCE(SUM(rssi * rssi), 0),
+           COUNT(DISTINCT CASE WHEN NOT EXISTS (
+               SELECT 1 FROM DeviceFingerprint f WHERE f.smac = b.smac AND f.payload_fingerprint = b.payload_fingerprint
+           ) THEN payload_fingerprint END),
+           COUNT(DISTINCT CASE WHEN NOT EXISTS (
+               SELECT 1 FROM DeviceDmac d WHERE d.smac = b.smac AND d.dmac = b.dmac
+           ) THEN dmac END)
+    FROM batch b GROUP BY smac
+    ON CONFLICT(smac) DO UPDATE SET
+        packet_count = packet_count + excluded.packet_count,
+        first_seen_us = COALESCE(MIN(first_seen_us, excluded.first_seen_us), first_seen_us, excluded.first_seen_us),
+        last_seen_us = COALESCE(MAX(last_seen_us, excluded.last_seen_us), last_seen_us, excluded.last_seen_us),
+        rssi_count = rssi_count + excluded.rssi_count,
+        rssi_min = COALESCE(MIN(rssi_min, excluded.rssi_min), rssi_min, excluded.rssi_min),
+        rssi_max = COALESCE(MAX(rssi_max, excluded.rssi_max), rssi_max, excluded.rssi_max),
+        rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_sumsq = rssi_sumsq + excluded.rssi_sumsq,
+        unique_fingerprints = unique_fingerprints + excluded.unique_fingerprints,
+        unique_dmacs = unique_dmacs + excluded.unique_dmacs
+'''
+
+def update_device_stats(cursor, batch_size=200000):
+    """Fold the packets after the 'device_stats' watermark into DeviceStats (caller commits).
+
+    Reads id ranges of at most batch_size rows and does one upsert per device
+    per range, so the cost follows the new packets. Statistics folded before
+    packet rows were rewritten in place are discarded and recomputed.
+    Returns the packets consumed.
+    """
+    state = get_detector_state(cursor, DEVICE_STATS_STATE)
+    if state_generation(state) != packet_generation(cursor):
+        reset_device_stats(cursor)
+        state = None
+    last_id = state['last_id'] if state else 0
+    generation = json.dumps({'generation': packet_generation(cursor)})
+    cursor.execute(f'SELECT MAX(id) FROM {packet_table(cursor)}')
+    max_id = cursor.fetchone()[0] or 0
+    consumed = 0
+    while last_id < max_id:
+        end_id = min(last_id + batch_size, max_id)
+        cursor.execute('SELECT COUNT(*) FROM BLEPacket WHERE id > ? AND id <= ?', (last_id, end_id))
+        consumed += cursor.fetchone()[0]
+        cursor.execute(DEVICE_STATS_UPSERT, (last_id, end_id))
+        cursor.execute('''
+            INSERT OR IGNORE INTO DeviceFingerprint (smac, payload_fingerprint)
+            SELECT DISTINCT lower(smac), payload_fingerprint FROM BLEPacket
+            WHERE id > ? AND id <= ? AND smac IS NOT NULL AND payload_fingerprint IS NOT NULL
+        ''', (last_id, end_id))
+        cursor.execute('''
+            INSERT OR IGNORE INTO DeviceDmac (smac, dmac)
+            SELECT DISTINCT lower(smac), lower(dmac) FROM BLEPacket
+            WHERE id > ? AND id <= ? AND smac IS NOT NULL AND dmac IS NOT NULL
+        ''', (last_id, end_id))
+        last_id = end_id
+        save_detector_state(cursor, DEVICE_STATS_STATE, last_id=last_id, state=generation)
+    return consumed
+
+def reset_device_stats(cursor):
+    """Empty DeviceStats so the next update_device_stats recomputes it from the first packet."""
+    for table in ('DeviceStats', 'DeviceFingerprint', 'DeviceDmac'):
+        cursor.execute(f'DELETE FROM {table}')
+    cursor.execute('DELETE FROM DetectorState WHERE name = ?', (DEVICE_STATS_STATE,))
+
+def device_stats_current(cursor):
+    """True when DeviceStats covers every packet as stored now (False on a database that predates the table)."""
+    try:
+        state = get_detector_state(cursor, DEVICE_STATS_STATE)
+    except sqlite3.OperationalError:
+        return False
+    if state_generation(state) != packet_generation(cursor):
+        return False
+    cursor.execute(f'SELECT MAX(id) FROM {packet_table(cursor)}')
+    max_id = cursor.fetchone()[0] or 0
+    return (state['last_id'] if state else 0) >= max_id
+
+def database_state(db_path):
+    """(max id, row count) of the packet and UUID tables plus the packet generation: a cheap token of the analyzers' input.
+
+    Appends and deletions change the counts; rewrites of existing rows in
+    place (dbMaintenance recompute-distance, the mocked rows of
+    insertMockedData) bump the generation (see mark_packets_rewritten).
+    None when the database does not exist yet.
+    """
+    if not os.path.exists(db_path):
+        return None
+    conn = connect(db_path)
+    try:
+        cursor = conn.cursor()
+        state = {}
+        for name, table in (('packets', packet_table(cursor)), ('uuids', 'BLEPacketUUID')):
+            try:
+                cursor.execute(f'SELECT MAX(rowid), COUNT(*) FROM {table}')
+                state[name] = list(cursor.fetchone())
+            except sqlite3.OperationalError:
+                state[name] = None
+        state['generation'] = packet_generation(cursor)
+        return state
+    finally:
+        conn.close()
+
+def packet_fingerprints(cursor, packets):
+    """(content_fingerprint, payload_fingerprint, id) for (id, dmac, company_id, manufacturer_data) rows.
+
+    UUID sets are read from BLEPacketUUID in one range scan over the rows' ids.
+    """
+    if not packets:
+        return []
+    ids = [packet[0] for packet in packets]
+    uuids = {}
+    cursor.execute('''
+        SELECT ble_packet_id, uuid_type, uuid FROM BLEPacketUUID
+        WHERE ble_packet_id BETWEEN ? AND ?
+    ''', (min(ids), max(ids)))
+    for packet_id, uuid_type, uuid in cursor.fetchall():
+        uuids.setdefault((packet_id, uuid_type), set()).add(uuid)
+
+    fingerprints = []
+    for packet_id, dmac, company_id, manufacturer_data in packets:
+        packet_uuids = {uuid_type: uuids.get((packet_id, uuid_type), ()) for uuid_type in ('16', '32', '128')}
+        fingerprints.append(stored_fingerprints(dmac, company_id, manufacturer_data, packet_uuids) + (packet_id,))
+    return fingerprints
+
+def stored_fingerprints(dmac, company_id, manufacturer_data, uuids):
+    """(content_fingerprint, payload_fingerprint) of a stored packet; ``uuids`` maps '16' / '32' / '128' to its UUIDs."""
+    fields = {
+        'dmac': dmac,
+        'uuids_16': ','.join(sorted(set(uuids.get('16', ())))),
+        'uuids_32': ','.join(sorted(set(uuids.get('32', ())))),
+        'uuids_128': ','.join(sorted(set(uuids.get('128', ())))),
+        'company_id': company_id or '',
+        'manufacturer_data': manufacturer_data or '',
+    }
+    return generate_content_fingerprint(fields), generate_payload_fingerprint(fields)
+
+def backfill_content_fingerprints(conn, batch_size=50000):
+    """Compute content_fingerprint and payload_fingerprint for rows ingested before the columns existed."""
+    cursor = conn.cursor()
+    table = packet_table(cursor)
+    last_id = 0
+    updated = 0
+    while True:
+        cursor.execute('''
+            SELECT id, dmac, company_id, manufacturer_data FROM BLEPacket
+            WHERE id > ? AND (content_fingerprint IS NULL OR payload_fingerprint IS NULL) ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        packets = cursor.fetchall()
+        if not packets:
+            break
+        last_id = packets[-1][0]
+        updates = packet_fingerprints(cursor, packets)
+        cursor.executemany(f'UPDATE {table} SET content_fingerprint = ?, payload_fingerprint = ? WHERE id = ?',
+                           updates)
+        conn.commit()
+        updated += len(updates)
+    if updated:
+        mark_packets_rewritten(cursor)
+        conn.commit()
+    return updated
+
+def backfill_timestamp_us(conn, batch_size=50000):
+    """Fill timestamp_us from the timestamp text for rows written before the column existed."""
+    cursor = conn.cursor()
+    table = packet_table(cursor)
+    last_id = 0
+    updated = 0
+    while True:
+        cursor.execute('''
+            SELECT id, timestamp FROM BLEPacket
+            WHERE id > ? AND timestamp_us IS NULL ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        cursor.executemany(f'UPDATE {table} SET timestamp_us = ? WHERE id = ?',
+                           [(timestamp_to_us(timestamp), packet_id) for packet_id, timestamp in rows])
+        conn.commit()
+        updated += len(rows)
+    if updated:
+        mark_packets_rewritten(cursor)
+        conn.commit()
+    return updated
+
+def lowercase_macs(conn, batch_size=50000):
+    """Lower-case the smac / dmac values an earlier version stored as given; returns how many packets changed.
+
+    A packet whose dmac changes gets its content_fingerprint recomputed (the
+    fingerprint hashes dmac), and the ReplayAlerts of the old and new
+    fingerprints are recomputed; in the normalized layout Device rows that
+    collide once lower-cased are merged. Any change marks the packets rewritten.
+    """
+    cursor = conn.cursor()
+    table = packet_table(cursor)
+    cursor.execute('SELECT id, content_fingerprint FROM BLEPacket WHERE dmac <> lower(dmac)')
+    dmac_changed = cursor.fetchall()
+    cursor.execute('SELECT COUNT(*) FROM BLEPacket WHERE smac <> lower(smac) OR dmac <> lower(dmac)')
+    changed = cursor.fetchone()[0]
+    if not changed:
+        return 0
+
+    if get_storage_mode(cursor) == 'normalized':
+        cursor.execute('SELECT id, mac FROM Device WHERE mac <> lower(mac)')
+        for device_id, mac in cursor.fetchall():
+            cursor.execute('SELECT id FROM Device WHERE mac = ?', (mac.lower(),))
+            existing = cursor.fetchone()
+            if existing is None:
+                cursor.execute('UPDATE Device SET mac = ? WHERE id = ?', (mac.lower(), device_id))
+                continue
+            for column in ('smac_id', 'dmac_id'):
+                cursor.execute(f'UPDATE BLEPacketCompact SET {column} = ? WHERE {column} = ?', (existing[0], device_id))
+            cursor.execute('DELETE FROM Device WHERE id = ?', (device_id,))
+    else:
+        cursor.execute('UPDATE BLEPacket SET smac = lower(smac) WHERE smac <> lower(smac)')
+        cursor.execute('UPDATE BLEPacket SET dmac = lower(dmac) WHERE dmac <> lower(dmac)')
+
+    fingerprints = {fingerprint for _, fingerprint in dmac_changed if fingerprint is not None}
+    ids = [packet_id for packet_id, _ in dmac_changed]
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        cursor.execute(f"""
+            SELECT id, dmac, company_id, manufacturer_data FROM BLEPacket
+            WHERE id IN ({', '.join('?' for _ in batch)}) ORDER BY id
+        """, batch)
+        updates = packet_fingerprints(cursor, cursor.fetchall())
+        cursor.executemany(f'UPDATE {table} SET content_fingerprint = ?, payload_fingerprint = ? WHERE id = ?',
+                           updates)
+        fingerprints.update(content for content, _payload, _id in updates)
+    queue_replay_recheck(cursor, fingerprints)
+    recheck_replay_alerts(cursor, int(REPLAY_TIME_WINDOW_SEC * 1_000_000))
+    cursor.execute('UPDATE ReplayAlerts SET smac = lower(smac), dmac = lower(dmac)')
+    mark_packets_rewritten(cursor)
+    conn.commit()
+    return changed
+
+def recompute_distances(conn, calibration=DISTANCE_CALIBRATION, batch_size=500000):
+    """Rewrite distance from rssi with the current path-loss calibration, in place.
+
+    Works through id ranges of batch_size packets, one transaction each, and
+    writes only the rows whose value changes. Indexes that contain distance
+    are dropped first and rebuilt at the end; a run that changed anything
+    marks the packets rewritten. Returns (scanned, updated).
+    """
+    cursor = conn.cursor()
+    table = packet_table(cursor)
+    for index in index_status(cursor):
+        if 'distance' in index['columns'] and index['state'] in ('ok', 'stale'):
+            cursor.execute(f"DROP INDEX {index['name']}")
+    conn.commit()
+
+    last_id = scanned = updated = 0
+    while True:
+        rows = cursor.execute('''
+            SELECT id, rssi, distance, company_id, smac FROM BLEPacket WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        ids, rssi, current, company_ids, smacs = zip(*rows)
+        last_id = ids[-1]
+        distance = rssi_to_distance_array(rssi, *calibration_arrays(company_ids, smacs, calibration))
+        current = np.array(current, dtype='float64')
+        changed = np.flatnonzero((distance != current) & ~(np.isnan(distance) & np.isnan(current)))
+        values = distance[changed].tolist()
+        cursor.executemany(f'UPDATE {table} SET distance = ? WHERE id = ?',
+                           [(None if value != value else value, ids[i]) for value, i in zip(values, changed.tolist())])
+        conn.commit()
+        scanned += len(rows)
+        updated += len(changed)
+
+    if updated:
+        mark_packets_rewritten(cursor)
+    create_indexes(cursor)
     conn.commit()
+    return scanned, updated
+
+def normalize_packet_storage(conn):
+    """Convert a flat BLEPacket table to the normalized layout in place; returns the packet count."""
+    cursor = conn.cursor()
+    if get_storage_mode(cursor) != 'flat':
+        return 0
+    # These columns are stored as-is in BLEPacketCompact, and the timestamp text is derived from timestamp_us
+    backfill_timestamp_us(conn)
+    backfill_content_fingerprints(conn)
+
+    conn.create_function('payload_hash', 2, payload_content_hash, deterministic=True)
+    conn.create_function('packet_hash_blob', 1, packet_hash_blob, deterministic=True)
+    create_normalized_packet_tables(cursor)
+    cursor.execute('''
+        INSERT OR IGNORE INTO Device (mac)
+        SELECT mac FROM (SELECT smac AS mac FROM BLEPacket UNION SELECT dmac FROM BLEPacket)
+        WHERE mac IS NOT NULL
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO Payload (company_id, manufacturer_data, content_hash)
+        SELECT company_id, manufacturer_data, payload_hash(company_id, manufacturer_data)
+        FROM (SELECT DISTINCT company_id, manufacturer_data FROM BLEPacket)
+        WHERE company_id IS NOT NULL OR manufacturer_data IS NOT NULL
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO CaptureSource (source_file, sensor_id)
+        SELECT DISTINCT source_file, sensor_id FROM BLEPacket
+        WHERE source_file IS NOT NULL OR sensor_id IS NOT NULL
+    ''')
+    cursor.execute('''
+        INSERT INTO BLEPacketCompact (id, timestamp_us, smac_id, dmac_id, rssi, distance, payload_id,
+                                      packet_hash, content_fingerprint, payload_fingerprint, source_id)
+        SELECT p.id, p.timestamp_us, s.id, d.id, p.rssi, p.distance, pl.id,
+               packet_hash_blob(p.packet_hash), p.content_fingerprint, p.payload_fingerprint, src.id
+        FROM BLEPacket p
+        LEFT JOIN Device s ON s.mac = p.smac
+        LEFT JOIN Device d ON d.mac = p.dmac
+        LEFT JOIN Payload pl ON pl.content_hash = payload_hash(p.company_id, p.manufacturer_data)
+        LEFT JOIN CaptureSource src ON src.source_file IS p.source_file AND src.sensor_id IS p.sensor_id
+        ORDER BY p.id
+    ''')
+    packet_count = cursor.rowcount
+    cursor.execute('DROP TABLE BLEPacket')
+    create_packet_view(cursor)
+    save_detector_state(cursor, PACKET_HASH_BLOB_STATE, state=json.dumps({'converted_packets': 0}))
+    # Built once over the loaded table rather than maintained during the copy
+    create_indexes(cursor)
+    conn.commit()
+    conn.execute('VACUUM')
+    return packet_count
+
+def stored_packet(cursor, packet_id):
+    """(physical row as PacketStore.encode returns it, sorted (uuid_type, uuid) rows) of a packet id, or None."""
+    cursor.execute(f"SELECT {', '.join(PacketStore(cursor).columns)} FROM {packet_table(cursor)} WHERE id = ?",
+                   (packet_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute('SELECT uuid_type, uuid FROM BLEPacketUUID WHERE ble_packet_id = ? ORDER BY uuid_type, uuid',
+                   (packet_id,))
+    return row, cursor.fetchall()
 
 def insert_malicious_attack_data(db_path):
     """
     Güvenilir olmayan ağ ortamını simüle eden saldırı verilerini ekler
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path, 'bulk')
     cursor = conn.cursor()
     
     print("🚨 Saldırı simülasyon verileri ekleniyor...")
@@ -86,8 +1192,8 @@ def insert_malicious_attack_data(db_path):
   {
     "id": 1,
     "timestamp": "2025-05-26 15:00:00.000000",
-    "smac": "AA:BB:CC:DD:EE:FF",
-    "dmac": "FF:FF:FF:FF:FF:FF",
+    "smac": "aa:bb:cc:dd:ee:ff",
+    "dmac": "ff:ff:ff:ff:ff:ff",
     "rssi": -40,
     "distance": 1.0,
     "company_id": "0x0006",
@@ -100,8 +1206,8 @@ def insert_malicious_attack_data(db_path):
   {
     "id": 2,
     "timestamp": "2025-05-26 15:00:01.000000",
-    "smac": "AA:BB:CC:DD:EE:FF",
-    "dmac": "FF:FF:FF:FF:FF:FF",
+    "smac": "aa:bb:cc:dd:ee:ff",
+    "dmac": "ff:ff:ff:ff:ff:ff",
     "rssi": -40,
     "distance": 1.0,
     "company_id": "0x0006",
@@ -115,7 +1221,7 @@ def insert_malicious_attack_data(db_path):
     "id": 3,
     "timestamp": "2025-05-26 15:01:00.000000",
     "smac": "11:22:33:44:55:66",
-    "dmac": "FF:FF:FF:FF:FF:FF",
+    "dmac": "ff:ff:ff:ff:ff:ff",
     "rssi": -35,
     "distance": 0.8,
     "company_id": "0x0006",
@@ -129,7 +1235,7 @@ def insert_malicious_attack_data(db_path):
     "id": 4,
     "timestamp": "2025-05-26 15:02:00.000000",
     "smac": "11:22:33:44:55:66",
-    "dmac": "FF:FF:FF:FF:FF:FF",
+    "dmac": "ff:ff:ff:ff:ff:ff",
     "rssi": -30,
     "distance": 0.5,
     "company_id": "0x0006",
@@ -142,8 +1248,8 @@ def insert_malicious_attack_data(db_path):
   {
     "id": 5,
     "timestamp": "2025-05-26 15:05:00.000000",
-    "smac": "27:DF:D0:83:01:3F",
-    "dmac": "FF:FF:FF:FF:FF:FF",
+    "smac": "27:df:d0:83:01:3f",
+    "dmac": "ff:ff:ff:ff:ff:ff",
     "rssi": -45,
     "distance": 2.0,
     "company_id": "0x0006",
@@ -156,8 +1262,8 @@ def insert_malicious_attack_data(db_path):
   {
     "id": 6,
     "timestamp": "2025-05-26 15:05:01.000000",
-    "smac": "69:84:17:7F:FD:D9",
-    "dmac": "FF:FF:FF:FF:FF:FF",
+    "smac": "69:84:17:7f:fd:d9",
+    "dmac": "ff:ff:ff:ff:ff:ff",
     "rssi": -45,
     "distance": 2.0,
     "company_id": "0x0006",
@@ -170,8 +1276,8 @@ def insert_malicious_attack_data(db_path):
       {
         "id": 7,
         "timestamp": "2025-05-26 15:06:00.000000",
-        "smac": "DE:AD:BE:EF:00:01",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "de:ad:be:ef:00:01",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -50,
         "distance": 2.5,
         "company_id": "0x004C",  # Apple Inc.
@@ -184,8 +1290,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 8,
         "timestamp": "2025-05-26 15:06:05.000000",
-        "smac": "DE:AD:BE:EF:00:02",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "de:ad:be:ef:00:02",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -48,
         "distance": 2.2,
         "company_id": "0x004C",
@@ -198,8 +1304,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 9,
         "timestamp": "2025-05-26 15:07:00.000000",
-        "smac": "BE:EF:FA:CE:CA:FE",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "be:ef:fa:ce:ca:fe",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -60,
         "distance": 3.5,
         "company_id": "0x0006",
@@ -212,8 +1318,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 10,
         "timestamp": "2025-05-26 15:07:30.000000",
-        "smac": "AA:BB:CC:DD:EE:FF",  # Impersonated device
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "aa:bb:cc:dd:ee:ff",  # Impersonated device
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -55,
         "distance": 3.0,
         "company_id": "0x0006",
@@ -226,8 +1332,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 11,
         "timestamp": "2025-05-26 15:08:00.000000",
-        "smac": "FA:KE:MI:TM:00:01",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "fa:ke:mi:tm:00:01",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -38,
         "distance": 1.5,
         "company_id": "0x00FF",
@@ -240,8 +1346,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 12,
         "timestamp": "2025-05-26 15:08:30.000000",
-        "smac": "FA:KE:MI:TM:00:02",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "fa:ke:mi:tm:00:02",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -36,
         "distance": 1.2,
         "company_id": "0x00FF",
@@ -254,8 +1360,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 13,
         "timestamp": "2025-05-26 15:09:00.000000",
-        "smac": "66:77:88:99:AA:BB",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "66:77:88:99:aa:bb",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -42,
         "distance": 2.3,
         "company_id": "0xFFFF",
@@ -268,8 +1374,8 @@ def insert_malicious_attack_data(db_path):
     {
         "id": 14,
         "timestamp": "2025-05-26 15:09:30.000000",
-        "smac": "77:88:99:AA:BB:CC",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "smac": "77:88:99:aa:bb:cc",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -44,
         "distance": 2.6,
         "company_id": "0xFFFF",
@@ -283,7 +1389,7 @@ def insert_malicious_attack_data(db_path):
         "id": 15,
         "timestamp": "2025-05-26 15:10:00.000000",
         "smac": "33:44:55:66:77:88",
-        "dmac": "FF:FF:FF:FF:FF:FF",
+        "dmac": "ff:ff:ff:ff:ff:ff",
         "rssi": -70,
         "distance": 5.0,
         "company_id": "0xABCD",
@@ -297,30 +1403,37 @@ def insert_malicious_attack_data(db_path):
 ]
     
     # Paketleri veritabanına ekle
+    # Ids at or below the current maximum replace (or fill gaps among) rows the id watermarks have already passed
+    cursor.execute(f'SELECT MAX(id) FROM {packet_table(cursor)}')
+    max_id = cursor.fetchone()[0] or 0
+    rewrites = False
+    store = PacketStore(cursor)
     for packet in malicious_packets:
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO BLEPacket 
-                (id, timestamp, smac, dmac, rssi, distance, company_id, manufacturer_data, packet_hash)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                packet['id'], packet['timestamp'], packet['smac'], packet['dmac'],
-                packet['rssi'], packet['distance'], packet['company_id'], 
-                packet['manufacturer_data'], packet['packet_hash']
-            ))
-            print(f"✅ Paket {packet['id']} eklendi - {packet['smac']}")
-                    # Insert UUIDs
             packet_id = packet['id']
-            for uuid in packet.get('uuids_16', []):
-                insert_uuids(cursor, conn, packet_id, packet.get('uuids_16', []), '16')
-            for uuid in packet.get('uuids_32', []):
-                insert_uuids(cursor, conn, packet_id, packet.get('uuids_32', []), '32')
-            for uuid in packet.get('uuids_128', []):
-                insert_uuids(cursor, conn, packet_id, packet.get('uuids_128', []), '128')
+            uuids = {uuid_type: packet.get(f'uuids_{uuid_type}', []) for uuid_type in ('16', '32', '128')}
+            # Stored complete, as the ingester writes packets, so no backfill rewrites them afterwards
+            packet = dict(packet, timestamp_us=timestamp_to_us(packet['timestamp']))
+            packet['content_fingerprint'], packet['payload_fingerprint'] = stored_fingerprints(
+                packet['dmac'], packet['company_id'], packet['manufacturer_data'], uuids)
+            row = tuple(packet.get(column) for column in PACKET_COLUMNS)
+            uuid_rows = sorted((uuid_type, uuid) for uuid_type, values in uuids.items() for uuid in values)
+            if stored_packet(cursor, packet_id) == (store.encode(row), uuid_rows):
+                print(f"✔️ Paket {packet_id} zaten kayıtlı - {packet['smac']}")
+                continue
+            store.insert(row, packet_id=packet_id, conflict='REPLACE')
+            rewrites = rewrites or packet_id <= max_id
+            print(f"✅ Paket {packet_id} eklendi - {packet['smac']}")
+            # A replaced packet must not keep the UUIDs of the row it overwrote
+            cursor.execute('DELETE FROM BLEPacketUUID WHERE ble_packet_id = ?', (packet_id,))
+            for uuid_type, values in uuids.items():
+                insert_uuids(cursor, conn, packet_id, values, uuid_type, commit=False)
 
         except Exception as e:
             print(f"❌ Paket {packet['id']} eklenirken hata: {e}")
     
+    if rewrites:
+        mark_packets_rewritten(cursor)
     conn.commit()
     
     # MAC Spoofing alert'leri ekle
@@ -351,6 +1464,8 @@ def insert_malicious_attack_data(db_path):
             print(f"❌ MAC Spoofing alert eklenirken hata: {e}")
     
     conn.commit()
+    backfill_timestamp_us(conn)
+    backfill_content_fingerprints(conn)
     conn.close()
     
     print("🎯 Saldırı simülasyon verileri başarıyla eklendi!")
@@ -364,7 +1479,7 @@ def verify_malicious_data(db_path):
     """
     Eklenen saldırı verilerini doğrula
     """
-    conn = sqlite3.connect(db_path)
+    conn = connect(db_path)
     cursor = conn.cursor()
     
     print("\n🔍 Saldırı verilerini doğrulama...")
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from utils.db_utils import device_stats_current
+from utils.profile_utils import count_rows_read
+from utils.time_utils import timestamp_us_to_datetime, local_time
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+# How read_packet_frame types the text columns of BLEPacket / BLEPacketUUID:
+# 'mac' = categorical with lower-cased categories, 'category' = categorical,
+# 'string' = STRING_DTYPE for near-unique values (a category per row would cost more)
+PACKET_COLUMN_TYPES = {
+    'smac': 'mac',
+    'dmac': 'mac',
+    'company_id': 'category',
+    'manufacturer_data': 'category',
+    'uuid_type': 'category',
+    'uuid': 'category',
+    'packet_hash': 'string',
+}
+READ_CHUNK_ROWS = 200_000
+
+
+def lower_categories(values):
+    """Lower-case a categorical by rewriting its categories, merging any that collide; codes stay sorted."""
+    categories = values.cat.categories
+    lowered = categories.str.lower()
+    merged = pd.Index(sorted(set(lowered)), dtype=categories.dtype)
+    codes = values.cat.codes.to_numpy()
+    remap = merged.get_indexer(lowered)
+    new_codes = np.where(codes >= 0, remap[codes], -1) if len(remap) else codes
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories=merged), index=values.index, name=values.name)
+
+
+def fill_missing(values, fill=''):
+    """fillna for a column of any read_packet_frame dtype (a categorical needs the value as a category)."""
+    if isinstance(values.dtype, pd.CategoricalDtype) and values.hasnans:
+        if fill not in values.cat.categories:
+            values = values.cat.add_categories([fill])
+    return values.fillna(fill)
+
+
+def _type_chunk(chunk):
+    for column in chunk.columns:
+        kind = PACKET_COLUMN_TYPES.get(column)
+        if kind in ('mac', 'category'):
+            chunk[column] = chunk[column].astype('category')
+        elif kind == 'string':
+            chunk[column] = chunk[column].astype(STRING_DTYPE)
+    if 'timestamp' in chunk.columns:
+        chunk['timestamp'] = timestamp_us_to_datetime(chunk['timestamp']).to_numpy()
+    return chunk
+
+
+def read_packet_frame(conn, sql, params=(), chunk_rows=READ_CHUNK_ROWS):
+    """Run a packet query into a typed DataFrame.
+
+    Rows are fetched chunk_rows at a time and typed per chunk, so the object
+    strings of only one chunk are alive at once. Columns listed in
+    PACKET_COLUMN_TYPES become categoricals with sorted categories (sorts and
+    groupbys then run on integer codes, in the same order as the strings) or
+    STRING_DTYPE; MAC columns are lower-cased once, on their categories. A
+    'timestamp' column of timestamp_us integers becomes datetime64[us] (UTC).
+    """
+    chunks = [_type_chunk(chunk) for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=chunk_rows)]
+    if not chunks:
+        return _type_chunk(pd.read_sql_query(sql, conn, params=params))
+    count_rows_read(sum(len(chunk) for chunk in chunks))
+    order = list(chunks[0].columns)
+    categorical = [column for column in order
+                   if PACKET_COLUMN_TYPES.get(column) in ('mac', 'category')]
+    merged = {column: union_categoricals([chunk[column] for chunk in chunks], sort_categories=True)
+              for column in categorical}
+    for chunk in chunks:
+        chunk.drop(columns=categorical, inplace=True)
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].reset_index(drop=True)
+    del chunks
+    for column in categorical:
+        values = pd.Series(merged.pop(column), index=df.index, name=column)
+        df[column] = lower_categories(values) if PACKET_COLUMN_TYPES[column] == 'mac' else values
+    return df[order]
+
+
+def read_device_stats(conn):
+    """DeviceStats as a frame, one row per smac; None while it lags BLEPacket (run an ingest or macSpoof.py).
+
+    first_seen / last_seen become datetime64[us], and rssi_mean / rssi_std
+    (sample, like Series.std) are derived from the stored count, sum and sum of squares.
+    """
+    if not device_stats_current(conn.cursor()):
+        return None
+    stats = read_packet_frame(conn, """
+        SELECT smac, packet_count, first_seen_us, last_seen_us, rssi_count, rssi_min, rssi_max, rssi_sum,
+               rssi_sumsq, unique_fingerprints, unique_dmacs
+        FROM DeviceStats ORDER BY smac
+    """)
+    for column in ('first_seen', 'last_seen'):
+        stats.insert(stats.columns.get_loc(f'{column}_us'), column,
+                     timestamp_us_to_datetime(stats.pop(f'{column}_us')).to_numpy())
+    count = stats['rssi_count'].astype('float64')
+    total = stats['rssi_sum'].astype('float64')
+    stats['rssi_mean'] = (total / count).where(count > 0)
+    variance = (stats['rssi_sumsq'].astype('float64') - total * total / count) / (count - 1)
+    stats['rssi_std'] = np.sqrt(variance.clip(lower=0)).where(count > 1)
+    return stats
+
+
+# The packet columns the replay / proximity visualizers and the dashboard plot, in time order
+PLOT_PACKETS_SQL = """
+    SELECT timestamp_us AS timestamp, dmac, smac, rssi, distance, packet_hash
+    FROM BLEPacket
+    ORDER BY timestamp_us
+"""
+
+
+def read_plot_packets(conn):
+    """PLOT_PACKETS_SQL as a typed frame, timestamp in local time; the pipeline loads it once for every plotting stage."""
+    df = read_packet_frame(conn, PLOT_PACKETS_SQL)
+    df['timestamp'] = local_time(df['timestamp'])
+    return df
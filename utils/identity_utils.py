@@ -0,0 +1,106 @@
+from utils.ble_utils import generate_payload_fingerprint
+
+# Packets with no UUIDs, company id or manufacturer data all share this fingerprint; it says nothing about identity
+EMPTY_PAYLOAD_FINGERPRINT = generate_payload_fingerprint(
+    {'uuids_16': '', 'uuids_32': '', 'uuids_128': '', 'company_id': '', 'manufacturer_data': ''})
+
+
+class IdentityGraph:
+    """Incremental union-find over advertiser MACs that share a payload fingerprint.
+
+    Every MAC belongs to one cluster, labelled by a representative MAC; two
+    clusters merge as soon as a packet links a MAC to a fingerprint already
+    seen from the other cluster. Union by size relabels the smaller cluster,
+    so find() is one dict lookup, each MAC is relabelled at most log2(n)
+    times, and the relabelled MACs are exactly the IdentityCluster rows a
+    flush has to write.
+
+    MAC labels are loaded from IdentityCluster up front; fingerprints are
+    looked up in IdentityFingerprint on first sight and cached, so only the
+    fingerprints of the current run are held in memory.
+    """
+
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+        self.cluster_of = {}    # mac -> representative mac
+        self.members = {}       # representative mac -> [macs]
+        self.fingerprints = {}  # payload_fingerprint -> first mac seen with it
+        self.dirty = set()
+        self.new_fingerprints = []
+
+    @classmethod
+    def load(cls, cursor):
+        graph = cls(cursor)
+        cursor.execute('SELECT mac, cluster FROM IdentityCluster')
+        for mac, cluster in cursor.fetchall():
+            graph.cluster_of[mac] = cluster
+            graph.members.setdefault(cluster, []).append(mac)
+        return graph
+
+    def __len__(self):
+        return len(self.cluster_of)
+
+    def find(self, mac):
+        return self.cluster_of.get(mac)
+
+    def _add(self, mac):
+        self.cluster_of[mac] = mac
+        self.members[mac] = [mac]
+        self.dirty.add(mac)
+
+    def _fingerprint_mac(self, fingerprint):
+        mac = self.fingerprints.get(fingerprint)
+        if mac is None and self.cursor is not None:
+            self.cursor.execute('SELECT mac FROM IdentityFingerprint WHERE payload_fingerprint = ?', (fingerprint,))
+            row = self.cursor.fetchone()
+            if row is not None:
+                mac = self.fingerprints[fingerprint] = row[0]
+        return mac
+
+    def union(self, a, b):
+        """Merge the clusters of two known MACs; returns the surviving label."""
+        keep, absorb = self.cluster_of[a], self.cluster_of[b]
+        if keep == absorb:
+            return keep
+        if len(self.members[keep]) < len(self.members[absorb]):
+            keep, absorb = absorb, keep
+        moved = self.members.pop(absorb)
+        for mac in moved:
+            self.cluster_of[mac] = keep
+        self.dirty.update(moved)
+        self.members[keep].extend(moved)
+        return keep
+
+    def observe(self, mac, fingerprint):
+        """Record one packet from ``mac`` carrying ``fingerprint`` (either may be None)."""
+        if mac is None:
+            return
+        if mac not in self.cluster_of:
+            self._add(mac)
+        if fingerprint is None or fingerprint == EMPTY_PAYLOAD_FINGERPRINT:
+            return
+        other = self._fingerprint_mac(fingerprint)
+        if other is None:
+            self.fingerprints[fingerprint] = mac
+            self.new_fingerprints.append((fingerprint, mac))
+        elif other != mac:
+            if other not in self.cluster_of:
+                self._add(other)
+            self.union(mac, other)
+
+    def flush(self, cursor):
+        """Write the MACs relabelled and the fingerprints first seen since the last flush (caller commits)."""
+        if self.dirty:
+            cursor.executemany('''
+                INSERT INTO IdentityCluster (mac, cluster) VALUES (?, ?)
+                ON CONFLICT(mac) DO UPDATE SET cluster = excluded.cluster
+            ''', [(mac, self.cluster_of[mac]) for mac in self.dirty])
+            self.dirty.clear()
+        if self.new_fingerprints:
+            cursor.executemany('INSERT OR IGNORE INTO IdentityFingerprint (payload_fingerprint, mac) VALUES (?, ?)',
+                               self.new_fingerprints)
+            self.new_fingerprints.clear()
+
+    def cluster_sizes(self):
+        """representative mac -> number of MACs, for the clusters held in memory."""
+        return {cluster: len(macs) for cluster, macs in self.members.items()}
@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import sqlite3
+import pandas as pd
+from utils.db_utils import connect, get_detector_state, save_detector_state, packet_table, packet_generation
+
+
+def read_watermark(db_path, name, params):
+    """Where an incremental detector left off, or (None, reason) when it has to run in full.
+
+    Returns ({'last_id', 'max_id', 'state'}, None) when the stored state was
+    computed with the same ``params`` and packet generation (no rows rewritten
+    in place since), every output file it recorded still exists, and the new
+    packets (id > last_id) all carry a timestamp no older than the newest one
+    already processed (state['max_ts_us']), so carrying the state
+    forward gives the result a full run would. max_id and the generation are
+    read once here: the run analyzes the packets up to max_id and stores both
+    with the next watermark.
+    """
+    conn = connect(db_path)
+    try:
+        cursor = conn.cursor()
+        try:
+            row = get_detector_state(cursor, name)
+        except sqlite3.OperationalError:
+            row = None
+        cursor.execute(f'SELECT MAX(id) FROM {packet_table(cursor)}')
+        max_id = cursor.fetchone()[0] or 0
+        if row is None or not row['state']:
+            return None, "no earlier run"
+        state = json.loads(row['state'])
+        if state.get('params') != params:
+            return None, "parameters changed"
+        generation = packet_generation(cursor)
+        if state.get('generation', 0) != generation:
+            return None, "packet rows were rewritten in place"
+        if max_id < row['last_id']:
+            return None, "packets were removed"
+        missing = [path for path in state.get('outputs', []) if not os.path.exists(path)]
+        if missing:
+            return None, f"{os.path.basename(missing[0])} is missing"
+        cursor.execute('''
+            SELECT MIN(timestamp_us), COUNT(*) - COUNT(timestamp_us) FROM BLEPacket WHERE id > ? AND id <= ?
+        ''', (row['last_id'], max_id))
+        oldest_new, untimed = cursor.fetchone()
+        newest_seen = state.get('max_ts_us')
+        if untimed or (oldest_new is not None and newest_seen is not None and oldest_new < newest_seen):
+            return None, "new packets are older than the ones already analyzed"
+    finally:
+        conn.close()
+    return {'last_id': row['last_id'], 'max_id': max_id, 'generation': generation, 'state': state}, None
+
+
+def current_max_id(db_path):
+    """The watermark a full run stores: the largest BLEPacket.id when it starts."""
+    conn = connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT MAX(id) FROM {packet_table(cursor)}')
+        return cursor.fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def current_generation(db_path):
+    """The packet generation a full run stores with its watermark, read when it starts."""
+    conn = connect(db_path)
+    try:
+        return packet_generation(conn.cursor())
+    finally:
+        conn.close()
+
+
+def max_timestamp_us(db_path, max_id):
+    """Newest timestamp_us among the packets up to max_id (the in-order check of the next run)."""
+    conn = connect(db_path)
+    try:
+        return conn.execute('SELECT MAX(timestamp_us) FROM BLEPacket WHERE id <= ?', (max_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def write_watermark(db_path, name, last_id, params, state, outputs=(), generation=0):
+    """Store the watermark and JSON carry-over state of one detector, with the ``outputs`` files that exist now.
+
+    ``generation`` is the packet generation the run read its packets at
+    (watermark['generation'] or current_generation() at the start), so a
+    rewrite during the run still invalidates the state.
+    """
+    state = {**state, 'params': params, 'outputs': [path for path in outputs if os.path.exists(path)],
+             'generation': generation}
+    conn = connect(db_path, 'state')
+    cursor = conn.cursor()
+    try:
+        save_detector_state(cursor, name, last_id=last_id, state=json.dumps(state))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def append_csv(frame, path):
+    """Append rows to a CSV written by an earlier run (with a header when the file is new)."""
+    exists = os.path.exists(path) and os.path.getsize(path) > 0
+    frame.to_csv(path, mode='a' if exists else 'w', header=not exists, index=False)
+
+
+def read_text_csv(path, columns=()):
+    """A CSV written by an earlier run as text (values exactly as written); None if absent or lacking ``columns``."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    try:
+        frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        return None
+    return frame if set(columns) <= set(frame.columns) else None
+
+
+def as_text(frame):
+    """``frame`` as the text to_csv writes for it, so new rows format like a full run's."""
+    return pd.read_csv(io.StringIO(frame.to_csv(index=False)), dtype=str, keep_default_na=False)
+
+
+def upsert_csv(path, frame, key, sort_by=(), parse=None, drop=None):
+    """Add ``frame``'s rows to a CSV, replacing earlier rows with the same ``key``; returns the row count.
+
+    Earlier rows are read and written back as text, so their values stay
+    exactly as written. With an empty ``key`` every row is kept. ``parse`` maps key / sort columns to a function that
+    turns their text into comparable values (e.g. pd.to_datetime); ``drop``
+    (a frame of key columns) removes rows that new ones supersede under a
+    different key; ``sort_by`` restores the order a full run writes.
+    """
+    parse = parse or {}
+    fresh = as_text(frame)
+    existing = read_text_csv(path, key)
+    combined = fresh if existing is None else pd.concat([existing, fresh], ignore_index=True)
+    keys = pd.DataFrame({column: parse.get(column, lambda values: values)(combined[column])
+                         for column in dict.fromkeys([*key, *sort_by])})
+    keep = ~keys.duplicated(subset=list(key), keep='last') if key else pd.Series(True, index=keys.index)
+    if key and drop is not None and len(drop):
+        dropped = pd.DataFrame({column: parse.get(column, lambda values: values)(drop[column].astype(str))
+                                for column in key})
+        stale = pd.MultiIndex.from_frame(keys[list(key)]).isin(pd.MultiIndex.from_frame(dropped))
+        keep &= ~stale | (combined.index >= len(combined) - len(fresh))
+    keys = keys[keep]
+    if sort_by:
+        keys = keys.sort_values(list(sort_by), kind='stable')
+    combined.loc[keys.index].to_csv(path, index=False)
+    return len(keys)
@@ -0,0 +1,184 @@
+import mmap
+import struct
+from collections import namedtuple
+
+# === pcapng block types ===
+SECTION_HEADER_BLOCK = 0x0A0D0D0A
+INTERFACE_DESCRIPTION_BLOCK = 0x00000001
+OBSOLETE_PACKET_BLOCK = 0x00000002
+ENHANCED_PACKET_BLOCK = 0x00000006
+
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+# Interface Description Block options
+OPT_END = 0
+OPT_IF_TSRESOL = 9
+OPT_IF_TSOFFSET = 14
+
+PacketRecord = namedtuple('PacketRecord', ['offset', 'end', 'linktype', 'ts_us', 'data'])
+
+
+def _parse_options(buf, start, stop, endian):
+    """Yield (code, value) pairs from a pcapng options area."""
+    pos = start
+    while pos + 4 <= stop:
+        code, length = struct.unpack_from(endian + 'HH', buf, pos)
+        pos += 4
+        if code == OPT_END:
+            break
+        yield code, bytes(buf[pos:pos + length])
+        pos += (length + 3) & ~3
+
+
+def _parse_interface(buf, offset, total_length, endian):
+    """Return (linktype, tsresol, tsoffset_us) for an Interface Description Block.
+
+    tsresol is ('dec', n) for 10^-n second units or ('bin', n) for 2^-n.
+    """
+    linktype, _reserved, _snaplen = struct.unpack_from(endian + 'HHI', buf, offset + 8)
+    tsresol = ('dec', 6)
+    tsoffset_us = 0
+    for code, value in _parse_options(buf, offset + 16, offset + total_length - 4, endian):
+        if code == OPT_IF_TSRESOL and value:
+            raw = value[0]
+            tsresol = ('bin', raw & 0x7F) if raw & 0x80 else ('dec', raw)
+        elif code == OPT_IF_TSOFFSET and len(value) >= 8:
+            tsoffset_us = struct.unpack(endian + 'q', value[:8])[0] * 1_000_000
+    return linktype, tsresol, tsoffset_us
+
+
+def _to_microseconds(units, tsresol):
+    kind, exponent = tsresol
+    if kind == 'bin':
+        return (units * 1_000_000) >> exponent
+    if exponent >= 6:
+        return units // 10 ** (exponent - 6)
+    return units * 10 ** (6 - exponent)
+
+
+def new_section_state():
+    """Fresh per-section reader state: byte order plus the interface table."""
+    return {'endian': '<', 'interfaces': []}
+
+
+class PcapngReader:
+    """Minimal, dependency-free pcapng reader.
+
+    Iterating yields a PacketRecord for every Enhanced (or obsolete) Packet
+    Block between ``start`` and ``end``. Timestamps are returned as integer
+    epoch microseconds. ``offset`` always points at the next unread block, so
+    it is a safe place to resume from; a truncated trailing block (a capture
+    that is still being written) simply ends the iteration there.
+
+    When starting mid-file, pass the section ``state`` that was in effect at
+    ``start`` (byte order and interfaces seen so far). The state dict is
+    replaced rather than mutated when a new block changes it, so a reference
+    taken at any point is a valid snapshot for resuming from ``offset``.
+    """
+
+    def __init__(self, path, start=0, end=None, state=None):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = self._file.seek(0, 2)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.size = size
+        self.end = size if end is None else min(end, size)
+        self.offset = start
+        self.state = state if state is not None else new_section_state()
+        if start == 0 and size >= 4 and struct.unpack_from('<I', self._map, 0)[0] != SECTION_HEADER_BLOCK:
+            self.close()
+            raise ValueError(f"{path} is not a pcapng file (use the pyshark engine for legacy pcap)")
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def blocks(self):
+        """Yield (offset, block_type, total_length) for every complete block."""
+        buf = self._map
+        while self.offset + 12 <= self.end:
+            offset = self.offset
+            endian = self.state['endian']
+            if struct.unpack_from('<I', buf, offset)[0] == SECTION_HEADER_BLOCK:
+                magic = struct.unpack_from('<I', buf, offset + 8)[0]
+                endian = '<' if magic == BYTE_ORDER_MAGIC else '>'
+            block_type, total_length = struct.unpack_from(endian + 'II', buf, offset)
+            if total_length < 12 or offset + total_length > self.end:
+                break
+            if block_type == SECTION_HEADER_BLOCK:
+                self.state = {'endian': endian, 'interfaces': []}
+            elif block_type == INTERFACE_DESCRIPTION_BLOCK:
+                interface = _parse_interface(buf, offset, total_length, endian)
+                self.state = {'endian': endian, 'interfaces': self.state['interfaces'] + [interface]}
+            self.offset = offset + total_length
+            yield offset, block_type, total_length
+
+    def __iter__(self):
+        buf = self._map
+        for offset, block_type, total_length in self.blocks():
+            endian = self.state['endian']
+            if block_type == ENHANCED_PACKET_BLOCK:
+                if_id, ts_high, ts_low, cap_len = struct.unpack_from(endian + 'IIII', buf, offset + 8)
+                data_start = offset + 28
+            elif block_type == OBSOLETE_PACKET_BLOCK:
+                if_id, _drops, ts_high, ts_low, cap_len = struct.unpack_from(endian + 'HHIII', buf, offset + 8)
+                data_start = offset + 28
+            else:
+                continue
+            interfaces = self.state['interfaces']
+            if if_id >= len(interfaces):
+                continue
+            linktype, tsresol, tsoffset_us = interfaces[if_id]
+            ts_us = _to_microseconds((ts_high << 32) | ts_low, tsresol) + tsoffset_us
+            yield PacketRecord(offset, self.offset, linktype, ts_us,
+                               bytes(buf[data_start:data_start + cap_len]))
+
+
+def split_chunks(path, chunk_bytes, start=0, state=None):
+    """Split a capture into block-aligned ranges of about chunk_bytes.
+
+    Returns (start, end, start_state, end_state) tuples. Chunks are only cut in
+    front of packet blocks, so start_state is the section/interface table in
+    effect at the chunk's first byte and end_state the one to resume with at
+    its end.
+    """
+    bounds = []
+    with PcapngReader(path, start=start, state=state) as reader:
+        chunk_start = reader.offset
+        chunk_state = reader.state
+        for offset, block_type, _total_length in reader.blocks():
+            if (offset - chunk_start >= chunk_bytes
+                    and block_type in (ENHANCED_PACKET_BLOCK, OBSOLETE_PACKET_BLOCK)):
+                bounds.append((chunk_start, offset, chunk_state))
+                chunk_start = offset
+                chunk_state = reader.state
+        if reader.offset > chunk_start:
+            bounds.append((chunk_start, reader.offset, chunk_state))
+        final_state = reader.state
+    end_states = [b[2] for b in bounds[1:]] + [final_state]
+    return [(s, e, st, end_state) for (s, e, st), end_state in zip(bounds, end_states)]
+
+
+def write_pcapng(path, packets, linktype):
+    """Write ``(ts_us, data)`` pairs as a single-interface pcapng file."""
+    def pad(data):
+        return data + b'\x00' * (-len(data) % 4)
+
+    with open(path, 'wb') as f:
+        shb_body = struct.pack('<IHHq', BYTE_ORDER_MAGIC, 1, 0, -1)
+        f.write(struct.pack('<II', SECTION_HEADER_BLOCK, 12 + len(shb_body)) + shb_body
+                + struct.pack('<I', 12 + len(shb_body)))
+        idb_body = struct.pack('<HHI', linktype, 0, 0)
+        f.write(struct.pack('<II', INTERFACE_DESCRIPTION_BLOCK, 12 + len(idb_body)) + idb_body
+                + struct.pack('<I', 12 + len(idb_body)))
+        for ts_us, data in packets:
+            body = struct.pack('<IIIII', 0, ts_us >> 32, ts_us & 0xFFFFFFFF, len(data), len(data)) + pad(data)
+            f.write(struct.pack('<II', ENHANCED_PACKET_BLOCK, 12 + len(body)) + body
+                    + struct.pack('<I', 12 + len(body)))
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+
+
+class Stage:
+    """One pipeline step.
+
+    ``run(values)`` receives the values of its ``shared`` dependencies as
+    {stage name: value}. ``deps`` must finish successfully first; stages
+    holding a common name in ``locks`` never run at the same time (pyplot's
+    global state, for instance). A ``shared`` stage only produces an
+    in-memory value (a loaded frame): it runs on first use by a dependent, so
+    it is skipped when every dependent is, and re-run whenever a selected
+    stage needs it.
+
+    ``inputs()`` returns what the result depends on besides the upstream
+    artifacts (database state, config values, script sources) as JSON values.
+    With it the stage is cached (see StageCache): it is skipped while these,
+    its dependencies' artifacts and its ``outputs`` files are unchanged. A
+    ``writes_db`` stage records its inputs as they are at the end of the
+    run, so the pipeline's own writes do not make it stale.
+    """
+
+    def __init__(self, name, run, deps=(), locks=(), shared=False, inputs=None, outputs=(), writes_db=False,
+                 description=''):
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.locks = frozenset(locks)
+        self.shared = shared
+        self.inputs = inputs
+        self.outputs = tuple(outputs)
+        self.writes_db = writes_db
+        self.description = description or name
+
+
+def check_stages(stages):
+    """Stages by name, in declaration order; every dependency must be declared before its dependents."""
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage: {stage.name}")
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on undeclared or later stage(s): {', '.join(missing)}")
+        by_name[stage.name] = stage
+    return by_name
+
+
+def select_stages(stages, names=None):
+    """The stages a run covers: ``names`` and everything downstream of them, plus the shared stages they read.
+
+    Without ``names`` every stage runs. Upstream stages that write files are
+    not re-run; their earlier outputs are used as they are.
+    """
+    by_name = check_stages(stages)
+    if not names:
+        return list(stages)
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)} (known: {', '.join(by_name)})")
+    selected = set(names)
+    for stage in stages:
+        if any(dep in selected for dep in stage.deps):
+            selected.add(stage.name)
+    for stage in reversed(stages):
+        if stage.name in selected:
+            selected.update(dep for dep in stage.deps if by_name[dep].shared)
+    return [stage for stage in stages if stage.name in selected]
+
+
+def file_digest(path, chunk_bytes=1 << 20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StageCache:
+    """Manifest (a JSON file) of the last successful run of every cached stage.
+
+    An entry keeps the stage's key (a digest of its inputs() and its
+    dependencies' artifacts), the size / mtime / SHA-256 of each output, and
+    the artifact digest its dependents build their keys from: the digest of
+    the output contents, or of the key for a stage without output files. A
+    stage is a hit when its key matches and every output still has the
+    recorded contents (re-hashed only when size or mtime moved), so a
+    dependent re-runs only when what it reads actually changed.
+    """
+
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.entries = json.load(f).get('stages', {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def artifact(self, name):
+        entry = self.entries.get(name)
+        return entry['artifact'] if entry else None
+
+    def key(self, stage, upstream):
+        return _digest({'inputs': stage.inputs(), 'upstream': upstream})
+
+    def hit(self, stage, key):
+        entry = self.entries.get(stage.name)
+        if self.force or entry is None or entry['key'] != key or sorted(entry['outputs']) != sorted(stage.outputs):
+            return False
+        for path, recorded in entry['outputs'].items():
+            if recorded is None:
+                if os.path.exists(path):
+                    return False
+                continue
+            if not os.path.exists(path):
+                return False
+            stat = os.stat(path)
+            if [stat.st_size, stat.st_mtime_ns] != recorded[:2] and file_digest(path) != recorded[2]:
+                return False
+        return True
+
+    def record(self, stage, key):
+        outputs = {}
+        for path in stage.outputs:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                outputs[path] = [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+            else:
+                outputs[path] = None
+        artifact = _digest({path: value and value[2] for path, value in outputs.items()}) if outputs else key
+        with self.lock:
+            self.entries[stage.name] = {'key': key, 'artifact': artifact, 'outputs': outputs,
+                                        'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            self._save()
+
+    def refresh(self, stage, upstream):
+        """Re-key a writes_db stage to the inputs at the end of the run (later stages' writes are the pipeline's own)."""
+        with self.lock:
+            entry = self.entries.get(stage.name)
+            if entry is not None:
+                entry['key'] = self.key(stage, upstream)
+                self._save()
+
+    def forget(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+class _Lazy:
+    """A shared stage's value, computed by the first dependent that asks for it."""
+
+    def __init__(self, stage, values, profiler=None):
+        self.stage = stage
+        self.values = values
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        self.done = False
+        self.value = self.error = self.seconds = self.metrics = None
+
+    def get(self):
+        with self.lock:
+            if not self.done:
+                started = time.perf_counter()
+                measured = None
+                try:
+                    values = _resolve(self.values)
+                    with _measure(self.profiler, self.stage) as measured:
+                        self.value = self.stage.run(values)
+                except Exception:
+                    self.error = traceback.format_exc()
+                self.seconds = time.perf_counter() - started
+                self.metrics = getattr(measured, 'metrics', None)
+                self.done = True
+                self.values = None
+        if self.error is not None:
+            raise RuntimeError(f"Shared stage {self.stage.name} failed:\n{self.error}")
+        return self.value
+
+
+def _resolve(values):
+    return {name: value.get() if isinstance(value, _Lazy) else value for name, value in values.items()}
+
+
+def _measure(profiler, stage):
+    """The profiler's context for one stage run (a no-op without a profiler)."""
+    return profiler.stage(stage) if profiler is not None else nullcontext()
+
+
+def run_pipeline(stages, workers=1, cache=None, log=print, profiler=None):
+    """Run ``stages`` (see select_stages) on a pool of ``workers`` threads, each as soon as its dependencies are done.
+
+    A failing stage does not stop the others: only the stages that depend on
+    it are skipped. With a StageCache, stages whose inputs are unchanged are
+    not run ('cached'). A shared value is released once its last dependent
+    has finished. With a ``profiler`` (see profile_utils.PipelineProfiler)
+    every stage that actually runs is measured. Returns {name: {'status':
+    'ok' | 'cached' | 'failed' | 'skipped' | 'unused', 'seconds', 'error',
+    'metrics'}} in declaration order.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    results = {stage.name: {'status': None, 'seconds': None, 'error': None, 'metrics': None} for stage in stages}
+    values = {}
+    lazies = {}
+    consumers = {stage.name: {other.name for other in stages if stage.name in other.deps} for stage in stages}
+    pending = list(stages)
+    running = {}
+    held = set()
+
+    def finish(stage):
+        for dep in stage.deps:
+            if dep in consumers:
+                consumers[dep].discard(stage.name)
+                if not consumers[dep]:
+                    values.pop(dep, None)
+
+    def upstream(stage):
+        """Artifact digests of the dependencies (through shared stages); None when one is unknown."""
+        artifacts = {}
+        for dep in stage.deps:
+            dep_stage = by_name.get(dep)
+            artifact = upstream(dep_stage) if dep_stage is not None and dep_stage.shared else cache.artifact(dep)
+            if artifact is None:
+                return None
+            artifacts[dep] = artifact
+        return artifacts
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while pending or running:
+            for stage in list(pending):
+                # Dependencies outside this run were produced by an earlier one
+                states = [results[dep]['status'] for dep in stage.deps if dep in by_name]
+                blocked = [dep for dep in stage.deps if dep in by_name and results[dep]['status'] in ('failed', 'skipped')]
+                if blocked:
+                    pending.remove(stage)
+                    results[stage.name].update(status='skipped', error=f"{', '.join(blocked)} did not complete")
+                    log(f"⏭️ {stage.description} atlandı ({', '.join(blocked)} tamamlanamadı).")
+                    finish(stage)
+                elif not all(state in ('ok', 'cached', 'deferred') for state in states):
+                    continue
+                elif stage.shared:
+                    pending.remove(stage)
+                    lazies[stage.name] = values[stage.name] = _Lazy(
+                        stage, {dep: values[dep] for dep in stage.deps if dep in values}, profiler)
+                    results[stage.name]['status'] = 'deferred'
+                elif not stage.locks & held and len(running) < max(1, workers):
+                    pending.remove(stage)
+                    held |= stage.locks
+                    stage_values = {dep: values[dep] for dep in stage.deps if dep in values}
+                    cached = cache is not None and stage.inputs is not None
+                    running[pool.submit(_execute, stage, stage_values, cache if cached else None,
+                                        upstream(stage) if cached else None, log, profiler)] = stage
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Stages cannot start: {', '.join(stage.name for stage in pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                held -= stage.locks
+                status, seconds, error, metrics = future.result()
+                results[stage.name].update(status=status, seconds=seconds, error=error, metrics=metrics)
+                if status == 'ok':
+                    log(f"✅ {stage.description} tamamlandı ({seconds:.1f} s).")
+                elif status == 'cached':
+                    log(f"♻️ {stage.description}: girdiler değişmedi, önceki çıktılar kullanılıyor.")
+                else:
+                    log(f"❌ {stage.description} başarısız oldu ({seconds:.1f} s):\n{error}")
+                finish(stage)
+
+    if cache is not None:
+        for stage in stages:
+            if stage.writes_db and stage.inputs is not None and results[stage.name]['status'] == 'ok':
+                cache.refresh(stage, upstream(stage))
+    for name, lazy in lazies.items():
+        if not lazy.done:
+            results[name]['status'] = 'unused'
+        else:
+            results[name].update(status='failed' if lazy.error else 'ok', seconds=lazy.seconds, error=lazy.error,
+                                 metrics=lazy.metrics)
+    return results
+
+
+def _execute(stage, values, cache, upstream, log, profiler=None):
+    """Run one stage unless the cache has it: (status, seconds, formatted traceback or None, metrics or None).
+
+    A non-zero SystemExit from a script's main() is a failure. The metrics
+    cover the stage's own run, not the shared values it had computed first.
+    """
+    started = time.perf_counter()
+    measured = None
+    try:
+        key = None
+        if cache is not None:
+            key = cache.key(stage, upstream)
+            if upstream is not None and cache.hit(stage, key):
+                return 'cached', time.perf_counter() - started, None, None
+        log(f"▶️ {stage.description} çalıştırılıyor...")
+        resolved = _resolve(values)
+        try:
+            with _measure(profiler, stage) as measured:
+                stage.run(resolved)
+        except SystemExit as exc:
+            if exc.code not in (None, 0):
+                raise
+        if cache is not None:
+            if stage.writes_db:
+                key = cache.key(stage, upstream)
+            if upstream is not None:
+                cache.record(stage, key)
+            else:
+                cache.forget(stage.name)
+    except (Exception, SystemExit):
+        if cache is not None:
+            cache.forget(stage.name)
+        return 'failed', time.perf_counter() - started, traceback.format_exc(), getattr(measured, 'metrics', None)
+    return 'ok', time.perf_counter() - started, None, getattr(measured, 'metrics', None)
@@ -0,0 +1,245 @@
+import cProfile
+import json
+import os
+import resource
+import sqlite3
+import threading
+import time
+from utils.db_utils import connect, packet_table
+
+_PAGE_BYTES = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_counters = threading.local()
+
+
+def count_rows_read(rows):
+    """Add ``rows`` to the calling thread's count of rows loaded from the database (see StageProfile.rows_in)."""
+    _counters.rows_read = getattr(_counters, 'rows_read', 0) + rows
+
+
+def counted_rows(rows):
+    """Iterate ``rows`` (a cursor streaming its result) and add how many it yielded to count_rows_read."""
+    count = 0
+    try:
+        for count, row in enumerate(rows, 1):
+            yield row
+    finally:
+        count_rows_read(count)
+
+
+def rows_read():
+    return getattr(_counters, 'rows_read', 0)
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None where /proc is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_BYTES
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def thread_io():
+    """I/O counters of the calling thread from /proc (Linux): storage bytes and read()/write() bytes."""
+    try:
+        with open(f'/proc/self/task/{threading.get_native_id()}/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines() if ': ' in line)
+    except OSError:
+        return None
+    return {name: int(fields[name]) for name in ('read_bytes', 'write_bytes', 'rchar', 'wchar') if name in fields}
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def database_marks(db_path):
+    """Max rowid of the packet and UUID tables and the database + WAL file size: cheap before / after marks.
+
+    Unlike database_state there is no COUNT(*), so taking them around every
+    stage costs nothing on a large database.
+    """
+    marks = {'packets': 0, 'uuids': 0,
+             'file_bytes': sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))}
+    if not os.path.exists(db_path):
+        return marks
+    try:
+        conn = connect(db_path)
+    except sqlite3.Error:
+        return marks
+    try:
+        cursor = conn.cursor()
+        for name, table in (('packets', packet_table(cursor)), ('uuids', 'BLEPacketUUID')):
+            marks[name] = cursor.execute(f'SELECT MAX(rowid) FROM {table}').fetchone()[0] or 0
+    except sqlite3.Error:
+        pass
+    finally:
+        conn.close()
+    return marks
+
+
+def csv_rows(path):
+    """Data rows of a CSV file (lines after the header)."""
+    lines = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            lines += chunk.count(b'\n')
+    return max(lines - 1, 0)
+
+
+class RssSampler:
+    """Samples the process RSS every ``interval`` seconds and keeps the peak seen while each stage runs.
+
+    Stages share one process, so a peak includes whatever ran alongside
+    (run with --workers 1 for per-stage peaks).
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peaks = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name='rss-sampler', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is None:
+            return
+        with self.lock:
+            for name, peak in self.peaks.items():
+                if rss > peak:
+                    self.peaks[name] = rss
+
+    def begin(self, name):
+        with self.lock:
+            self.peaks[name] = current_rss() or 0
+
+    def end(self, name):
+        self._sample()
+        with self.lock:
+            peak = self.peaks.pop(name, 0)
+        return peak or None
+
+
+class StageProfile:
+    """Wall / CPU time, peak RSS, rows and I/O of one stage run, measured in the thread that runs it.
+
+    cpu_sec is the thread's CPU time plus that of the child processes reaped
+    meanwhile (the ingest decoders). rows_in counts the rows the stage fetched
+    from the database (read_packet_frame, or count_rows_read / counted_rows
+    around its cursor reads; single-value lookups such as COUNT(*) aside)
+    plus those of the shared frames handed to it, rows_out the data rows of the stage's
+    CSV outputs plus the packets it added to the database. io holds the
+    thread's /proc counters: read_bytes / write_bytes reached the storage
+    layer, rchar / wchar went through read() / write() (SQLite pages read
+    through mmap appear in neither). With ``profile_path`` the stage runs
+    under cProfile and the stats are dumped there.
+    """
+
+    def __init__(self, name, sampler=None, db_path=None, outputs=(), profile_path=None):
+        self.name = name
+        self.sampler = sampler
+        self.db_path = db_path
+        self.outputs = outputs
+        self.profile_path = profile_path
+        self.metrics = None
+
+    def __enter__(self):
+        self._db = database_marks(self.db_path) if self.db_path else None
+        self._io = thread_io()
+        self._rows = rows_read()
+        if self.sampler is not None:
+            self.sampler.begin(self.name)
+        self._children = children_cpu()
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        self._profiler = None
+        if self.profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is not None:
+            self._profiler.disable()
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu + children_cpu() - self._children
+        peak = self.sampler.end(self.name) if self.sampler is not None else None
+        if peak is None:
+            # Without /proc only the lifetime peak of the process is known (ru_maxrss is in KiB on Linux)
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        io = thread_io()
+        db = None
+        if self._db is not None:
+            after = database_marks(self.db_path)
+            db = {'packets_added': after['packets'] - self._db['packets'],
+                  'uuids_added': after['uuids'] - self._db['uuids'],
+                  'file_growth_bytes': after['file_bytes'] - self._db['file_bytes']}
+        csv_out = sum(csv_rows(path) for path in self.outputs if path.endswith('.csv') and os.path.exists(path))
+        self.metrics = {
+            'wall_sec': round(wall, 3),
+            'cpu_sec': round(cpu, 3),
+            'peak_rss_mb': round(peak / 2**20, 1),
+            'rows_in': rows_read() - self._rows,
+            'rows_out': csv_out + max(db['packets_added'], 0) if db else csv_out,
+            'io': {name: value - self._io.get(name, 0) for name, value in io.items()} if io and self._io else None,
+            'db': db,
+            'profile': None,
+        }
+        if self._profiler is not None:
+            os.makedirs(os.path.dirname(self.profile_path) or '.', exist_ok=True)
+            self._profiler.dump_stats(self.profile_path)
+            self.metrics['profile'] = self.profile_path
+        return False
+
+
+class PipelineProfiler:
+    """Hands run_pipeline a StageProfile per stage run and owns the RSS sampler they share.
+
+    With ``profile_dir`` every stage is also run under cProfile, its stats
+    written to <profile_dir>/<stage>.prof (python -m pstats <file>, or
+    snakeviz); run the stages one at a time then, as only one cProfile may
+    be enabled at once.
+    """
+
+    def __init__(self, db_path=None, profile_dir=None, interval=0.05):
+        self.db_path = db_path
+        self.profile_dir = profile_dir
+        self.sampler = RssSampler(interval)
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.sampler.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.sampler.__exit__(*exc)
+
+    def stage(self, stage):
+        profile_path = os.path.join(self.profile_dir, f'{stage.name}.prof') if self.profile_dir else None
+        return StageProfile(stage.name, self.sampler, self.db_path, stage.outputs, profile_path)
+
+
+def write_report(path, results, **details):
+    """Write the run's stage results (with their metrics) as JSON: ``details`` first, then 'stages'."""
+    report = {**details, 'stages': results}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    os.replace(temporary, path)
+    return report
@@ -0,0 +1,148 @@
+import heapq
+import math
+from bisect import bisect_right
+from config import REPLAY_TIME_WINDOW_SEC, REPLAY_REORDER_SEC
+
+
+class StreamingReplayDetector:
+    """Online replay detection over content fingerprints, one packet at a time.
+
+    Per fingerprint it keeps the sightings of the last window plus a reorder
+    horizon (REPLAY_REORDER_SEC), sorted by time, so a packet that arrives out
+    of time order is compared with both of its neighbours. The alert of a
+    fingerprint is its first sighting less than the window after the previous
+    one, as in the batch scan of replayAttack.py; observe() reports it each
+    time it moves earlier. Once a fingerprint's sightings expire, a later pair
+    may be reported again: ReplayAlerts keeps the earliest across batches and
+    runs. A packet more than the horizon older than the newest one may have
+    lost its predecessor to eviction, so its fingerprint is added to
+    ``recheck`` for an exact pass over the database (recheck_replay_alerts).
+    """
+
+    def __init__(self, window_sec=REPLAY_TIME_WINDOW_SEC, reorder_sec=REPLAY_REORDER_SEC):
+        self.window_us = int(window_sec * 1_000_000)
+        self.reorder_us = int(reorder_sec * 1_000_000)
+        self.sightings = {}  # fingerprint -> [sorted timestamps, their details, repeated_at of the alert so far]
+        self.expiry = []     # heap of (timestamp_us, fingerprint), one per kept sighting
+        self.newest = None
+        self.recheck = set()
+
+    def __len__(self):
+        return len(self.sightings)
+
+    def _evict(self):
+        cutoff = self.newest - self.window_us - self.reorder_us
+        expiry, sightings = self.expiry, self.sightings
+        while expiry and expiry[0][0] <= cutoff:
+            _, fingerprint = heapq.heappop(expiry)
+            entry = sightings.get(fingerprint)
+            if entry is None:
+                continue
+            drop = bisect_right(entry[0], cutoff)
+            if drop == len(entry[0]):
+                del sightings[fingerprint]
+            elif drop:
+                del entry[0][:drop], entry[1][:drop]
+
+    def _insert(self, fingerprint, timestamp_us, details):
+        entry = self.sightings.get(fingerprint)
+        if entry is None:
+            entry = self.sightings[fingerprint] = [[], [], None]
+        # After equal timestamps: ties stay in arrival (id) order, like the batch sort
+        i = bisect_right(entry[0], timestamp_us)
+        entry[0].insert(i, timestamp_us)
+        entry[1].insert(i, details)
+        heapq.heappush(self.expiry, (timestamp_us, fingerprint))
+        return entry, i
+
+    def observe(self, fingerprint, timestamp_us, details=None):
+        """Record one packet with the ``details`` to report if it is the repeat.
+
+        Returns (first_seen_us, repeated_at_us, details of the repeating packet)
+        when the packet moves its fingerprint's alert earlier, else None.
+        """
+        if fingerprint is None or timestamp_us is None:
+            return None
+        if self.newest is None or timestamp_us > self.newest:
+            self.newest = timestamp_us
+            self._evict()
+        elif timestamp_us < self.newest - self.reorder_us:
+            self.recheck.add(fingerprint)
+            if timestamp_us <= self.newest - self.window_us - self.reorder_us:
+                return None
+
+        entry, i = self._insert(fingerprint, timestamp_us, details)
+        times, packets, best = entry
+        # Every sighting between a kept one and this packet is kept too, so both neighbours are the true ones
+        alert = None
+        if i > 0 and timestamp_us - times[i - 1] < self.window_us:
+            alert = (times[i - 1], timestamp_us, details)
+        elif i + 1 < len(times) and times[i + 1] - timestamp_us < self.window_us:
+            alert = (timestamp_us, times[i + 1], packets[i + 1])
+        if alert is None or (best is not None and alert[1] >= best):
+            return None
+        entry[2] = alert[1]
+        return alert
+
+    def seed(self, rows):
+        """Prime the state with (fingerprint, timestamp_us, details) rows already stored, in time order.
+
+        Their alerts are already in ReplayAlerts, so none are reported.
+        """
+        for fingerprint, timestamp_us, details in rows:
+            if fingerprint is None or timestamp_us is None:
+                continue
+            if self.newest is None or timestamp_us > self.newest:
+                self.newest = timestamp_us
+            self._insert(fingerprint, timestamp_us, details)
+        if self.newest is not None:
+            self._evict()
+
+
+class TimeSlicedBloomFilter:
+    """Fixed-memory "seen recently?" test: one Bloom filter per window-wide time slice.
+
+    An item added at time t goes into slice t // window. A query checks the
+    current and the previous slice, which together cover everything seen in
+    the last window (plus up to one window more; callers confirm candidates).
+    Each slice is sized for ``capacity`` items at half of ``fp_rate``, so a
+    two-slice query stays near ``fp_rate``; more items only raise that rate.
+    """
+
+    def __init__(self, window_us, capacity, fp_rate):
+        self.window_us = window_us
+        self.bits = max(8, math.ceil(-capacity * math.log(fp_rate / 2) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.slices = {}  # slice number -> bytearray
+
+    @property
+    def nbytes(self):
+        return len(self.slices) * ((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing over the two halves of the 64-bit fingerprint
+        h1 = item & 0xFFFFFFFF
+        h2 = (item >> 32) & 0xFFFFFFFF | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _slice(self, number):
+        bits = self.slices.get(number)
+        if bits is None:
+            for old in [n for n in self.slices if n < number - 1]:
+                del self.slices[old]
+            bits = self.slices[number] = bytearray((self.bits + 7) // 8)
+        return bits
+
+    def check_and_add(self, item, timestamp_us):
+        """True when ``item`` may have been added within the last window; then adds it."""
+        number = timestamp_us // self.window_us
+        positions = self._positions(item)
+        seen = False
+        for candidate in (self.slices.get(number), self.slices.get(number - 1)):
+            if candidate is not None and all(candidate[p >> 3] & (1 << (p & 7)) for p in positions):
+                seen = True
+                break
+        current = self._slice(number)
+        for p in positions:
+            current[p >> 3] |= 1 << (p & 7)
+        return seen
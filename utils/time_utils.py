@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+# Every UTC offset change falls on a quarter hour, so one offset holds for a whole bucket
+OFFSET_BUCKET_US = 15 * 60 * 1_000_000
+
+
+def timestamp_us_to_datetime(values):
+    """BLEPacket.timestamp_us integers -> datetime64[us] with no string parsing; NULL becomes NaT.
+
+    The values are naive UTC instants, so the analyzers' orderings and time
+    differences hold across DST changes; see local_time for display.
+    """
+    values = pd.Series(values)
+    if values.dtype == 'int64':
+        return values.astype('datetime64[us]')
+    return pd.to_datetime(values, unit='us').astype('datetime64[us]')
+
+
+def utc_offset_us(timestamp_us):
+    """The local clock's offset from UTC at a UTC epoch microsecond value, in microseconds."""
+    moment = datetime.fromtimestamp(timestamp_us // 1_000_000, timezone.utc).astimezone()
+    return moment.utcoffset() // moment.utcoffset().resolution
+
+
+def wall_clock_offset_us(wall_us):
+    """The local clock's offset from UTC at a naive local wall-clock microsecond count (a repeated hour: its first pass)."""
+    moment = (datetime(1970, 1, 1) + timedelta(microseconds=wall_us)).astimezone()
+    return moment.utcoffset() // moment.utcoffset().resolution
+
+
+def local_time(values):
+    """Naive UTC datetime64 values -> the local wall-clock time, for CSVs and plots; NaT stays NaT.
+
+    The offset is looked up once per quarter hour present, not per value. The
+    result repeats an hour at the end of DST, so only compute on the UTC values.
+    """
+    values = pd.Series(values).astype('datetime64[us]')
+    us = values.to_numpy().view('int64').copy()
+    valid = ~np.isnat(values.to_numpy())
+    codes, buckets = pd.factorize(us[valid] // OFFSET_BUCKET_US)
+    offsets = np.array([utc_offset_us(int(bucket) * OFFSET_BUCKET_US) for bucket in buckets], dtype='int64')
+    us[valid] += offsets[codes]
+    return pd.Series(us.view('datetime64[us]'), index=values.index, name=values.name)
+
+
+def with_local_time(frame, columns):
+    """A copy of frame with the given datetime64 columns (those present) shown in local time."""
+    frame = frame.copy()
+    for column in columns:
+        if column in frame.columns and pd.api.types.is_datetime64_dtype(frame[column]):
+            frame[column] = local_time(frame[column])
+    return frame
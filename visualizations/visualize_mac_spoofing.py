@@ -8,7 +8,6 @@ macSpoof.py analiz sonuçlarını görselleştiren script
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import sqlite3
 import numpy as np
 from datetime import datetime
 import warnings
@@ -16,6 +15,9 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from config import DB_PATH, FOTOS_DIR, DOCS_DIR
+from utils.db_utils import connect
+from utils.frame_utils import read_packet_frame, read_device_stats
+from utils.time_utils import local_time
 from matplotlib.dates import DateFormatter, HourLocator
 
 
@@ -31,6 +33,7 @@ class MacSpoofingVisualizer:
         self.docs_path = docs_path+'/'
         self.png_path = png_path+'/'
         self.raw_data = None
+        self.device_stats = None
         self.fingerprint_changes = None
         self.alerts = None
         self.top_uuids = None
@@ -51,11 +54,11 @@ class MacSpoofingVisualizer:
         print("📊 MAC Spoofing analiz verileri yükleniyor...")
         
         # Ana veriyi veritabanından yükle
-        conn = sqlite3.connect(self.db_path)
-        self.raw_data = pd.read_sql_query("""
+        conn = connect(self.db_path)
+        self.raw_data = read_packet_frame(conn, """
             SELECT 
                 BLEPacket.id,
-                BLEPacket.timestamp,
+                BLEPacket.timestamp_us AS timestamp,
                 BLEPacket.dmac,
                 BLEPacket.smac,
                 BLEPacket.company_id,
@@ -64,12 +67,12 @@ class MacSpoofingVisualizer:
                 BLEPacketUUID.uuid
             FROM BLEPacket
             LEFT JOIN BLEPacketUUID ON BLEPacket.id = BLEPacketUUID.ble_packet_id
-        """, conn)
+        """)
+        self.raw_data['timestamp'] = local_time(self.raw_data['timestamp'])
+        # Cihaz sayısı DeviceStats tablosundan (güncel değilse None)
+        self.device_stats = read_device_stats(conn)
         conn.close()
         
-        # Timestamp dönüşümü
-        self.raw_data['timestamp'] = pd.to_datetime(self.raw_data['timestamp'], errors='coerce')
-        
         # CSV dosyalarını yükle
         try:
             fingerprint_file = os.path.join(self.docs_path, "Fingerprint_Change_Events.csv")
@@ -330,7 +333,8 @@ DMAC Anomali: {dmac_anomalies_str}
             summary = {
                 '🔍 MAC SPOOFING ANALİZ ÖZETİ': {
                     'Toplam BLE Paketi': len(self.raw_data) if self.raw_data is not None else 'N/A',
-                    'Unique MAC Adresi': self.raw_data['smac'].nunique() if self.raw_data is not None else 'N/A',
+                    'Unique MAC Adresi': (len(self.device_stats) if self.device_stats is not None
+                                          else self.raw_data['smac'].nunique() if self.raw_data is not None else 'N/A'),
                     'Fingerprint Değişiklikleri': len(self.fingerprint_changes) if self.fingerprint_changes is not None else 'N/A',
                     'Anomalili MAC Sayısı': len(self.alerts) if self.alerts is not None else 'N/A',
                     'Analiz Tarihi': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
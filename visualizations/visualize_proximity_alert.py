@@ -8,7 +8,6 @@ proximityAlert.py analiz sonuçlarını görselleştiren script
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import sqlite3
 import numpy as np
 from datetime import datetime, timedelta
 import warnings
@@ -16,6 +15,9 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from config import DB_PATH, DOCS_DIR, FOTOS_DIR
+from utils.db_utils import connect
+from utils.frame_utils import read_packet_frame
+from utils.time_utils import local_time
 
 
 warnings.filterwarnings('ignore')
@@ -24,10 +26,12 @@ warnings.filterwarnings('ignore')
 plt.rcParams['font.family'] = ['DejaVu Sans']
 
 class ProximityAlertVisualizer:
-    def __init__(self, db_path=DB_PATH, docs_path=DOCS_DIR,png_path=FOTOS_DIR):
+    def __init__(self, db_path=DB_PATH, docs_path=DOCS_DIR,png_path=FOTOS_DIR, packets=None):
         self.db_path = db_path
         self.docs_path = docs_path+'/'
         self.png_path = png_path+'/'
+        # Pipeline'da paylaşılan read_plot_packets çerçevesi verilirse veritabanı tekrar okunmaz
+        self.shared_packets = packets
         self.raw_distance_data = None
         self.proximity_alerts = None
         
@@ -46,18 +50,20 @@ class ProximityAlertVisualizer:
         print("📊 Proximity Alert analiz verileri yükleniyor...")
         
         # Ana mesafe verilerini veritabanından yükle
-        conn = sqlite3.connect(self.db_path)
-        self.raw_distance_data = pd.read_sql_query("""
-            SELECT timestamp, smac, dmac, distance, rssi
-            FROM BLEPacket
-            WHERE distance IS NOT NULL
-            ORDER BY smac, timestamp
-        """, conn)
-        conn.close()
-        
-        # Timestamp dönüşümü
-        self.raw_distance_data['timestamp'] = pd.to_datetime(self.raw_distance_data['timestamp'], format='mixed', errors='coerce')
-        self.raw_distance_data['smac'] = self.raw_distance_data['smac'].str.lower()
+        if self.shared_packets is not None:
+            packets = self.shared_packets[['timestamp', 'smac', 'dmac', 'distance', 'rssi']]
+            self.raw_distance_data = packets[packets['distance'].notna()].sort_values(
+                ['smac', 'timestamp'], kind='stable', ignore_index=True)
+        else:
+            conn = connect(self.db_path)
+            self.raw_distance_data = read_packet_frame(conn, """
+                SELECT timestamp_us AS timestamp, smac, dmac, distance, rssi
+                FROM BLEPacket
+                WHERE distance IS NOT NULL
+                ORDER BY smac, timestamp_us
+            """)
+            self.raw_distance_data['timestamp'] = local_time(self.raw_distance_data['timestamp'])
+            conn.close()
         
         print(f"✅ Ham mesafe verileri: {len(self.raw_distance_data)} kayıt")
         
@@ -70,6 +76,11 @@ class ProximityAlertVisualizer:
                     self.proximity_alerts['timestamp_1'] = pd.to_datetime(self.proximity_alerts['timestamp_1'])
                 if 'timestamp_2' in self.proximity_alerts.columns:
                     self.proximity_alerts['timestamp_2'] = pd.to_datetime(self.proximity_alerts['timestamp_2'])
+                # Episode satırları: her olayın en büyük sıçraması distance_diff olarak kullanılır
+                if 'peak_distance_diff' in self.proximity_alerts.columns:
+                    self.proximity_alerts['distance_diff'] = self.proximity_alerts['peak_distance_diff']
+                    for column in ('start', 'end'):
+                        self.proximity_alerts[column] = pd.to_datetime(self.proximity_alerts[column])
                 print(f"✅ Proximity alert'leri: {len(self.proximity_alerts)} kayıt")
             else:
                 print("⚠️ ProximityAnomalyAlerts.csv bulunamadı")
@@ -100,7 +111,7 @@ class ProximityAlertVisualizer:
             axes[0,0].legend()
             
             # 2. MAC adresi başına ortalama mesafe
-            mac_avg_distance = self.raw_distance_data.groupby('smac')['distance'].agg(['mean', 'std', 'count']).reset_index()
+            mac_avg_distance = self.raw_distance_data.groupby('smac', observed=True)['distance'].agg(['mean', 'std', 'count']).reset_index()
             mac_avg_distance = mac_avg_distance.sort_values('mean', ascending=False).head(15)
             
             y_pos = range(len(mac_avg_distance))
@@ -372,6 +383,10 @@ class ProximityAlertVisualizer:
                     summary['🚨 ANOMALİ İSTATİSTİKLERİ']['Maksimum Mesafe Sıçrama'] = f"{self.proximity_alerts['distance_diff'].max():.2f}m"
                     summary['🚨 ANOMALİ İSTATİSTİKLERİ']['Anomalili MAC Sayısı'] = self.proximity_alerts['smac'].nunique()
                 
+                if 'pair_count' in self.proximity_alerts.columns:
+                    summary['🚨 ANOMALİ İSTATİSTİKLERİ']['Anomalili Paket Çifti'] = int(self.proximity_alerts['pair_count'].sum())
+                    summary['🚨 ANOMALİ İSTATİSTİKLERİ']['Ortalama Olay Süresi'] = f"{self.proximity_alerts['duration_sec'].mean():.1f}s"
+                
                 if 'time_window_sec' in self.proximity_alerts.columns:
                     summary['🚨 ANOMALİ İSTATİSTİKLERİ']['Ortalama Zaman Penceresi'] = f"{self.proximity_alerts['time_window_sec'].mean():.1f}s"
             
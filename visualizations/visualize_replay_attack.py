@@ -8,7 +8,6 @@ replayAttack.py analiz sonuçlarını görselleştiren script
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import sqlite3
 import numpy as np
 from datetime import datetime, timedelta
 import warnings
@@ -16,6 +15,8 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from config import DB_PATH, DOCS_DIR,FOTOS_DIR, REPLAY_TIME_WINDOW_SEC
+from utils.db_utils import connect
+from utils.frame_utils import read_device_stats, read_plot_packets
 
 
 warnings.filterwarnings('ignore')
@@ -24,11 +25,14 @@ warnings.filterwarnings('ignore')
 plt.rcParams['font.family'] = ['DejaVu Sans']
 
 class ReplayAttackVisualizer:
-    def __init__(self, db_path=DB_PATH, docs_path=DOCS_DIR,png_path=FOTOS_DIR):
+    def __init__(self, db_path=DB_PATH, docs_path=DOCS_DIR,png_path=FOTOS_DIR, packets=None, device_stats=None):
         self.db_path = db_path
         self.docs_path = docs_path+'/'
         self.png_path = png_path+'/'
+        # Pipeline'da paylaşılan read_plot_packets çerçevesi verilirse veritabanı tekrar okunmaz
+        self.shared_packets = packets
         self.raw_packet_data = None
+        self.device_stats = device_stats
         self.replay_alerts = None
         self.time_window = REPLAY_TIME_WINDOW_SEC
         
@@ -47,16 +51,15 @@ class ReplayAttackVisualizer:
         print("📊 Replay Attack analiz verileri yükleniyor...")
         
         # Ana paket verilerini veritabanından yükle
-        conn = sqlite3.connect(self.db_path)
-        self.raw_packet_data = pd.read_sql_query("""
-            SELECT timestamp, dmac, smac, rssi, distance, packet_hash
-            FROM BLEPacket
-            ORDER BY timestamp
-        """, conn)
-        conn.close()
+        if self.shared_packets is not None:
+            self.raw_packet_data = self.shared_packets.copy(deep=False)
+        else:
+            conn = connect(self.db_path)
+            self.raw_packet_data = read_plot_packets(conn)
+            # Cihaz başına sayımlar DeviceStats tablosundan (güncel değilse None, paketlerden sayılır)
+            self.device_stats = read_device_stats(conn)
+            conn.close()
         
-        # Timestamp dönüşümü
-        self.raw_packet_data['timestamp'] = pd.to_datetime(self.raw_packet_data['timestamp'], format='mixed', errors='coerce')
         self.raw_packet_data.dropna(subset=['timestamp'], inplace=True)
         
         print(f"✅ Ham paket verileri: {len(self.raw_packet_data)} kayıt")
@@ -146,7 +149,10 @@ class ReplayAttackVisualizer:
             axes[1,0].grid(True, alpha=0.3)
             
             # 4. MAC adresi başına paket sayısı
-            mac_packet_counts = self.raw_packet_data['smac'].value_counts().head(10)
+            if self.device_stats is not None:
+                mac_packet_counts = self.device_stats.set_index('smac')['packet_count'].nlargest(10)
+            else:
+                mac_packet_counts = self.raw_packet_data['smac'].value_counts().head(10)
             axes[1,1].bar(range(len(mac_packet_counts)), mac_packet_counts.values, color=self.colors['info'])
             axes[1,1].set_xticks(range(len(mac_packet_counts)))
             axes[1,1].set_xticklabels([mac[:10] + '...' if len(mac) > 10 else mac 